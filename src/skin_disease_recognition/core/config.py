@@ -16,6 +16,50 @@ MODEL_DIR = PROJECT_ROOT / 'models'
 load_dotenv(PROJECT_ROOT / '.env')
 ACTIVE_MODEL = os.getenv('ACTIVE_MODEL_NAME')
 ACTIVE_DEVICE = os.getenv('ACTIVE_DEVICE')
+CASCADE_MODEL = os.getenv('CASCADE_MODEL_NAME')
+
+# Candidate model evaluated on sampled live traffic: 'shadow' or 'canary'
+CANDIDATE_MODEL = os.getenv('CANDIDATE_MODEL_NAME')
+CANDIDATE_MODE = os.getenv('CANDIDATE_MODE', 'shadow')
+CANDIDATE_FRACTION = float(os.getenv('CANDIDATE_FRACTION', '0.1'))
+CANDIDATE_DIR = Path(os.getenv('CANDIDATE_DIR', DATA_DIR / 'candidate'))
+
+SERVING_MODE = os.getenv('SERVING_MODE', 'single')
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+TORCH_NUM_THREADS = os.getenv('TORCH_NUM_THREADS')
+TORCH_NUM_INTEROP_THREADS = os.getenv('TORCH_NUM_INTEROP_THREADS')
+
+# Default deadline of predict requests, 0 disables it
+REQUEST_TIMEOUT_MS = float(os.getenv('REQUEST_TIMEOUT_MS', '0'))
+
+# Priority lanes: 0 workers runs inference inline in the request handler
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', '0'))
+SCHEDULER_RESERVED_INTERACTIVE = int(os.getenv('SCHEDULER_RESERVED_INTERACTIVE', '1'))
+SCHEDULER_MAX_BATCH = int(os.getenv('SCHEDULER_MAX_BATCH', '8'))
+INTERACTIVE_WEIGHT = int(os.getenv('INTERACTIVE_WEIGHT', '4'))
+BULK_WEIGHT = int(os.getenv('BULK_WEIGHT', '1'))
+
+# WebSocket frame streams: concurrent sessions and default prediction smoothing
+STREAM_MAX_SESSIONS = int(os.getenv('STREAM_MAX_SESSIONS', '64'))
+STREAM_SMOOTHING = float(os.getenv('STREAM_SMOOTHING', '0.6'))
+
+# gRPC service next to the HTTP app (0 = off), see serving/grpc_server.py
+GRPC_PORT = int(os.getenv('GRPC_PORT', '0'))
+GRPC_WORKERS = int(os.getenv('GRPC_WORKERS', '8'))
+GRPC_MAX_MESSAGE_MB = int(os.getenv('GRPC_MAX_MESSAGE_MB', '32'))
+
+# Drift monitoring compares the last MONITOR_WINDOW to 2x as many requests
+MONITOR_WINDOW = int(os.getenv('MONITOR_WINDOW', '10000'))
+
+JOBS_DIR = Path(os.getenv('JOBS_DIR', DATA_DIR / 'jobs'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '64'))
+# Seconds before a job batch claimed by a worker process counts as abandoned
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '600'))
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', DATA_DIR / 'profiles'))
+PROFILE_REQUESTS = int(os.getenv('PROFILE_REQUESTS', '0'))
 
 if __name__ == '__main__':
     print(f'Project root is: {PROJECT_ROOT}')
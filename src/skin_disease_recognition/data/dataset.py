@@ -1,4 +1,5 @@
 import cv2
+from torch import Tensor
 from torch.utils.data import Dataset
 from torchvision.datasets import ImageFolder
 
@@ -28,3 +29,20 @@ class SkinDataset(Dataset):
             image = augmented['image']
 
         return image, label
+
+
+class FeatureDataset(Dataset):
+    """Precomputed backbone features with the class metadata of SkinDataset."""
+
+    def __init__(self, features: Tensor, labels: Tensor, classes: list[str]):
+        super().__init__()
+        self.features = features
+        self.labels = labels
+        self.classes = classes
+        self.targets = labels.tolist()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return self.features[index], self.labels[index]
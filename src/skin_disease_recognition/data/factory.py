@@ -9,6 +9,11 @@ import torch
 from torch.utils.data import DataLoader, WeightedRandomSampler
 
 from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.data.samplers import (
+    DistributedWeightedSampler,
+    ShardSampler,
+)
+from skin_disease_recognition.utils.distributed import is_distributed
 
 
 def seed_worker(worker_id):
@@ -17,8 +22,9 @@ def seed_worker(worker_id):
     random.seed(worker_seed)
 
 
-def get_transforms(cfg: DictConfig, stage='train'):
-    image_size = cfg.model.image_size
+def get_transforms(cfg: DictConfig, stage='train', image_size: int | None = None):
+    if image_size is None:
+        image_size = cfg.model.image_size
     if stage == 'train':
         return A.Compose(
             [
@@ -45,44 +51,119 @@ def get_transforms(cfg: DictConfig, stage='train'):
     raise ValueError('Wrong stage has been specified')
 
 
-def make_loaders(cfg: DictConfig):
-    train_transform = get_transforms(cfg, 'train')
-    test_transform = get_transforms(cfg, 'test')
+def make_sampler(
+    targets, generator: torch.Generator
+) -> WeightedRandomSampler | DistributedWeightedSampler:
+    class_weights = 1.0 / np.bincount(targets)
+    sample_weights = class_weights[targets]
 
-    train_dataset = SkinDataset(
-        hydra.utils.to_absolute_path(cfg.data.train_path), train_transform
-    )
-    test_dataset = SkinDataset(
-        hydra.utils.to_absolute_path(cfg.data.test_path), test_transform
+    if is_distributed():
+        return DistributedWeightedSampler(
+            sample_weights.tolist(),
+            num_samples=len(targets),
+            seed=generator.initial_seed(),
+        )
+    return WeightedRandomSampler(
+        sample_weights.tolist(), num_samples=len(targets), generator=generator
     )
 
-    class_weights = 1.0 / np.bincount(train_dataset.targets)
-    sample_weights = class_weights[train_dataset.targets]
 
-    g = torch.Generator()
-    g.manual_seed(cfg.seed)
+def loader_kwargs(cfg: DictConfig) -> dict:
+    """Worker settings shared by every image DataLoader, see `tune_loader`."""
+    kwargs = {'num_workers': cfg.data.num_workers, 'pin_memory': True}
+    if cfg.data.num_workers > 0:
+        kwargs['persistent_workers'] = cfg.data.get('persistent_workers', False)
+        prefetch_factor = cfg.data.get('prefetch_factor')
+        if prefetch_factor is not None:
+            kwargs['prefetch_factor'] = prefetch_factor
+    return kwargs
 
-    sampler = WeightedRandomSampler(
-        sample_weights.tolist(), num_samples=len(train_dataset), generator=g
+
+def make_train_loader(
+    cfg: DictConfig, generator: torch.Generator, image_size: int | None = None
+) -> DataLoader:
+    train_transform = get_transforms(cfg, 'train', image_size)
+    train_dataset = SkinDataset(
+        hydra.utils.to_absolute_path(cfg.data.train_path), train_transform
     )
 
-    train_loader = DataLoader(
+    sampler = make_sampler(train_dataset.targets, generator)
+
+    return DataLoader(
         dataset=train_dataset,
         batch_size=cfg.data.batch_size,
-        num_workers=cfg.data.num_workers,
-        pin_memory=True,
         sampler=sampler,
         shuffle=False,
-        generator=g,
+        generator=generator,
         worker_init_fn=seed_worker,
+        **loader_kwargs(cfg),
+    )
+
+
+def make_test_loader(
+    cfg: DictConfig,
+    generator: torch.Generator,
+    shard: bool | None = None,
+    image_size: int | None = None,
+) -> DataLoader:
+    """`shard` defaults to sharding across processes when run under torchrun."""
+    if shard is None:
+        shard = is_distributed()
+    test_transform = get_transforms(cfg, 'test', image_size)
+    test_dataset = SkinDataset(
+        hydra.utils.to_absolute_path(cfg.data.test_path), test_transform
     )
-    test_loader = DataLoader(
+
+    return DataLoader(
         dataset=test_dataset,
         batch_size=cfg.data.batch_size,
-        num_workers=cfg.data.num_workers,
-        pin_memory=True,
-        generator=g,
+        sampler=ShardSampler(len(test_dataset)) if shard else None,
+        generator=generator,
         worker_init_fn=seed_worker,
+        **loader_kwargs(cfg),
     )
 
+
+def make_loaders(cfg: DictConfig, image_size: int | None = None):
+    """
+    `image_size` only changes the train resolution (see ProgressiveResizing);
+    the test set is always evaluated at cfg.model.image_size.
+
+    Under torchrun both loaders are sharded across processes.
+    """
+    g = torch.Generator()
+    g.manual_seed(cfg.seed)
+
+    train_loader = make_train_loader(cfg, g, image_size)
+    test_loader = make_test_loader(cfg, g)
+
     return train_loader, test_loader
+
+
+class ProgressiveResizing:
+    """
+    Train-resolution schedule: starts at `start_size` and grows linearly to
+    cfg.model.image_size over `ramp_epochs`, in multiples of `step` pixels.
+    A new train loader is built whenever the size changes.
+    """
+
+    def __init__(self, cfg: DictConfig, start_size: int, ramp_epochs: int, step: int):
+        self.cfg = cfg
+        self.start_size = start_size
+        self.target_size = cfg.model.image_size
+        self.ramp_epochs = ramp_epochs
+        self.step = step
+        self.generator = torch.Generator()
+        self.generator.manual_seed(cfg.seed)
+
+    def size_for_epoch(self, epoch: int) -> int:
+        if self.ramp_epochs <= 0 or epoch >= self.ramp_epochs:
+            return self.target_size
+        size = self.start_size + (self.target_size - self.start_size) * (
+            epoch / self.ramp_epochs
+        )
+        size = int(round(size / self.step) * self.step)
+        return min(max(size, self.start_size), self.target_size)
+
+    def make_loader(self, image_size: int) -> DataLoader:
+        return make_train_loader(self.cfg, self.generator, image_size)
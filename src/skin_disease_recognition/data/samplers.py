@@ -0,0 +1,63 @@
+import math
+
+import torch
+from torch.utils.data import Sampler
+
+from skin_disease_recognition.utils.distributed import get_rank, get_world_size
+
+
+class DistributedWeightedSampler(Sampler[int]):
+    """
+    `WeightedRandomSampler` split across processes: every rank draws the same
+    epoch-seeded sample of `num_samples` indices with replacement and keeps
+    every world_size-th one, so ranks see disjoint shards of one balanced
+    draw and run the same number of steps. Call `set_epoch` every epoch.
+    """
+
+    def __init__(
+        self,
+        weights: list[float],
+        num_samples: int,
+        seed: int = 0,
+        rank: int | None = None,
+        world_size: int | None = None,
+    ):
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+        self.num_samples = math.ceil(num_samples / self.world_size)
+        self.total_size = self.num_samples * self.world_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = torch.multinomial(
+            self.weights, self.total_size, replacement=True, generator=g
+        )
+        return iter(indices[self.rank :: self.world_size].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class ShardSampler(Sampler[int]):
+    """Every world_size-th index in order, without the padding of
+    DistributedSampler, so sharded evaluation counts each sample once."""
+
+    def __init__(
+        self, length: int, rank: int | None = None, world_size: int | None = None
+    ):
+        self.length = length
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+
+    def __iter__(self):
+        return iter(range(self.rank, self.length, self.world_size))
+
+    def __len__(self):
+        return len(range(self.rank, self.length, self.world_size))
@@ -0,0 +1,166 @@
+import argparse
+import itertools
+import logging
+from pathlib import Path
+import time
+
+from hydra import compose, initialize_config_dir
+from omegaconf import DictConfig, OmegaConf
+import pandas as pd
+import torch
+
+from skin_disease_recognition.core.config import PROJECT_ROOT
+from skin_disease_recognition.data.factory import make_train_loader
+from skin_disease_recognition.modeling.benchmark import synchronize
+from skin_disease_recognition.utils.resources import available_cpus
+
+logger = logging.getLogger(__name__)
+
+CONF_DIR = PROJECT_ROOT / 'conf'
+TUNED_DIR = CONF_DIR / 'loader'
+
+
+def tuned_config(model: str, directory: Path = TUNED_DIR) -> Path:
+    """Override for the `model` config, loaded by config.yaml as `loader`."""
+    return directory / f'{model}.yaml'
+
+
+def measure_loader(
+    cfg: DictConfig, device: str, num_batches: int, epochs: int = 2
+) -> float:
+    """
+    Images per second delivered to `device` by the train loader built from
+    `cfg`, over `epochs` passes of at most `num_batches` batches. Worker
+    start-up is included, so persistent workers pay off from the 2nd pass.
+    """
+    g = torch.Generator()
+    g.manual_seed(cfg.seed)
+    loader = make_train_loader(cfg, g)
+
+    num_images = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for i, (images, _) in enumerate(loader):
+            images.to(device, non_blocking=True)
+            num_images += len(images)
+            if i + 1 >= num_batches:
+                break
+    synchronize(device)
+    return num_images / (time.perf_counter() - start)
+
+
+def candidate_settings(
+    workers: list[int], prefetch_factors: list[int], persistent: list[bool]
+) -> list[dict]:
+    candidates = []
+    for num_workers in workers:
+        if num_workers == 0:
+            # Prefetching and persistence only apply to worker processes
+            candidates.append(
+                {
+                    'num_workers': 0,
+                    'prefetch_factor': None,
+                    'persistent_workers': False,
+                }
+            )
+            continue
+        for prefetch_factor, persistent_workers in itertools.product(
+            prefetch_factors, persistent
+        ):
+            candidates.append(
+                {
+                    'num_workers': num_workers,
+                    'prefetch_factor': prefetch_factor,
+                    'persistent_workers': persistent_workers,
+                }
+            )
+    return candidates
+
+
+def pick_best(results: pd.DataFrame, tolerance: float = 0.05) -> dict:
+    """
+    Fastest settings, preferring fewer workers among those within `tolerance`
+    of the best throughput.
+    """
+    threshold = results['images_per_sec'].max() * (1 - tolerance)
+    close = results[results['images_per_sec'] >= threshold]
+    best = close.sort_values(
+        ['num_workers', 'images_per_sec'], ascending=[True, False]
+    ).iloc[0]
+    return best.drop('images_per_sec').to_dict()
+
+
+def write_override(settings: dict, path: Path) -> Path:
+    """
+    Writes the worker `settings` as a Hydra override picked up by config.yaml.
+    The batch size is left to the model config: loader throughput says nothing
+    about whether a larger batch fits in memory or trains as well.
+    """
+    data = {
+        'num_workers': int(settings['num_workers']),
+        'prefetch_factor': (
+            None
+            if pd.isna(settings['prefetch_factor'])
+            else int(settings['prefetch_factor'])
+        ),
+        'persistent_workers': bool(settings['persistent_workers']),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('# @package _global_\n')
+        f.write('# Generated by tune_loader.py for this machine\n')
+        f.write(OmegaConf.to_yaml({'data': data}))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark DataLoader settings and write the fastest as a '
+        'config override'
+    )
+    cpus = available_cpus()
+    parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='+',
+        default=sorted({0, *(w for w in (2, 4, 8, 16) if w <= cpus)}),
+    )
+    parser.add_argument('--prefetch-factors', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--num-batches', type=int, default=50)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--output', type=Path, default=None)
+    parser.add_argument('overrides', nargs='*', help='Hydra overrides')
+    args = parser.parse_args()
+
+    overrides = list(args.overrides)
+    with initialize_config_dir(config_dir=str(CONF_DIR), version_base='1.2'):
+        cfg = compose(
+            config_name='config', overrides=overrides, return_hydra_config=True
+        )
+        model = cfg.hydra.runtime.choices.model
+        if tuned_config(model).exists():
+            # Tune from the untuned defaults, not a previous result
+            cfg = compose(config_name='config', overrides=['~loader', *overrides])
+    output = args.output or tuned_config(model)
+    device = args.device or cfg.device
+    if device == 'cuda' and not torch.cuda.is_available():
+        device = 'cpu'
+
+    rows = []
+    candidates = candidate_settings(args.workers, args.prefetch_factors, [False, True])
+    for settings in candidates:
+        run_cfg = OmegaConf.merge(cfg, {'data': settings})
+        images_per_sec = measure_loader(run_cfg, device, args.num_batches)
+        logger.info(f'{settings}: {images_per_sec:.1f} images/s')
+        rows.append({**settings, 'images_per_sec': images_per_sec})
+
+    results = pd.DataFrame(rows)
+    print(results.sort_values('images_per_sec', ascending=False).to_string(index=False))
+
+    best = pick_best(results)
+    path = write_override(best, output)
+    print(f'Best settings {best} written to {path}')
+
+
+if __name__ == '__main__':
+    main()
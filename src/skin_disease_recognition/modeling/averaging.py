@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from itertools import islice
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from skin_disease_recognition.utils.distributed import broadcast_from_main
+
+
+class AveragedWeights:
+    """
+    Running average of the parameters and floating point buffers of `model`,
+    kept as one flat list of tensors on the model's device and updated in
+    place with a single fused `torch._foreach_lerp_` call.
+
+    With `decay` it is an exponential moving average (EMA), warmed up as
+    min(decay, (1 + n) / (10 + n)) so early updates are not dominated by the
+    random initialization. Without it every update has equal weight (SWA).
+
+    `swap()` exchanges the live and averaged tensors by pointer, so the model
+    can be evaluated or saved with the averaged weights without a copy.
+    """
+
+    def __init__(self, model: nn.Module, decay: float | None = None):
+        self.model = model
+        self.decay = decay
+        self.num_updates = 0
+        state = list(model.named_parameters()) + [
+            (name, b) for name, b in model.named_buffers() if b.is_floating_point()
+        ]
+        self.names = [name for name, _ in state]
+        self.live = [t for _, t in state]
+        self.averaged = [t.detach().clone() for t in self.live]
+
+    def weight(self) -> float:
+        """Interpolation weight of the newest live weights."""
+        if self.decay is None:
+            return 1.0 / (self.num_updates + 1)
+        decay = min(self.decay, (1 + self.num_updates) / (10 + self.num_updates))
+        return 1.0 - decay
+
+    @torch.no_grad()
+    def update(self):
+        torch._foreach_lerp_(self.averaged, self.live, self.weight())
+        self.num_updates += 1
+
+    def _exchange(self):
+        for live, averaged in zip(self.live, self.averaged, strict=True):
+            live.data, averaged.data = averaged.data, live.data
+
+    @contextmanager
+    def swap(self):
+        self._exchange()
+        try:
+            yield self.model
+        finally:
+            self._exchange()
+
+
+@torch.no_grad()
+def recalibrate_batch_norm(
+    model: nn.Module, loader: DataLoader, device: str, num_batches: int | None = None
+) -> int:
+    """
+    Recomputes BatchNorm running statistics of `model` (e.g. after swapping
+    in averaged weights) as a cumulative average over the first
+    `num_batches` batches of `loader`. Returns the number of batches used.
+    """
+    bn_layers = [
+        m for m in model.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)
+    ]
+    if not bn_layers:
+        return 0
+
+    momenta = {}
+    for bn in bn_layers:
+        bn.reset_running_stats()
+        momenta[bn] = bn.momentum
+        bn.momentum = None
+
+    was_training = model.training
+    model.train()
+    used = 0
+    for images, _ in islice(loader, num_batches):
+        model(images.to(device))
+        used += 1
+    model.train(was_training)
+
+    for bn in bn_layers:
+        bn.momentum = momenta[bn]
+        # Ranks saw different batches, keep rank 0's statistics everywhere
+        broadcast_from_main([bn.running_mean, bn.running_var])
+    return used
@@ -0,0 +1,62 @@
+from collections.abc import Callable
+import resource
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+
+def synchronize(device: str | torch.device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def reset_peak_memory(device: str | torch.device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory_mb(device: str | torch.device) -> float:
+    """
+    Peak CUDA allocations since the last reset on a GPU. On CPU, the peak RSS
+    of the whole process, which cannot be reset.
+    """
+    if torch.device(device).type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_calls(
+    fn: Callable[[], object], device: str, warmup: int = 5, iters: int = 20
+) -> dict[str, float]:
+    """Wall time of `fn()` after `warmup` untimed calls, in milliseconds."""
+    timings = []
+    for i in range(warmup + iters):
+        synchronize(device)
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        if i >= warmup:
+            timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'latency_ms_mean': float(np.mean(timings)),
+        'latency_ms_p50': float(np.percentile(timings, 50)),
+        'latency_ms_p95': float(np.percentile(timings, 95)),
+    }
+
+
+def measure_latency(
+    model: nn.Module,
+    input_shape: tuple[int, ...],
+    device: str,
+    warmup: int = 5,
+    iters: int = 20,
+) -> dict[str, float]:
+    """Forward-pass latency of `model` on random input, in milliseconds."""
+    model.eval()
+    x = torch.randn(*input_shape, device=device)
+    with torch.no_grad():
+        return time_calls(lambda: model(x), device, warmup, iters)
@@ -0,0 +1,350 @@
+import argparse
+from collections.abc import Callable
+import copy
+from functools import partial
+import io
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import threading
+
+import hydra
+from omegaconf import OmegaConf
+import pandas as pd
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from skin_disease_recognition.core.config import MODEL_DIR, PROJECT_ROOT
+from skin_disease_recognition.modeling.benchmark import time_calls
+from skin_disease_recognition.utils.resources import available_cpus
+
+logger = logging.getLogger(__name__)
+
+CONF_DIR = PROJECT_ROOT / 'conf'
+BENCHMARK_DIR = PROJECT_ROOT / 'benchmarks'
+BACKENDS = ('eager', 'compiled', 'onnx', 'quantized')
+
+
+def current_rss_mb() -> float | None:
+    """Resident set size of this process, None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+class PeakMemory:
+    """
+    Peak memory while the block runs: CUDA allocations on a GPU, otherwise
+    the process RSS sampled by a background thread every `interval` seconds.
+    `peak_mb` is the absolute peak, `added_mb` the increase over the start.
+    """
+
+    def __init__(self, device: str, interval: float = 0.002):
+        self.cuda = torch.device(device).type == 'cuda'
+        self.interval = interval
+        self.peak_mb = self.added_mb = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+            self._start = torch.cuda.memory_allocated() / 2**20
+        else:
+            self._start = current_rss_mb()
+            if self._start is not None:
+                self.peak_mb = self._start
+                self._thread = threading.Thread(target=self._sample, daemon=True)
+                self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cuda:
+            self.peak_mb = torch.cuda.max_memory_allocated() / 2**20
+        elif self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+        if self.peak_mb is not None:
+            self.added_mb = self.peak_mb - self._start
+
+
+def config_specs(names: list[str]) -> list[dict]:
+    specs = []
+    for name in names:
+        model_cfg = OmegaConf.load(CONF_DIR / 'model' / f'{name}.yaml')
+        specs.append(
+            {
+                'name': name,
+                'source': 'config',
+                'model_name': model_cfg.model_name,
+                'image_size': model_cfg.image_size,
+            }
+        )
+    return specs
+
+
+def export_specs(folders: list[str]) -> list[dict]:
+    specs = []
+    for folder in folders:
+        with open(MODEL_DIR / folder / 'model_data.json') as f:
+            model_data = json.load(f)
+        specs.append(
+            {
+                'name': folder,
+                'source': 'export',
+                'model_name': model_data['model_name'],
+                'image_size': model_data['image_size'],
+            }
+        )
+    return specs
+
+
+def exported_f1(model_dir: Path = MODEL_DIR) -> tuple[dict, dict]:
+    """
+    Macro F1 from the metrics.json of every exported folder, by folder and,
+    for unmodified exports only, the best one per architecture model_name.
+    """
+    by_folder, by_model = {}, {}
+    for metrics_path in sorted(model_dir.glob('*/metrics.json')):
+        with open(metrics_path) as f:
+            f1 = json.load(f).get('f1-score')
+        by_folder[metrics_path.parent.name] = f1
+        data_path = metrics_path.parent / 'model_data.json'
+        if f1 is None or not data_path.exists():
+            continue
+        with open(data_path) as f:
+            model_data = json.load(f)
+        if 'pruning' in model_data or 'optimizations' in model_data:
+            continue
+        name = model_data['model_name']
+        by_model[name] = max(f1, by_model.get(name, f1))
+    return by_folder, by_model
+
+
+def load_model(spec: dict, device: str, num_classes: int) -> nn.Module:
+    if spec['source'] == 'export':
+        model = torch.load(
+            MODEL_DIR / spec['name'] / 'model.pth',
+            weights_only=False,
+            map_location=device,
+        )
+    else:
+        # Random weights time the same as trained ones and need no download
+        model_cfg = OmegaConf.load(CONF_DIR / 'model' / f'{spec["name"]}.yaml')
+        model = hydra.utils.instantiate(
+            model_cfg.estimator, weights=None, num_classes=num_classes
+        )
+    return model.to(device).eval()
+
+
+def quantize_static(
+    model: nn.Module, example: torch.Tensor, batches: int = 4
+) -> nn.Module:
+    """
+    Post-training static int8 quantization (FX graph mode) of the
+    convolutions and Linear layers for the CPU engine. Observers are
+    calibrated on random batches: the kernels time the same, but the
+    accuracy of the result is not that of a model calibrated on real images.
+    """
+    qconfig = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(model), qconfig, (example,))
+    for _ in range(batches):
+        prepared(torch.randn(8, *example.shape[1:]))
+    return convert_fx(prepared)
+
+
+def prepare_backend(
+    model: nn.Module, backend: str, example: torch.Tensor, device: str, threads: int
+) -> Callable[[torch.Tensor], object] | None:
+    """Forward function of `model` on `backend`, None when unavailable here."""
+    if backend == 'eager':
+        return model
+    if backend == 'compiled':
+        compiled = torch.compile(model)
+        # Compilation errors only surface on the first call
+        compiled(example)
+        return compiled
+    if backend == 'quantized':
+        if torch.device(device).type != 'cpu':
+            logger.warning('Quantized backend only runs on CPU, skipping')
+            return None
+        return quantize_static(model, example)
+    if backend == 'onnx':
+        try:
+            import onnxruntime
+        except ImportError:
+            logger.warning('onnxruntime is not installed, skipping the ONNX backend')
+            return None
+        exported = io.BytesIO()
+        torch.onnx.export(
+            model,
+            (example,),
+            exported,
+            input_names=['input'],
+            output_names=['logits'],
+            dynamic_axes={'input': {0: 'batch'}},
+        )
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        providers = ['CPUExecutionProvider']
+        if torch.device(device).type == 'cuda':
+            providers.insert(0, 'CUDAExecutionProvider')
+        session = onnxruntime.InferenceSession(
+            exported.getvalue(), options, providers=providers
+        )
+        return lambda x: session.run(None, {'input': x.cpu().numpy()})
+    raise ValueError(f'Unknown backend: {backend}')
+
+
+def benchmark_model(
+    spec: dict,
+    backends: list[str],
+    batch_sizes: list[int],
+    thread_counts: list[int],
+    device: str,
+    num_classes: int,
+    warmup: int = 3,
+    iters: int = 10,
+) -> list[dict]:
+    """Latency, throughput and peak memory of one model on every combination."""
+    model = load_model(spec, device, num_classes)
+    size = spec['image_size']
+    params = sum(p.numel() for p in model.parameters())
+    default_threads = torch.get_num_threads()
+    rows = []
+    for backend in backends:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            example = torch.randn(1, 3, size, size, device=device)
+            try:
+                with torch.no_grad():
+                    forward = prepare_backend(model, backend, example, device, threads)
+            except Exception as e:
+                logger.warning(f'{backend} failed for {spec["name"]}: {e}')
+                forward = None
+            if forward is None:
+                break
+            for batch_size in batch_sizes:
+                x = torch.randn(batch_size, 3, size, size, device=device)
+                with PeakMemory(device) as memory, torch.no_grad():
+                    timing = time_calls(partial(forward, x), device, warmup, iters)
+                rows.append(
+                    {
+                        'model': spec['name'],
+                        'source': spec['source'],
+                        'model_name': spec['model_name'],
+                        'params_m': params / 1e6,
+                        'backend': backend,
+                        'threads': threads,
+                        'batch_size': batch_size,
+                        **timing,
+                        'images_per_s': batch_size * 1000 / timing['latency_ms_mean'],
+                        'peak_memory_mb': memory.peak_mb,
+                        'forward_memory_mb': memory.added_mb,
+                    }
+                )
+                logger.info(
+                    f'{spec["name"]} {backend} threads={threads} '
+                    f'batch={batch_size}: {timing["latency_ms_mean"]:.1f} ms'
+                )
+    torch.set_num_threads(default_threads)
+    return rows
+
+
+def run_matrix(
+    specs: list[dict],
+    backends: list[str],
+    batch_sizes: list[int],
+    thread_counts: list[int],
+    device: str,
+    num_classes: int,
+    warmup: int = 3,
+    iters: int = 10,
+    isolate: bool = True,
+) -> pd.DataFrame:
+    """
+    Benchmarks every model and joins its macro F1 from the exported
+    metrics.json files. With `isolate`, each model runs in a fresh process
+    so that its peak memory does not include the previous models.
+    """
+    rows = []
+    for spec in specs:
+        args = (spec, backends, batch_sizes, thread_counts, device, num_classes)
+        kwargs = {'warmup': warmup, 'iters': iters}
+        if isolate:
+            ctx = multiprocessing.get_context('spawn')
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                rows += pool.apply(benchmark_model, args, kwargs)
+        else:
+            rows += benchmark_model(*args, **kwargs)
+
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return table
+    by_folder, by_model = exported_f1(MODEL_DIR)
+    table['f1_macro'] = [
+        # Quantized models are calibrated on random inputs, their F1 is unknown
+        None
+        if row.backend == 'quantized'
+        else by_folder.get(row.model)
+        if row.source == 'export'
+        else by_model.get(row.model_name)
+        for row in table.itertuples()
+    ]
+    return table.sort_values(['batch_size', 'threads', 'latency_ms_mean'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark model latency, throughput and memory against F1'
+    )
+    parser.add_argument(
+        '--models',
+        nargs='*',
+        default=sorted(p.stem for p in (CONF_DIR / 'model').glob('*.yaml')),
+        help='Configs under conf/model',
+    )
+    parser.add_argument(
+        '--exports', nargs='*', default=[], help='Exported folders under models/'
+    )
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument(
+        '--threads', nargs='+', type=int, default=sorted({1, available_cpus()})
+    )
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--output', type=Path, default=BENCHMARK_DIR / 'matrix.csv')
+    args = parser.parse_args()
+
+    cfg = OmegaConf.load(CONF_DIR / 'config.yaml')
+    table = run_matrix(
+        config_specs(args.models) + export_specs(args.exports),
+        list(args.backends),
+        args.batch_sizes,
+        args.threads,
+        args.device,
+        cfg.data.num_classes,
+        warmup=args.warmup,
+        iters=args.iters,
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output, index=False)
+    print(table.to_string(index=False, float_format='%.2f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+from collections.abc import Callable
+from contextlib import contextmanager, nullcontext
+import copy
+import logging
+
+from omegaconf import DictConfig
+import torch
+from torch import nn
+from torch.nn.functional import cross_entropy
+from torch.utils.checkpoint import checkpoint
+from torchvision.models.efficientnet import FusedMBConv, MBConv
+from torchvision.models.resnet import BasicBlock, Bottleneck
+
+from skin_disease_recognition.utils.distributed import is_distributed
+
+logger = logging.getLogger(__name__)
+
+BLOCK_TYPES = (MBConv, FusedMBConv, BasicBlock, Bottleneck)
+
+
+def residual_blocks(model: nn.Module) -> list[nn.Module]:
+    """EfficientNet MBConv and ResNet blocks of `model`, input side first."""
+    blocks = [module for module in model.modules() if isinstance(module, BLOCK_TYPES)]
+    if not blocks:
+        raise ValueError(f'Checkpointing {type(model).__name__} is not supported')
+    return blocks
+
+
+@contextmanager
+def frozen_running_stats(module: nn.Module):
+    """Stops BatchNorm running statistics and batch counts from updating."""
+    norms = [
+        m
+        for m in module.modules()
+        if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats
+    ]
+    saved = [(m.momentum, m.num_batches_tracked.clone()) for m in norms]
+    for m in norms:
+        # running = (1 - momentum) * running + momentum * batch
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, tracked) in zip(norms, saved, strict=True):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(tracked)
+
+
+class CheckpointedBlock(nn.Module):
+    """
+    Runs `block` under activation checkpointing while training: only its
+    input is kept for the backward pass, which runs the block again. The
+    recomputation leaves BatchNorm running statistics alone, so they are
+    updated once per step as without checkpointing.
+    """
+
+    def __init__(self, block: nn.Module):
+        super().__init__()
+        self.block = block
+
+    def _contexts(self):
+        return nullcontext(), frozen_running_stats(self.block)
+
+    def forward(self, x):
+        if self.training and torch.is_grad_enabled():
+            return checkpoint(
+                self.block, x, use_reentrant=False, context_fn=self._contexts
+            )
+        return self.block(x)
+
+
+def checkpointed_view(model: nn.Module, count: int) -> nn.Module:
+    """
+    Copy of the module tree of `model` with its first `count` residual blocks
+    (-1 for all) checkpointed. The copy shares every parameter and buffer, so
+    training it trains `model`, which stays free of wrappers for the export.
+    """
+    blocks = residual_blocks(model)
+    if count < 0:
+        count = len(blocks)
+    chosen = {id(block) for block in blocks[:count]}
+
+    def rebuild(module: nn.Module) -> nn.Module:
+        if id(module) in chosen:
+            return CheckpointedBlock(module)
+        children = {name: rebuild(child) for name, child in module._modules.items()}
+        if all(children[name] is child for name, child in module._modules.items()):
+            return module
+        view = copy.copy(module)
+        view._modules = children
+        return view
+
+    return rebuild(model)
+
+
+def measure_step_memory(
+    model: nn.Module,
+    count: int,
+    batch_size: int,
+    image_size: int,
+    num_classes: int,
+    device: str,
+) -> float:
+    """
+    Peak CUDA memory in MB of one forward and backward pass on random images
+    with `count` checkpointed blocks. BatchNorm statistics are restored after.
+    """
+    buffers = [b.detach().clone() for b in model.buffers()]
+    view = checkpointed_view(model, count).train()
+    images = torch.randn(batch_size, 3, image_size, image_size, device=device)
+    labels = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    model.zero_grad(set_to_none=True)
+    torch.cuda.empty_cache()
+    torch.cuda.reset_peak_memory_stats(device)
+    cross_entropy(view(images), labels).backward()
+    peak = torch.cuda.max_memory_allocated(device) / 2**20
+
+    model.zero_grad(set_to_none=True)
+    with torch.no_grad():
+        for buffer, saved in zip(model.buffers(), buffers, strict=True):
+            buffer.copy_(saved)
+    return peak
+
+
+def plan_checkpointing(
+    measure: Callable[[int, int], float],
+    num_blocks: int,
+    effective_batch: int,
+    budget_mb: float,
+    extra_mb: float = 0.0,
+    headroom: float = 0.0,
+    probes: tuple[int, int] = (2, 4),
+) -> dict:
+    """
+    Picks how many blocks to checkpoint and the micro-batch for a memory
+    budget. `measure(count, batch_size)` returns the peak MB of a training
+    step, which is extrapolated linearly in the batch size from `probes`;
+    `extra_mb` (state allocated outside the step, e.g. optimizer moments) is
+    added on top, and `headroom` is the fraction of the budget kept free.
+
+    The micro-batch is the largest divisor of `effective_batch` that fits, so
+    that `batch_size * accumulation_steps` stays the same. Checkpointing costs
+    recompute, so the fewest blocks reaching that micro-batch are chosen. The
+    extrapolation is then checked with a real step at the chosen micro-batch,
+    falling back to smaller divisors while it does not fit.
+    """
+    usable_mb = budget_mb * (1.0 - headroom)
+    divisors = [b for b in range(1, effective_batch + 1) if effective_batch % b == 0]
+    counts = sorted({round(num_blocks * i / 4) for i in range(5)})
+    estimates = {}
+    for count in counts:
+        small, large = (measure(count, b) for b in probes)
+        per_image = max(large - small, 0.0) / (probes[1] - probes[0])
+        fixed = small - per_image * probes[0] + extra_mb
+        estimates[count] = fixed, per_image
+        logger.info(
+            f'Checkpointing {count}/{num_blocks} blocks: {fixed:.0f} MB fixed, '
+            f'{per_image:.0f} MB per image'
+        )
+        if fixed + per_image * effective_batch <= usable_mb:
+            break
+
+    for batch_size in reversed(divisors):
+        fitting = [
+            count
+            for count, (fixed, per_image) in estimates.items()
+            if fixed + per_image * batch_size <= usable_mb
+        ]
+        if not fitting:
+            continue
+        count = min(fitting)
+        fixed, per_image = estimates[count]
+        measured = measure(count, batch_size) + extra_mb
+        logger.info(
+            f'Checkpointing {count}/{num_blocks} blocks at batch size '
+            f'{batch_size}: {measured:.0f} MB measured, '
+            f'{fixed + per_image * batch_size:.0f} MB predicted'
+        )
+        if measured <= usable_mb:
+            return {
+                'blocks': count,
+                'batch_size': batch_size,
+                'accumulation_steps': effective_batch // batch_size,
+                'predicted_mb': fixed + per_image * batch_size,
+                'measured_mb': measured,
+            }
+    raise ValueError(f'No micro-batch fits in {usable_mb:.0f} MB, even batch size 1')
+
+
+def training_state_mb(
+    model: nn.Module, optimizer_moments: int, ddp: bool, averaged_copies: int
+) -> float:
+    """
+    MB of training state allocated outside a forward and backward pass:
+    optimizer moments and DDP gradient buckets per trainable parameter, plus
+    EMA/SWA copies of every parameter and floating point buffer.
+    """
+    trainable = sum(
+        p.numel() * p.element_size() for p in model.parameters() if p.requires_grad
+    )
+    averaged = sum(t.numel() * t.element_size() for t in model.parameters()) + sum(
+        b.numel() * b.element_size() for b in model.buffers() if b.is_floating_point()
+    )
+    buckets = trainable if ddp else 0
+    return (
+        optimizer_moments * trainable + buckets + averaged_copies * averaged
+    ) / 2**20
+
+
+def plan_for_budget(model: nn.Module, cfg: DictConfig) -> dict:
+    """Memory plan for `model` at cfg.model.image_size on cfg.device."""
+    if torch.device(cfg.device).type != 'cuda':
+        raise ValueError('checkpointing.memory_budget_mb needs a CUDA device')
+    # Adam(W) keeps two moments per trainable parameter, allocated at step one.
+    # DDP copies the gradients into its own buckets for the all-reduce.
+    extra_mb = training_state_mb(
+        model,
+        optimizer_moments=2,
+        ddp=is_distributed(),
+        averaged_copies=int(cfg.ema.enabled) + int(cfg.swa.enabled),
+    )
+
+    def measure(count: int, batch_size: int) -> float:
+        return measure_step_memory(
+            model,
+            count,
+            batch_size,
+            cfg.model.image_size,
+            cfg.data.num_classes,
+            cfg.device,
+        )
+
+    return plan_checkpointing(
+        measure,
+        len(residual_blocks(model)),
+        cfg.data.batch_size * cfg.data.accumulation_steps,
+        cfg.checkpointing.memory_budget_mb,
+        extra_mb=extra_mb,
+        headroom=cfg.checkpointing.headroom,
+    )
@@ -0,0 +1,215 @@
+import ast
+import logging
+from pathlib import Path
+import random
+
+import hydra.utils
+import mlflow
+from mlflow.tracking import MlflowClient
+from omegaconf import DictConfig
+import torch
+from torch import Tensor, nn
+from torch.nn.functional import kl_div, log_softmax, softmax
+from torch.utils.data import DataLoader, Dataset
+
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.data.factory import (
+    get_transforms,
+    loader_kwargs,
+    make_sampler,
+    seed_worker,
+)
+from skin_disease_recognition.utils.distributed import barrier, is_main_process
+
+logger = logging.getLogger(__name__)
+
+
+def load_teacher(
+    registered_name: str, version: int | None, device: str
+) -> tuple[nn.Module, dict]:
+    """
+    Loads a registered model (the latest version when `version` is None) and
+    the `model` config of the run that trained it, like download_model.py.
+    """
+    client = MlflowClient()
+    if version is None:
+        versions = client.search_model_versions(f"name='{registered_name}'")
+        if not versions:
+            raise ValueError(f'No registered model found for name: {registered_name}')
+        version = max(int(v.version) for v in versions)
+    model_version = client.get_model_version(registered_name, str(version))
+
+    model = mlflow.pytorch.load_model(
+        f'models:/{registered_name}/{version}', map_location=device
+    )
+    model.eval()
+    model_data = ast.literal_eval(
+        client.get_run(model_version.run_id).data.to_dictionary()['params']['model']
+    )
+    model_data['version'] = int(version)
+    logger.info(f'Loaded teacher {model_data["model_name"]} v{version}')
+    return model, model_data
+
+
+class AugmentedView(Dataset):
+    """
+    `dataset` images with the augmentation of view `view` of every sample
+    fixed by its seed, so teacher and student see the same augmented image
+    even at different resolutions.
+    """
+
+    def __init__(self, dataset: SkinDataset, seed: int):
+        self.dataset = dataset
+        self.seed = seed
+        self.view = 0
+
+    def sample_seed(self, view: int, index: int) -> int:
+        return (self.seed * 1_000_003 + view * len(self.dataset) + index) % 2**32
+
+    def get(self, view: int, index: int):
+        self.dataset.transform.set_random_seed(self.sample_seed(view, index))
+        return self.dataset[index]
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return self.get(self.view, index)
+
+
+class DistillationDataset(AugmentedView):
+    """
+    Draws one of the cached views of every sample and returns it with a
+    target row of [label, *teacher logits], which `DistillationLoss` splits.
+    """
+
+    def __init__(self, dataset: SkinDataset, seed: int, logits: Tensor):
+        super().__init__(dataset, seed)
+        if logits.shape[1] != len(dataset):
+            raise ValueError('Teacher logits do not match the dataset')
+        self.logits = logits
+        self.classes = dataset.classes
+        self.targets = dataset.targets
+
+    def __getitem__(self, index):
+        view = random.randrange(len(self.logits))
+        image, label = self.get(view, index)
+        target = torch.cat(
+            [
+                torch.tensor([label], dtype=torch.float32),
+                self.logits[view, index].float(),
+            ]
+        )
+        return image, target
+
+
+class DistillationLoss(nn.Module):
+    """
+    alpha * T^2 * KL(teacher || student) at temperature T plus
+    (1 - alpha) * `hard_loss` on the labels. Plain label targets (e.g. from
+    the test loader) only get `hard_loss`.
+    """
+
+    def __init__(self, hard_loss: nn.Module, temperature: float, alpha: float):
+        super().__init__()
+        self.hard_loss = hard_loss
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def forward(self, pred: Tensor, target: Tensor) -> Tensor:
+        if target.dim() == 1:
+            return self.hard_loss(pred, target)
+
+        labels = target[:, 0].long()
+        teacher_logits = target[:, 1:]
+        t = self.temperature
+        soft = kl_div(
+            log_softmax(pred / t, dim=1),
+            softmax(teacher_logits / t, dim=1),
+            reduction='batchmean',
+        )
+        return self.alpha * t * t * soft + (1 - self.alpha) * self.hard_loss(
+            pred, labels
+        )
+
+
+def compute_teacher_logits(
+    teacher: nn.Module, views: AugmentedView, num_views: int, cfg: DictConfig
+) -> Tensor:
+    """Teacher logits of every sample for each view, as float16 [views, N, C]."""
+    loader = DataLoader(
+        views,
+        batch_size=cfg.data.batch_size,
+        num_workers=cfg.data.num_workers,
+        pin_memory=True,
+    )
+    all_logits = []
+    with torch.no_grad():
+        for view in range(num_views):
+            logger.info(f'Computing teacher logits, view {view + 1}/{num_views}')
+            views.view = view
+            logits = [
+                teacher(images.to(cfg.device)).cpu().half() for images, _ in loader
+            ]
+            all_logits.append(torch.cat(logits))
+    return torch.stack(all_logits)
+
+
+def cached_teacher_logits(
+    teacher: nn.Module, teacher_data: dict, cfg: DictConfig
+) -> Tensor:
+    """
+    Teacher logits for `distillation.views` augmented views of the train set,
+    computed once (by rank 0 under torchrun) and stored in
+    `distillation.cache_dir`.
+    """
+    views = cfg.distillation.views
+    cache_dir = Path(hydra.utils.to_absolute_path(cfg.distillation.cache_dir))
+    cache_path = cache_dir / (
+        f'{teacher_data["model_name"]}_v{teacher_data["version"]}'
+        f'_{teacher_data["image_size"]}_s{cfg.seed}_v{views}.pt'
+    )
+    train_dataset = SkinDataset(
+        hydra.utils.to_absolute_path(cfg.data.train_path),
+        get_transforms(cfg, 'train', teacher_data['image_size']),
+    )
+
+    if is_main_process():
+        logits = None
+        if cache_path.exists():
+            logits = torch.load(cache_path)
+            if logits.shape[:2] == (views, len(train_dataset)):
+                logger.info(f'Using cached teacher logits from {cache_path}')
+            else:
+                logger.info(f'Cached teacher logits in {cache_path} are stale')
+                logits = None
+        if logits is None:
+            view_dataset = AugmentedView(train_dataset, cfg.seed)
+            logits = compute_teacher_logits(teacher, view_dataset, views, cfg)
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            torch.save(logits, cache_path)
+    barrier()
+    if not is_main_process():
+        logits = torch.load(cache_path)
+    return logits
+
+
+def make_distillation_loader(
+    cfg: DictConfig, logits: Tensor, generator: torch.Generator
+) -> DataLoader:
+    dataset = DistillationDataset(
+        SkinDataset(
+            hydra.utils.to_absolute_path(cfg.data.train_path),
+            get_transforms(cfg, 'train'),
+        ),
+        cfg.seed,
+        logits,
+    )
+    return DataLoader(
+        dataset=dataset,
+        batch_size=cfg.data.batch_size,
+        sampler=make_sampler(dataset.targets, generator),
+        generator=generator,
+        worker_init_fn=seed_worker,
+        **loader_kwargs(cfg),
+    )
@@ -1,6 +1,8 @@
+from contextlib import nullcontext
 import json
 import logging
 import os
+import time
 from typing import Any, cast
 
 from hydra.core.hydra_config import HydraConfig
@@ -8,16 +10,40 @@ import mlflow
 import mlflow.pytorch
 import numpy as np
 from omegaconf import DictConfig, OmegaConf
-from sklearn.metrics import classification_report
 import torch
 from torch import Tensor, nn
 from torch.nn.functional import softmax
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim import Optimizer
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.utils.data import DataLoader
 import torchmetrics
 from torchmetrics import Accuracy, F1Score, Precision, Recall
 
+from skin_disease_recognition.data.factory import ProgressiveResizing
+from skin_disease_recognition.modeling.averaging import (
+    AveragedWeights,
+    recalibrate_batch_norm,
+)
+from skin_disease_recognition.modeling.benchmark import (
+    measure_latency,
+    peak_memory_mb,
+    reset_peak_memory,
+    synchronize,
+)
+from skin_disease_recognition.modeling.metrics import (
+    classification_report_from_confusion,
+    predict_confusion,
+    update_confusion_matrix,
+)
+from skin_disease_recognition.modeling.profiling import TraceProfiler
+from skin_disease_recognition.modeling.stopping import EarlyStopping
+from skin_disease_recognition.utils.distributed import (
+    all_reduce_sum,
+    any_rank,
+    is_main_process,
+    unwrap,
+)
 from skin_disease_recognition.utils.plots import (
     plot_bad_pred_distribution,
     plot_confusion_matrix,
@@ -39,7 +65,48 @@ class Trainer:
         device: str,
         num_classes: int,
         accumulation_steps: int,
+        export_model: nn.Module | None = None,
+        export_test_loader: DataLoader | None = None,
+        early_stopping: EarlyStopping | None = None,
+        time_budget_s: float | None = None,
+        progressive_resizing: ProgressiveResizing | None = None,
+        profile_loader: bool = False,
+        train_profiler: TraceProfiler | None = None,
+        eval_profiler: TraceProfiler | None = None,
+        ema: AveragedWeights | None = None,
+        swa: AveragedWeights | None = None,
+        swa_start: int = 0,
+        swa_bn_batches: int | None = None,
+        teacher: nn.Module | None = None,
+        teacher_test_loader: DataLoader | None = None,
     ):
+        """
+        `export_model` and `export_test_loader` are set when `model` is only a
+        part of the network being trained (e.g. the head over cached
+        features): the best weights are then logged and evaluated through
+        the full model on images instead.
+
+        `time_budget_s` stops training before an epoch that would not finish
+        within the budget; the best weights are still evaluated and logged.
+
+        `profile_loader` splits every epoch into time spent waiting for the
+        next batch and compute time; the device is synchronized after each
+        step so asynchronous CUDA work is not counted as waiting.
+
+        `train_profiler` and `eval_profiler` capture `torch.profiler` traces
+        of the first epoch's training steps and evaluation batches.
+
+        With `ema`, the averaged weights are updated after every optimizer
+        step and are the ones evaluated and kept as best. With `swa`, the
+        epoch-end weights are averaged from epoch `swa_start` on at a
+        constant learning rate; after the last epoch the average is
+        evaluated with BatchNorm statistics recomputed over `swa_bn_batches`
+        train batches and kept if it beats the best epoch.
+
+        `teacher` (with its own `teacher_test_loader`, as the teacher may use
+        another input size) is the model a distilled student learned from;
+        the final report then compares both on macro F1 and latency.
+        """
         self.model = model
         self.train_loader = train_loader
         self.test_loader = test_loader
@@ -48,6 +115,26 @@ class Trainer:
         self.device = device
         self.scheduler = scheduler
         self.accumulation_steps = accumulation_steps
+        self.export_model = export_model if export_model is not None else model
+        self.export_test_loader = (
+            export_test_loader if export_test_loader is not None else test_loader
+        )
+        self.early_stopping = early_stopping
+        self.time_budget_s = time_budget_s
+        self.progressive_resizing = progressive_resizing
+        self.profile_loader = profile_loader
+        self.train_profiler = train_profiler
+        self.eval_profiler = eval_profiler
+        self.ema = ema
+        self.swa = swa
+        self.swa_start = swa_start
+        self.swa_bn_batches = swa_bn_batches
+        self.best_state: dict[str, Tensor] | None = None
+        self.teacher = teacher
+        self.teacher_test_loader = teacher_test_loader
+        self.train_images_per_sec = 0.0
+        self.train_peak_memory_mb = 0.0
+        self.loader_profile: dict[str, float] = {}
 
         self.metrics = torchmetrics.MetricCollection(
             {
@@ -66,44 +153,131 @@ class Trainer:
 
     def train_one_epoch(self, epoch_index):
         self.model.train()
-        losses = []
+        loss_sum = torch.zeros((), device=self.device)
         n = len(self.train_loader)
+        num_images = 0
+        wait_s = 0.0
+        compute_s = 0.0
+        start = time.perf_counter()
+        step_end = start
+
+        if self.train_profiler is not None:
+            self.train_profiler.start()
+        reset_peak_memory(self.device)
+
+        sampler = getattr(self.train_loader, 'sampler', None)
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch_index)
 
         self.optimizer.zero_grad()
         for i, data in enumerate(self.train_loader):
+            step_start = time.perf_counter()
+            wait_s += step_start - step_end
             images: Tensor
             labels: Tensor
             images, labels = data
+            num_images += len(images)
             images = images.to(device=self.device)
             labels = labels.to(device=self.device)
 
-            pred = self.model(images)
+            is_step = (i + 1) % self.accumulation_steps == 0 or i + 1 == n
+            with self._gradient_sync(is_step):
+                pred = self.model(images)
 
-            loss = self.loss_fn(pred, labels)
-            losses.append(loss.item())
-            loss = loss / self.accumulation_steps
+                loss = self.loss_fn(pred, labels)
+                loss_sum += loss.detach()
+                loss = loss / self.accumulation_steps
 
-            loss.backward()
+                loss.backward()
 
             if (i + 1) % self.accumulation_steps == 0:
-                self.optimizer.step()
-                self.optimizer.zero_grad()
+                self._optimizer_step()
 
             if i % 100 == 0:
-                logger.info(f'Epoch {epoch_index}, Batch {i}/{n}')
+                # The only host-device sync of the loss within the epoch
+                running_loss = loss_sum.item() / (i + 1)
+                logger.info(
+                    f'Epoch {epoch_index}, Batch {i}/{n}, loss {running_loss:.4f}'
+                )
+
+            if self.profile_loader:
+                synchronize(self.device)
+            step_end = time.perf_counter()
+            compute_s += step_end - step_start
+
+            if self.train_profiler is not None:
+                self.train_profiler.step()
 
         if len(self.train_loader) % self.accumulation_steps != 0:
-            self.optimizer.step()
-            self.optimizer.zero_grad()
+            self._optimizer_step()
 
-        avg_loss = np.mean(losses)
+        if self.train_profiler is not None:
+            self.train_profiler.stop()
+        self.train_peak_memory_mb = peak_memory_mb(self.device)
+
+        stats = torch.tensor(
+            [loss_sum.item(), n, num_images / (time.perf_counter() - start)],
+            device=self.device,
+        )
+        loss_sum, num_batches, self.train_images_per_sec = all_reduce_sum(
+            stats
+        ).tolist()
+        if self.profile_loader:
+            wait_fraction = wait_s / max(wait_s + compute_s, 1e-9)
+            self.loader_profile = {
+                'loader_wait_s': wait_s,
+                'compute_s': compute_s,
+                'loader_wait_fraction': wait_fraction,
+            }
+            logger.info(f'Epoch {epoch_index} loader profile: {self.loader_profile}')
+            if wait_fraction > 0.2:
+                logger.warning(
+                    f'Training waited on the data loader for {wait_fraction:.0%} '
+                    'of the epoch, consider `make tune-loader`'
+                )
+
+        avg_loss = loss_sum / max(num_batches, 1)
         return avg_loss
 
+    def _optimizer_step(self):
+        self.optimizer.step()
+        self.optimizer.zero_grad()
+        if self.ema is not None:
+            self.ema.update()
+
+    def _eval_weights(self):
+        """Swaps in the EMA weights for evaluation and checkpointing."""
+        if self.ema is None:
+            return nullcontext()
+        return self.ema.swap()
+
+    def _save_best(self):
+        """Keeps the best weights in preallocated host memory, not on disk."""
+        state = unwrap(self.model).state_dict()
+        if self.best_state is None:
+            self.best_state = {
+                k: torch.empty_like(v, device='cpu') for k, v in state.items()
+            }
+        for k, v in state.items():
+            self.best_state[k].copy_(v)
+
+    def _gradient_sync(self, sync: bool):
+        """Skips the DDP gradient all-reduce on accumulation micro-batches."""
+        if sync or not isinstance(self.model, DistributedDataParallel):
+            return nullcontext()
+        return self.model.no_sync()
+
     def evaluate(self):
-        self.model.eval()
+        # Every rank holds the same weights, so the test shards are scored
+        # by the plain module and only the results are reduced
+        model = unwrap(self.model)
+        model.eval()
         self.metrics.reset()
 
-        losses = []
+        loss_sum = torch.zeros((), device=self.device)
+
+        if self.eval_profiler is not None:
+            self.eval_profiler.start()
 
         with torch.no_grad():
             for data in self.test_loader:
@@ -114,30 +288,47 @@ class Trainer:
                 images = images.to(device=self.device)
                 labels = labels.to(device=self.device)
 
-                pred = self.model(images)
+                pred = model(images)
 
-                loss = self.loss_fn(pred, labels)
-                losses.append(loss.item())
+                loss_sum += self.loss_fn(pred, labels)
 
                 self.metrics.update(pred, labels)
 
+                if self.eval_profiler is not None:
+                    self.eval_profiler.step()
+
+        if self.eval_profiler is not None:
+            self.eval_profiler.stop()
+
+        # torchmetrics gathers its states across ranks in compute()
         score = {k: v.item() for k, v in self.metrics.compute().items()}
-        score['validation_loss'] = np.mean(losses)
+        loss_sum, num_batches = all_reduce_sum(
+            torch.stack(
+                [loss_sum, torch.tensor(len(self.test_loader), device=self.device)]
+            ).float()
+        ).tolist()
+        score['validation_loss'] = loss_sum / max(num_batches, 1)
 
         return score
 
     def final_evaluation(self):
-        y_preds = []
-        y_trues = []
+        model = self.export_model
+        test_loader = self.export_test_loader
+        num_classes = len(test_loader.dataset.classes)
 
+        confusion = torch.zeros(
+            (num_classes, num_classes), dtype=torch.int64, device=self.device
+        )
         miss_probs = []
 
+        # Only the 9 most extreme misses of each kind are plotted, so only
+        # that many candidates are kept across batches
         low_miss = []
         high_miss = []
 
-        self.model.eval()
+        model.eval()
         with torch.no_grad():
-            for data in self.test_loader:
+            for data in test_loader:
                 images: Tensor
                 labels: Tensor
                 images, labels = data
@@ -145,28 +336,30 @@ class Trainer:
                 images = images.to(self.device)
                 labels = labels.to(self.device)
 
-                pred: Tensor = softmax(self.model(images), 1)
-                pred_label = torch.argmax(pred, dim=1)
+                pred: Tensor = softmax(model(images), 1)
+                confidence, pred_label = pred.max(dim=1)
+                update_confusion_matrix(confusion, labels, pred_label)
 
-                for j, (p, lab) in enumerate(zip(pred_label, labels, strict=True)):
-                    if p != lab:
-                        miss_probs.append(pred[j][p].item())
-                    if p != lab and pred[j][p] > 0.85:
-                        entry = (images[j], p, lab, pred[j][p])
-                        high_miss.append(entry)
-                    if p != lab and pred[j][p] < 0.4:
-                        entry = (images[j], p, lab, pred[j][p])
-                        low_miss.append(entry)
+                missed = pred_label != labels
+                miss_probs.append(confidence[missed])
 
-                y_preds.extend(pred_label.cpu())
-                y_trues.extend(labels.cpu())
+                high = missed & (confidence > 0.85)
+                low = missed & (confidence < 0.4)
+                high_miss = self._top_misses(
+                    high_miss, images, pred_label, labels, confidence, high, True
+                )
+                low_miss = self._top_misses(
+                    low_miss, images, pred_label, labels, confidence, low, False
+                )
 
-        classes = self.test_loader.dataset.classes
+        confusion = confusion.cpu().numpy()
+        miss_probs = torch.cat(miss_probs).cpu().numpy()
+        classes = test_loader.dataset.classes
 
         plot_path = os.path.join(
             HydraConfig.get().runtime.output_dir, 'conf_matrix.png'
         )
-        plot_confusion_matrix(plot_path, y_trues, y_preds, classes)
+        plot_confusion_matrix(plot_path, confusion, classes)
         mlflow.log_artifact(plot_path)
         logger.info('Confusion matrix plot logged to MLflow')
 
@@ -177,93 +370,268 @@ class Trainer:
         mlflow.log_artifact(plot_path)
         logger.info('Bad classification prediction values plot logged to MLflow')
 
-        high_miss.sort(key=lambda x: x[3], reverse=True)
-        top_high_miss = high_miss[:9]
-
-        if top_high_miss:
+        if high_miss:
             plot_path = os.path.join(
                 HydraConfig.get().runtime.output_dir, 'high_confidence_misses.png'
             )
             plot_misclassified_images(
                 plot_path,
-                top_high_miss,
+                high_miss,
                 classes,
                 'Top High Confidence Misclassifications',
             )
             mlflow.log_artifact(plot_path)
             logger.info('High confidence misses plot logged to MLflow')
 
-        low_miss.sort(key=lambda x: x[3])
-        top_low_miss = low_miss[:9]
-
-        if top_low_miss:
+        if low_miss:
             plot_path = os.path.join(
                 HydraConfig.get().runtime.output_dir, 'low_confidence_misses.png'
             )
             plot_misclassified_images(
                 plot_path,
-                top_low_miss,
+                low_miss,
                 classes,
                 'Top Low Confidence Misclassifications',
             )
             mlflow.log_artifact(plot_path)
             logger.info('Low confidence misses plot logged to MLflow')
 
-        classif_report: dict = classification_report(
-            y_true=y_trues, y_pred=y_preds, target_names=classes, output_dict=True
-        )
+        classif_report = classification_report_from_confusion(confusion, classes)
         classif_report_json = json.dumps(classif_report)
         mlflow.log_text(classif_report_json, 'classification_report.json')
         logger.info('Classification report logged to MLflow')
+        return classif_report
+
+    @staticmethod
+    def _top_misses(
+        entries: list,
+        images: Tensor,
+        pred_label: Tensor,
+        labels: Tensor,
+        confidence: Tensor,
+        mask: Tensor,
+        highest: bool,
+        keep: int = 9,
+    ) -> list:
+        """Merges the masked samples of a batch into the `keep` most extreme."""
+        idx = mask.nonzero().flatten()
+        if len(idx) == 0:
+            return entries
+        idx = idx[confidence[idx].argsort(descending=highest)[:keep]]
+        batch = list(
+            zip(
+                images[idx].cpu(),
+                pred_label[idx].tolist(),
+                labels[idx].tolist(),
+                confidence[idx].tolist(),
+                strict=True,
+            )
+        )
+        entries = sorted(entries + batch, key=lambda x: x[3], reverse=highest)
+        return entries[:keep]
+
+    def log_inference_latency(self):
+        images, _ = next(iter(self.export_test_loader))
+        latency = measure_latency(
+            self.export_model, (1, *images.shape[1:]), self.device
+        )
+        mlflow.log_metrics({f'inference_{k}': v for k, v in latency.items()})
+        logger.info(f'Inference latency logged to MLflow: {latency}')
+        return latency
+
+    def log_teacher_comparison(self, student_report: dict, student_latency: dict):
+        """Macro F1 and latency of the distillation teacher next to the student."""
+        teacher, test_loader = self.teacher, self.teacher_test_loader
+        classes = test_loader.dataset.classes
+        confusion = predict_confusion(teacher, test_loader, self.device, len(classes))
+        teacher_report = classification_report_from_confusion(confusion, classes)
+        images, _ = next(iter(test_loader))
+        teacher_latency = measure_latency(teacher, (1, *images.shape[1:]), self.device)
+
+        comparison = {
+            'teacher': {
+                'f1': teacher_report['macro avg']['f1-score'],
+                **teacher_latency,
+            },
+            'student': {
+                'f1': student_report['macro avg']['f1-score'],
+                **student_latency,
+            },
+        }
+        comparison['f1_retained'] = (
+            comparison['student']['f1'] / comparison['teacher']['f1']
+            if comparison['teacher']['f1'] > 0
+            else 0.0
+        )
+        comparison['speedup'] = (
+            teacher_latency['latency_ms_mean'] / student_latency['latency_ms_mean']
+        )
+        mlflow.log_dict(comparison, 'distillation_report.json')
+        mlflow.log_metrics(
+            {
+                'teacher_f1': comparison['teacher']['f1'],
+                'teacher_inference_latency_ms_mean': teacher_latency['latency_ms_mean'],
+                'distillation_speedup': comparison['speedup'],
+            }
+        )
+        logger.info(f'Teacher vs student: {comparison}')
 
     def train(
         self, max_epochs: int, experiment_name: str, run_name: str, cfg: DictConfig
     ):
-        mlflow.set_experiment(experiment_name)
-
-        with mlflow.start_run(run_name=run_name):
-            mlflow.log_params(cast(dict[str, Any], OmegaConf.to_object(cfg)))
-
-            class_names = self.test_loader.dataset.classes
-            class_names = ' '.join(class_names)
-            mlflow.log_text(class_names, 'class_names.txt')
+        # Under torchrun every rank trains, only rank 0 logs and checkpoints
+        is_main = is_main_process()
+        if is_main:
+            mlflow.set_experiment(experiment_name)
+            run = mlflow.start_run(run_name=run_name)
+        else:
+            run = nullcontext()
+
+        with run:
+            if is_main:
+                mlflow.log_params(cast(dict[str, Any], OmegaConf.to_object(cfg)))
+
+                class_names = self.test_loader.dataset.classes
+                class_names = ' '.join(class_names)
+                mlflow.log_text(class_names, 'class_names.txt')
 
             best_f1 = 0.0
             best_step = 0
-            best_model_path = 'best_model_state.pth'
+            best_weights = 'ema' if self.ema is not None else 'live'
+
+            start_time = time.monotonic()
+            time_to_best = 0.0
+            stop_reason = 'max_epochs'
+
+            image_size = cfg.model.image_size
+            phases: dict[int, dict] = {}
 
             for epoch in range(max_epochs):
+                epoch_start = time.monotonic()
+                if self.progressive_resizing is not None:
+                    new_size = self.progressive_resizing.size_for_epoch(epoch)
+                    if new_size != image_size:
+                        logger.info(f'Training at {new_size}px from epoch {epoch}')
+                        image_size = new_size
+                        self.train_loader = self.progressive_resizing.make_loader(
+                            image_size
+                        )
                 logger.info(f'Epoch {epoch}')
                 loss = self.train_one_epoch(epoch_index=epoch)
                 logger.info(f'Epoch {epoch} finished. Training loss: {loss}')
 
-                scores = self.evaluate()
-                logger.info(f'Metrics for epoch {epoch}: {scores}')
-                curr_f1 = scores['f1']
-                curr_val_loss = scores['validation_loss']
+                in_swa = self.swa is not None and epoch >= self.swa_start
+                if in_swa:
+                    self.swa.update()
+
+                with self._eval_weights():
+                    scores = self.evaluate()
+                    logger.info(f'Metrics for epoch {epoch}: {scores}')
+                    curr_f1 = scores['f1']
+                    curr_val_loss = scores['validation_loss']
+
+                    if best_f1 < curr_f1:
+                        logger.info(f'New model with better F1 found: f1 = {curr_f1}')
+                        best_f1 = curr_f1
+                        best_step = epoch
+                        time_to_best = time.monotonic() - start_time
+                        if is_main:
+                            self._save_best()
 
                 backbone_lr = self.optimizer.param_groups[0]['lr']
                 head_lr = self.optimizer.param_groups[1]['lr']
-                self.scheduler.step(curr_val_loss)
-
-                if best_f1 < curr_f1:
-                    logger.info(f'New model with better F1 found: f1 = {curr_f1}')
-                    best_f1 = curr_f1
-                    best_step = epoch
-                    torch.save(self.model.state_dict(), best_model_path)
+                if not in_swa:
+                    self.scheduler.step(curr_val_loss)
                 scores['training_loss'] = loss
                 scores['backbone_lr'] = backbone_lr
                 scores['head_lr'] = head_lr
-                mlflow.log_metrics(metrics=scores, step=epoch)
+                scores['train_image_size'] = image_size
+                scores['train_images_per_sec'] = self.train_images_per_sec
+                scores['train_peak_memory_mb'] = self.train_peak_memory_mb
+                scores.update(self.loader_profile)
+                if is_main:
+                    mlflow.log_metrics(metrics=scores, step=epoch)
+
+                phase = phases.setdefault(
+                    image_size, {'epochs': 0, 'time_s': 0.0, 'images_per_sec': []}
+                )
+                phase['epochs'] += 1
+                phase['time_s'] += time.monotonic() - epoch_start
+                phase['images_per_sec'].append(self.train_images_per_sec)
+                phase['accuracy'] = scores['accuracy']
+                phase['f1'] = scores['f1']
+
+                if self.early_stopping is not None and self.early_stopping.step(scores):
+                    stop_reason = 'early_stopping'
+                    logger.info(
+                        f'No {self.early_stopping.monitor} improvement for '
+                        f'{self.early_stopping.patience} epochs, stopping'
+                    )
+                    break
+
+                elapsed = time.monotonic() - start_time
+                epoch_time = time.monotonic() - epoch_start
+                # Clocks differ between ranks, so they stop together
+                if self.time_budget_s is not None and any_rank(
+                    elapsed + epoch_time > self.time_budget_s, self.device
+                ):
+                    stop_reason = 'time_budget'
+                    logger.info(
+                        f'Next epoch would exceed the {self.time_budget_s}s budget, '
+                        'stopping'
+                    )
+                    break
+
+            logger.info(f'Run finished after {epoch + 1} epochs')
+
+            if self.swa is not None and self.swa.num_updates > 0:
+                with self.swa.swap() as model:
+                    used = recalibrate_batch_norm(
+                        model, self.train_loader, self.device, self.swa_bn_batches
+                    )
+                    swa_scores = self.evaluate()
+                    logger.info(
+                        f'SWA over {self.swa.num_updates} epochs, BatchNorm '
+                        f'recalibrated on {used} batches: {swa_scores}'
+                    )
+                    if is_main:
+                        mlflow.log_metrics(
+                            {f'swa_{k}': v for k, v in swa_scores.items()}
+                        )
+                    if swa_scores['f1'] > best_f1:
+                        best_f1 = swa_scores['f1']
+                        best_step = epoch
+                        best_weights = 'swa'
+                        if is_main:
+                            self._save_best()
+
+            if not is_main:
+                return
+
+            for phase in phases.values():
+                phase['images_per_sec'] = float(np.mean(phase['images_per_sec']))
+            mlflow.log_dict(
+                {str(size): phase for size, phase in phases.items()},
+                'resolution_phases.json',
+            )
+
+            mlflow.set_tag('stop_reason', stop_reason)
+            mlflow.set_tag('best_weights', best_weights)
+            mlflow.log_metrics(
+                {
+                    'time_to_best_s': time_to_best,
+                    'train_time_s': time.monotonic() - start_time,
+                    'best_epoch': best_step,
+                }
+            )
 
             if best_f1 > 0.0:
                 logger.info('Loading best model and logging to MLflow')
-                self.model.load_state_dict(torch.load(best_model_path))
+                unwrap(self.model).load_state_dict(self.best_state)
                 mlflow.pytorch.log_model(
-                    pytorch_model=self.model, name='model', step=best_step
+                    pytorch_model=self.export_model, name='model', step=best_step
                 )
-                if os.path.exists(best_model_path):
-                    os.remove(best_model_path)
-                self.final_evaluation()
-
-            logger.info(f'Run finished after {epoch + 1} epochs')
+                report = self.final_evaluation()
+                latency = self.log_inference_latency()
+                if self.teacher is not None:
+                    self.log_teacher_comparison(report, latency)
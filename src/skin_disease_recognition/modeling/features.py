@@ -0,0 +1,159 @@
+import logging
+from pathlib import Path
+
+import hydra.utils
+from omegaconf import DictConfig
+import torch
+from torch import Tensor, nn
+from torch.utils.data import DataLoader
+from torchvision.models import EfficientNet, ResNet
+
+from skin_disease_recognition.data.dataset import FeatureDataset, SkinDataset
+from skin_disease_recognition.data.factory import (
+    get_transforms,
+    make_sampler,
+    seed_worker,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def forward_features(model: nn.Module, x: Tensor) -> Tensor:
+    """Pooled backbone features, i.e. the input of the classification head."""
+    if isinstance(model, EfficientNet):
+        x = model.features(x)
+        x = model.avgpool(x)
+        return torch.flatten(x, 1)
+    if isinstance(model, ResNet):
+        x = model.conv1(x)
+        x = model.bn1(x)
+        x = model.relu(x)
+        x = model.maxpool(x)
+        x = model.layer1(x)
+        x = model.layer2(x)
+        x = model.layer3(x)
+        x = model.layer4(x)
+        x = model.avgpool(x)
+        return torch.flatten(x, 1)
+    if hasattr(model, 'forward_features'):
+        return model.forward_features(x)
+    raise ValueError(f'Feature extraction not supported for {type(model).__name__}')
+
+
+def forward_head(model: nn.Module, features: Tensor) -> Tensor:
+    """Logits from features returned by `forward_features`."""
+    if isinstance(model, EfficientNet):
+        return model.classifier(features)
+    if isinstance(model, ResNet):
+        return model.fc(features)
+    if hasattr(model, 'forward_head'):
+        return model.forward_head(features)
+    raise ValueError(f'Head not supported for {type(model).__name__}')
+
+
+def get_head(model: nn.Module) -> nn.Module:
+    if isinstance(model, EfficientNet):
+        return model.classifier
+    if isinstance(model, ResNet):
+        return model.fc
+    raise ValueError(f'Head not supported for {type(model).__name__}')
+
+
+def compute_features(
+    model: nn.Module, loader: DataLoader, device: str
+) -> tuple[Tensor, Tensor]:
+    model.eval()
+    features = []
+    labels = []
+    with torch.no_grad():
+        for images, targets in loader:
+            features.append(forward_features(model, images.to(device)).cpu())
+            labels.append(targets)
+    return torch.cat(features), torch.cat(labels)
+
+
+def cached_features(
+    model: nn.Module,
+    dataset: SkinDataset,
+    cache_path: Path,
+    cfg: DictConfig,
+    views: int = 1,
+) -> FeatureDataset:
+    """
+    Backbone features of `dataset` for `views` passes of its transform,
+    computed once and stored in `cache_path`. With random augmentations
+    each view is a different augmented copy of every image.
+    """
+    if cache_path.exists():
+        cached = torch.load(cache_path)
+        if len(cached['labels']) == len(dataset) * views:
+            logger.info(f'Using cached features from {cache_path}')
+            return FeatureDataset(cached['features'], cached['labels'], dataset.classes)
+        logger.info(f'Cached features in {cache_path} are stale, recomputing')
+
+    loader = DataLoader(
+        dataset,
+        batch_size=cfg.data.batch_size,
+        num_workers=cfg.data.num_workers,
+        pin_memory=True,
+        worker_init_fn=seed_worker,
+    )
+
+    all_features = []
+    all_labels = []
+    for view in range(views):
+        logger.info(f'Computing features for {cache_path.name}, view {view + 1}')
+        features, labels = compute_features(model, loader, cfg.device)
+        all_features.append(features)
+        all_labels.append(labels)
+    features = torch.cat(all_features)
+    labels = torch.cat(all_labels)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({'features': features, 'labels': labels}, cache_path)
+    return FeatureDataset(features, labels, dataset.classes)
+
+
+def make_feature_loaders(cfg: DictConfig, model: nn.Module):
+    """
+    Loaders over cached backbone features for head-only training, in place of
+    `make_loaders`. Test features always use the test transform; train
+    features use the train transform when `feature_cache.views` > 0 (that
+    many augmented views) and the test transform otherwise.
+    """
+    views = cfg.feature_cache.views
+    train_stage = 'train' if views > 0 else 'test'
+
+    train_dataset = SkinDataset(
+        hydra.utils.to_absolute_path(cfg.data.train_path),
+        get_transforms(cfg, train_stage),
+    )
+    test_dataset = SkinDataset(
+        hydra.utils.to_absolute_path(cfg.data.test_path), get_transforms(cfg, 'test')
+    )
+
+    cache_dir = Path(hydra.utils.to_absolute_path(cfg.feature_cache.dir))
+    prefix = f'{cfg.model.model_name}_{cfg.model.image_size}_s{cfg.seed}'
+    train_features = cached_features(
+        model,
+        train_dataset,
+        cache_dir / f'{prefix}_train_v{views}.pt',
+        cfg,
+        views=max(views, 1),
+    )
+    test_features = cached_features(
+        model, test_dataset, cache_dir / f'{prefix}_test.pt', cfg
+    )
+
+    g = torch.Generator()
+    g.manual_seed(cfg.seed)
+
+    train_loader = DataLoader(
+        dataset=train_features,
+        batch_size=cfg.data.batch_size,
+        sampler=make_sampler(train_features.targets, g),
+        generator=g,
+    )
+    test_loader = DataLoader(dataset=test_features, batch_size=cfg.data.batch_size)
+
+    return train_loader, test_loader
@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+from torch import Tensor, nn
+from torch.utils.data import DataLoader
+
+
+def update_confusion_matrix(matrix: Tensor, labels: Tensor, preds: Tensor):
+    """Adds a batch to `matrix` (rows: true class, columns: predicted) in place."""
+    num_classes = matrix.shape[0]
+    counts = torch.bincount(labels * num_classes + preds, minlength=num_classes**2)
+    matrix += counts.view(num_classes, num_classes)
+
+
+@torch.no_grad()
+def predict_confusion(
+    model: nn.Module, loader: DataLoader, device: str, num_classes: int
+) -> np.ndarray:
+    model.eval()
+    matrix = torch.zeros((num_classes, num_classes), dtype=torch.int64, device=device)
+    for images, labels in loader:
+        preds = model(images.to(device)).argmax(dim=1)
+        update_confusion_matrix(matrix, labels.to(device), preds)
+    return matrix.cpu().numpy()
+
+
+def classification_report_from_confusion(
+    matrix: np.ndarray, classes: list[str]
+) -> dict:
+    """
+    Same output as sklearn's `classification_report(..., output_dict=True)`,
+    computed from a confusion matrix instead of per-sample predictions.
+    Undefined precision/recall/F1 (no predictions or no support) are 0.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    tp = np.diag(matrix)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(
+            precision + recall > 0,
+            2 * precision * recall / (precision + recall),
+            0.0,
+        )
+
+    report: dict = {}
+    for i, name in enumerate(classes):
+        report[name] = {
+            'precision': float(precision[i]),
+            'recall': float(recall[i]),
+            'f1-score': float(f1[i]),
+            'support': float(support[i]),
+        }
+
+    total = support.sum()
+    report['accuracy'] = float(tp.sum() / total) if total > 0 else 0.0
+    weights = support / total if total > 0 else np.zeros_like(support)
+    report['macro avg'] = {
+        'precision': float(precision.mean()),
+        'recall': float(recall.mean()),
+        'f1-score': float(f1.mean()),
+        'support': float(total),
+    }
+    report['weighted avg'] = {
+        'precision': float(precision @ weights),
+        'recall': float(recall @ weights),
+        'f1-score': float(f1 @ weights),
+        'support': float(total),
+    }
+    return report
@@ -0,0 +1,102 @@
+import logging
+from pathlib import Path
+
+import mlflow
+import torch
+from torch.profiler import ProfilerActivity, _ExperimentalConfig, profile, schedule
+
+logger = logging.getLogger(__name__)
+
+
+class TraceProfiler:
+    """
+    Captures `torch.profiler` traces once and exports them to `output_dir`
+    as a Chrome trace (`<name>_trace.json`, open in chrome://tracing or
+    Perfetto) and a per-operator summary table (`<name>_ops.txt`). Both are
+    also logged to MLflow under `profiler/` when a run is active.
+
+    With `wait`/`warmup`/`active` the capture follows a step schedule
+    (call `step()` after every step), otherwise everything between `start()`
+    and `stop()` is recorded. Only the thread calling `start()` is traced
+    unless `all_threads` is set.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        output_dir: str | Path,
+        device: str,
+        wait: int | None = None,
+        warmup: int | None = None,
+        active: int | None = None,
+        record_shapes: bool = True,
+        profile_memory: bool = False,
+        row_limit: int = 50,
+        all_threads: bool = False,
+    ):
+        self.name = name
+        self.output_dir = Path(output_dir)
+        self.device = device
+        self.row_limit = row_limit
+        self.files: list[Path] = []
+        self.done = False
+
+        activities = [ProfilerActivity.CPU]
+        if torch.device(device).type == 'cuda':
+            activities.append(ProfilerActivity.CUDA)
+        step_schedule = None
+        if active is not None:
+            step_schedule = schedule(
+                wait=wait or 0, warmup=warmup or 0, active=active, repeat=1
+            )
+
+        self._profile = profile(
+            activities=activities,
+            schedule=step_schedule,
+            on_trace_ready=self._export,
+            record_shapes=record_shapes,
+            profile_memory=profile_memory,
+            experimental_config=_ExperimentalConfig(profile_all_threads=all_threads),
+        )
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        if self.done or self._running:
+            return
+        self._profile.start()
+        self._running = True
+
+    def step(self):
+        if self._running:
+            self._profile.step()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._profile.stop()
+        self._running = False
+        self.done = True
+
+    def _export(self, prof: profile):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        trace_path = self.output_dir / f'{self.name}_trace.json'
+        table_path = self.output_dir / f'{self.name}_ops.txt'
+
+        prof.export_chrome_trace(str(trace_path))
+        sort_by = (
+            'self_cuda_time_total'
+            if torch.device(self.device).type == 'cuda'
+            else 'self_cpu_time_total'
+        )
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit)
+        table_path.write_text(table)
+        self.files = [trace_path, table_path]
+        logger.info(f'Profiler trace for {self.name} written to {trace_path}')
+
+        if mlflow.active_run() is not None:
+            for path in self.files:
+                mlflow.log_artifact(str(path), artifact_path='profiler')
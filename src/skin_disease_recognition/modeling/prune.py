@@ -0,0 +1,264 @@
+import json
+import logging
+import os.path
+import shutil
+
+import hydra
+from omegaconf import DictConfig, open_dict
+import torch
+from torch import Tensor, nn
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torchvision.models import EfficientNet, ResNet
+from torchvision.models.efficientnet import MBConv
+from torchvision.models.resnet import BasicBlock, Bottleneck
+
+from skin_disease_recognition.core.config import MODEL_DIR, PROJECT_ROOT
+from skin_disease_recognition.data.factory import make_loaders, make_test_loader
+from skin_disease_recognition.modeling.benchmark import measure_latency
+from skin_disease_recognition.modeling.engine import Trainer
+from skin_disease_recognition.modeling.features import get_head
+from skin_disease_recognition.modeling.metrics import (
+    classification_report_from_confusion,
+    predict_confusion,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def keep_count(channels: int, amount: float, round_to: int = 8) -> int:
+    """Channels left after pruning `amount` of them, in multiples of `round_to`."""
+    keep = round(channels * (1 - amount) / round_to) * round_to
+    return min(channels, max(round_to, keep))
+
+
+def top_channels(importance: Tensor, keep: int) -> Tensor:
+    """Indices of the `keep` most important channels, in their original order."""
+    return importance.topk(keep).indices.sort().values
+
+
+def slice_conv(
+    conv: nn.Conv2d, out_idx: Tensor | None = None, in_idx: Tensor | None = None
+) -> nn.Conv2d:
+    weight = conv.weight.detach()
+    bias = conv.bias.detach() if conv.bias is not None else None
+    groups = conv.groups
+    if out_idx is not None:
+        weight = weight[out_idx]
+        bias = bias[out_idx] if bias is not None else None
+        if groups > 1:
+            # Depthwise: every kept output channel keeps its own input channel
+            groups = len(out_idx)
+    if in_idx is not None and conv.groups == 1:
+        weight = weight[:, in_idx]
+
+    in_channels = weight.shape[1] * groups
+    new = nn.Conv2d(
+        in_channels,
+        weight.shape[0],
+        kernel_size=conv.kernel_size,
+        stride=conv.stride,
+        padding=conv.padding,
+        dilation=conv.dilation,
+        groups=groups,
+        bias=bias is not None,
+        padding_mode=conv.padding_mode,
+    ).to(weight.device)
+    new.weight.data.copy_(weight)
+    if bias is not None:
+        new.bias.data.copy_(bias)
+    return new
+
+
+def slice_bn(bn: nn.BatchNorm2d, idx: Tensor) -> nn.BatchNorm2d:
+    new = nn.BatchNorm2d(len(idx), eps=bn.eps, momentum=bn.momentum).to(
+        bn.weight.device
+    )
+    new.weight.data.copy_(bn.weight.detach()[idx])
+    new.bias.data.copy_(bn.bias.detach()[idx])
+    new.running_mean.copy_(bn.running_mean[idx])
+    new.running_var.copy_(bn.running_var[idx])
+    new.num_batches_tracked.copy_(bn.num_batches_tracked)
+    return new.train(bn.training)
+
+
+def prune_basic_block(block: BasicBlock, amount: float, round_to: int):
+    idx = top_channels(
+        block.bn1.weight.detach().abs(),
+        keep_count(block.bn1.num_features, amount, round_to),
+    )
+    block.conv1 = slice_conv(block.conv1, out_idx=idx)
+    block.bn1 = slice_bn(block.bn1, idx)
+    block.conv2 = slice_conv(block.conv2, in_idx=idx)
+
+
+def prune_bottleneck(block: Bottleneck, amount: float, round_to: int):
+    idx = top_channels(
+        block.bn1.weight.detach().abs(),
+        keep_count(block.bn1.num_features, amount, round_to),
+    )
+    block.conv1 = slice_conv(block.conv1, out_idx=idx)
+    block.bn1 = slice_bn(block.bn1, idx)
+    block.conv2 = slice_conv(block.conv2, in_idx=idx)
+
+    idx = top_channels(
+        block.bn2.weight.detach().abs(),
+        keep_count(block.bn2.num_features, amount, round_to),
+    )
+    block.conv2 = slice_conv(block.conv2, out_idx=idx)
+    block.bn2 = slice_bn(block.bn2, idx)
+    block.conv3 = slice_conv(block.conv3, in_idx=idx)
+
+
+def prune_mbconv(block: MBConv, amount: float, round_to: int):
+    layers = block.block
+    if len(layers) < 4:
+        # No expansion layer: the depthwise channels are the block's input
+        return
+    expand, depthwise, se, project = layers[0], layers[1], layers[2], layers[3]
+    importance = expand[1].weight.detach().abs() * depthwise[1].weight.detach().abs()
+    idx = top_channels(importance, keep_count(len(importance), amount, round_to))
+
+    expand[0] = slice_conv(expand[0], out_idx=idx)
+    expand[1] = slice_bn(expand[1], idx)
+    depthwise[0] = slice_conv(depthwise[0], out_idx=idx)
+    depthwise[1] = slice_bn(depthwise[1], idx)
+    se.fc1 = slice_conv(se.fc1, in_idx=idx)
+    se.fc2 = slice_conv(se.fc2, out_idx=idx)
+    project[0] = slice_conv(project[0], in_idx=idx)
+
+
+def prune_model(model: nn.Module, amount: float, round_to: int = 8) -> nn.Module:
+    """
+    Structured pruning of the channels inside each residual block, ranked by
+    the magnitude of their BatchNorm scale (network slimming). Layers are
+    rebuilt with fewer channels, so the model is smaller and faster on dense
+    kernels. Block inputs and outputs are untouched, so the residual
+    connections and the classification head keep their shapes.
+    """
+    if not 0.0 <= amount < 1.0:
+        raise ValueError('Pruning amount must be in [0, 1)')
+    if not isinstance(model, EfficientNet | ResNet):
+        raise ValueError(f'Pruning not supported for {type(model).__name__}')
+
+    for module in model.modules():
+        if isinstance(module, BasicBlock):
+            prune_basic_block(module, amount, round_to)
+        elif isinstance(module, Bottleneck):
+            prune_bottleneck(module, amount, round_to)
+        elif isinstance(module, MBConv):
+            prune_mbconv(module, amount, round_to)
+    return model
+
+
+def count_parameters(model: nn.Module) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+
+def finetune(model: nn.Module, cfg: DictConfig, run_name: str) -> nn.Module:
+    """Short fine-tuning of the pruned model with the usual Trainer."""
+    train_loader, test_loader = make_loaders(cfg)
+    for param in model.parameters():
+        param.requires_grad = True
+    head_params = list(get_head(model).parameters())
+    head_ids = {id(p) for p in head_params}
+    backbone_params = [p for p in model.parameters() if id(p) not in head_ids]
+
+    lr = cfg.prune.finetune_lr
+    optim = torch.optim.AdamW(
+        [{'params': backbone_params, 'lr': lr * 0.1}, {'params': head_params}],
+        lr=lr,
+    )
+    scheduler = ReduceLROnPlateau(optimizer=optim, mode='min')
+    trainer = Trainer(
+        model=model,
+        train_loader=train_loader,
+        test_loader=test_loader,
+        optimizer=optim,
+        scheduler=scheduler,
+        loss_fn=hydra.utils.instantiate(cfg.loss_function),
+        device=cfg.device,
+        num_classes=cfg.data.num_classes,
+        accumulation_steps=cfg.data.accumulation_steps,
+    )
+    trainer.train(
+        max_epochs=cfg.prune.finetune_epochs,
+        experiment_name=cfg.experiment_name,
+        run_name=run_name,
+        cfg=cfg,
+    )
+    return model
+
+
+@hydra.main(
+    config_path=os.path.join(PROJECT_ROOT, 'conf'),
+    config_name='prune',
+    version_base='1.2',
+)
+def main(cfg: DictConfig):
+    source = MODEL_DIR / cfg.prune.model_folder
+    amount = cfg.prune.amount
+    with open(source / 'model_data.json') as f:
+        model_data = json.load(f)
+    if 'optimizations' in model_data:
+        raise ValueError('Prune the exported model before optimize_export.py')
+    model: nn.Module = torch.load(
+        source / 'model.pth', weights_only=False, map_location=cfg.device
+    )
+
+    # Data and transforms follow the exported model, not the default config
+    with open_dict(cfg):
+        cfg.model = model_data
+    g = torch.Generator()
+    g.manual_seed(cfg.seed)
+    test_loader = make_test_loader(cfg, g, shard=False)
+    input_shape = (1, 3, cfg.model.image_size, cfg.model.image_size)
+
+    params_before = count_parameters(model)
+    latency_before = measure_latency(model, input_shape, cfg.device)
+
+    prune_model(model, amount, cfg.prune.round_to)
+    params_after = count_parameters(model)
+    logger.info(
+        f'Pruned {amount:.0%} of block channels: '
+        f'{params_before:,} -> {params_after:,} parameters'
+    )
+
+    run_name = f'{model_data["model_name"]}-pruned{round(amount * 100)}'
+    if cfg.prune.finetune_epochs > 0:
+        model = finetune(model, cfg, run_name)
+    model.eval()
+
+    classes = test_loader.dataset.classes
+    confusion = predict_confusion(model, test_loader, cfg.device, len(classes))
+    report = classification_report_from_confusion(confusion, classes)
+    latency_after = measure_latency(model, input_shape, cfg.device)
+
+    dest = MODEL_DIR / f'{cfg.prune.model_folder}-pruned{round(amount * 100)}'
+    dest.mkdir()
+    torch.save(model, dest / 'model.pth')
+    model_data['pruning'] = {
+        'source': cfg.prune.model_folder,
+        'amount': amount,
+        'finetune_epochs': cfg.prune.finetune_epochs,
+        'params_before': params_before,
+        'params_after': params_after,
+    }
+    with open(dest / 'model_data.json', 'w') as f:
+        json.dump(model_data, f)
+    shutil.copy(source / 'class_names.txt', dest / 'class_names.txt')
+    with open(dest / 'classification_report.json', 'w') as f:
+        json.dump(report, f)
+    with open(dest / 'metrics.json', 'w') as f:
+        json.dump(report['macro avg'], f)
+    with open(dest / 'latency.json', 'w') as f:
+        json.dump({'before': latency_before, 'after': latency_after}, f)
+
+    logger.info(
+        f'Saved to {dest}: macro F1 {report["macro avg"]["f1-score"]:.4f}, '
+        f'latency {latency_before["latency_ms_mean"]:.1f} -> '
+        f'{latency_after["latency_ms_mean"]:.1f} ms'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import math
+
+
+class EarlyStopping:
+    """
+    Stops training when the monitored validation metric has not improved by
+    more than `min_delta` for `patience` consecutive epochs.
+    """
+
+    def __init__(self, monitor: str = 'f1', patience: int = 8, min_delta: float = 0.0):
+        if monitor not in ('f1', 'validation_loss'):
+            raise ValueError(f'Unsupported early stopping metric: {monitor}')
+        self.monitor = monitor
+        self.patience = patience
+        self.min_delta = min_delta
+        self.mode = 'min' if monitor == 'validation_loss' else 'max'
+        self.best = math.inf if self.mode == 'min' else -math.inf
+        self.bad_epochs = 0
+
+    def improved(self, value: float) -> bool:
+        if self.mode == 'min':
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
+
+    def step(self, scores: dict) -> bool:
+        """Records one epoch of scores, returns True when training should stop."""
+        value = scores[self.monitor]
+        if self.improved(value):
+            self.best = value
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return self.bad_epochs >= self.patience
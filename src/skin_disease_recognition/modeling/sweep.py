@@ -0,0 +1,279 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+import uuid
+
+import cv2
+import mlflow
+from mlflow.tracking import MlflowClient
+import numpy as np
+from omegaconf import OmegaConf
+import pandas as pd
+import torch
+from torchvision.datasets.folder import IMG_EXTENSIONS
+
+from skin_disease_recognition.core.config import PROCESSED_DATA_DIR, PROJECT_ROOT
+from skin_disease_recognition.utils.resources import available_cpus
+
+logger = logging.getLogger(__name__)
+
+CONF_DIR = PROJECT_ROOT / 'conf'
+SWEEP_DIR = PROJECT_ROOT / 'sweeps'
+
+
+def prepare_resized_dataset(src: Path, dst: Path, size: int, workers: int) -> Path:
+    """
+    Decodes and resizes every image of `src` to size x size once, so all runs
+    of a sweep read small files instead of the full-resolution originals.
+    Training transforms resize to the model's image_size anyway.
+    """
+    sources = [p for p in src.rglob('*') if p.suffix.lower() in IMG_EXTENSIONS]
+
+    def resize(path: Path):
+        out = dst / path.relative_to(src)
+        if out.exists():
+            return
+        out.parent.mkdir(parents=True, exist_ok=True)
+        image = cv2.imread(str(path))
+        if image is None:
+            return
+        image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+        cv2.imwrite(str(out), image)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(resize, sources))
+    return dst
+
+
+def should_prune(curves: dict[str, list[float]], name: str, grace_epochs: int) -> bool:
+    """
+    Median stopping rule: stop a run whose best F1 so far is below the median
+    of the best F1 other runs had reached after the same number of epochs.
+    """
+    curve = curves[name]
+    epoch = len(curve) - 1
+    if epoch < grace_epochs:
+        return False
+    others = [
+        max(other[: epoch + 1])
+        for other_name, other in curves.items()
+        if other_name != name and len(other) > epoch
+    ]
+    if len(others) < 2:
+        return False
+    return max(curve) < float(np.median(others))
+
+
+class SweepRun:
+    def __init__(self, config: str):
+        self.config = config
+        self.status = 'queued'
+        self.process: subprocess.Popen | None = None
+        self.slot: dict | None = None
+        self.run_id: str | None = None
+
+
+class SweepRunner:
+    def __init__(
+        self,
+        configs: list[str],
+        overrides: list[str],
+        experiment_name: str,
+        max_parallel: int | None = None,
+        threads_per_run: int = 4,
+        grace_epochs: int = 3,
+        poll_interval: float = 30.0,
+    ):
+        self.sweep_id = uuid.uuid4().hex[:8]
+        self.output_dir = SWEEP_DIR / self.sweep_id
+        self.runs = [SweepRun(config) for config in configs]
+        self.overrides = overrides
+        self.experiment_name = experiment_name
+        self.grace_epochs = grace_epochs
+        self.poll_interval = poll_interval
+        self.client = MlflowClient()
+        self.slots = self._make_slots(max_parallel, threads_per_run)
+
+    def _make_slots(self, max_parallel: int | None, threads_per_run: int):
+        gpus = torch.cuda.device_count()
+        if gpus > 0:
+            parallel = max_parallel or gpus
+            return [
+                {'device': 'cuda', 'gpu': i % gpus, 'threads': threads_per_run}
+                for i in range(parallel)
+            ]
+
+        cpus = available_cpus()
+        parallel = max_parallel or max(1, cpus // threads_per_run)
+        threads = max(1, cpus // parallel)
+        return [{'device': 'cpu', 'gpu': None, 'threads': threads}] * parallel
+
+    def _launch(self, run: SweepRun, slot: dict):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(
+            [str(PROJECT_ROOT / 'src'), env.get('PYTHONPATH', '')]
+        )
+        env['OMP_NUM_THREADS'] = str(slot['threads'])
+        env['MKL_NUM_THREADS'] = str(slot['threads'])
+        if slot['gpu'] is not None:
+            env['CUDA_VISIBLE_DEVICES'] = str(slot['gpu'])
+
+        run_dir = self.output_dir / run.config
+        command = [
+            sys.executable,
+            '-m',
+            'skin_disease_recognition.modeling.train',
+            f'model={run.config}',
+            f'device={slot["device"]}',
+            f'experiment_name={self.experiment_name}',
+            f'+sweep_id={self.sweep_id}',
+            f'+sweep_run={run.config}',
+            f'hydra.run.dir={run_dir}',
+            *self.overrides,
+        ]
+        run_dir.mkdir(parents=True, exist_ok=True)
+        with open(run_dir / 'train.log', 'w') as log_file:
+            run.process = subprocess.Popen(
+                command, env=env, cwd=PROJECT_ROOT, stdout=log_file, stderr=log_file
+            )
+        run.slot = slot
+        run.status = 'running'
+        logger.info(
+            f'Started {run.config} on {slot["device"]} ({slot["threads"]} threads)'
+        )
+
+    def _f1_curves(self) -> dict[str, list[float]]:
+        runs = mlflow.search_runs(
+            experiment_names=[self.experiment_name],
+            filter_string=f"params.sweep_id = '{self.sweep_id}'",
+            output_format='list',
+        )
+        curves = {}
+        for mlflow_run in runs:
+            name = mlflow_run.data.params['sweep_run']
+            for run in self.runs:
+                if run.config == name:
+                    run.run_id = mlflow_run.info.run_id
+            history = self.client.get_metric_history(mlflow_run.info.run_id, 'f1')
+            curves[name] = [m.value for m in sorted(history, key=lambda m: m.step)]
+        return curves
+
+    def run(self) -> pd.DataFrame:
+        queued = list(self.runs)
+        free_slots = list(self.slots)
+        running: list[SweepRun] = []
+        logger.info(
+            f'Sweep {self.sweep_id}: {len(queued)} runs, {len(free_slots)} parallel'
+        )
+
+        while queued or running:
+            while queued and free_slots:
+                run = queued.pop(0)
+                self._launch(run, free_slots.pop(0))
+                running.append(run)
+            time.sleep(self.poll_interval)
+
+            curves = self._f1_curves()
+            for run in list(running):
+                code = run.process.poll()
+                if code is None and run.config in curves:
+                    if should_prune(curves, run.config, self.grace_epochs):
+                        logger.info(f'Pruning {run.config}: F1 below running median')
+                        run.process.terminate()
+                        run.process.wait()
+                        if run.run_id:
+                            self.client.set_terminated(run.run_id, 'KILLED')
+                        run.status = 'pruned'
+                elif code is not None:
+                    run.status = 'finished' if code == 0 else 'failed'
+                    logger.info(f'{run.config} {run.status}')
+                if run.status != 'running':
+                    running.remove(run)
+                    free_slots.append(run.slot)
+
+        self._f1_curves()
+        summary = self.summary()
+        summary.to_csv(self.output_dir / 'summary.csv', index=False)
+        return summary
+
+    def summary(self) -> pd.DataFrame:
+        rows = []
+        for run in self.runs:
+            row = {'model': run.config, 'status': run.status}
+            if run.run_id is not None:
+                mlflow_run = self.client.get_run(run.run_id)
+                history = self.client.get_metric_history(run.run_id, 'f1')
+                info = mlflow_run.info
+                end_time = info.end_time or int(time.time() * 1000)
+                row['best_f1'] = max((m.value for m in history), default=None)
+                row['epochs'] = len(history)
+                row['train_time_min'] = (end_time - info.start_time) / 60000
+                row['inference_latency_ms'] = mlflow_run.data.metrics.get(
+                    'inference_latency_ms_mean'
+                )
+            rows.append(row)
+
+        summary = pd.DataFrame(rows)
+        if 'best_f1' in summary:
+            summary = summary.sort_values(
+                'best_f1', ascending=False, na_position='last'
+            )
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Train several model configs in parallel and rank them by F1'
+    )
+    parser.add_argument(
+        '--models',
+        nargs='+',
+        default=sorted(p.stem for p in (CONF_DIR / 'model').glob('*.yaml')),
+    )
+    parser.add_argument('--max-parallel', type=int, default=None)
+    parser.add_argument('--threads-per-run', type=int, default=4)
+    parser.add_argument('--grace-epochs', type=int, default=3)
+    parser.add_argument('--poll-interval', type=float, default=30.0)
+    parser.add_argument(
+        '--no-resize-cache',
+        action='store_true',
+        help='Train on the original images instead of a shared resized copy',
+    )
+    parser.add_argument('overrides', nargs='*', help='Hydra overrides for every run')
+    args = parser.parse_args()
+
+    cfg = OmegaConf.load(CONF_DIR / 'config.yaml')
+    overrides = list(args.overrides)
+
+    if not args.no_resize_cache:
+        size = max(
+            OmegaConf.load(CONF_DIR / 'model' / f'{m}.yaml').image_size
+            for m in args.models
+        )
+        for split in ('train', 'test'):
+            src = PROJECT_ROOT / cfg.data[f'{split}_path']
+            dst = PROCESSED_DATA_DIR / f'resized_{size}' / split
+            logger.info(f'Preparing {split} images at {size}px in {dst}')
+            prepare_resized_dataset(src, dst, size, available_cpus())
+            overrides.insert(0, f'data.{split}_path={dst}')
+
+    runner = SweepRunner(
+        configs=args.models,
+        overrides=overrides,
+        experiment_name=cfg.experiment_name,
+        max_parallel=args.max_parallel,
+        threads_per_run=args.threads_per_run,
+        grace_epochs=args.grace_epochs,
+        poll_interval=args.poll_interval,
+    )
+    summary = runner.run()
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,42 @@ import logging
 import os.path
 
 import hydra
+from hydra.core.hydra_config import HydraConfig
 from omegaconf import DictConfig
 import torch.nn
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 import torchvision.models
 
 from skin_disease_recognition.core.config import PROJECT_ROOT
-from skin_disease_recognition.data.factory import make_loaders
+from skin_disease_recognition.data.factory import (
+    ProgressiveResizing,
+    make_loaders,
+    make_test_loader,
+)
+from skin_disease_recognition.modeling.averaging import AveragedWeights
+from skin_disease_recognition.modeling.checkpointing import (
+    checkpointed_view,
+    plan_for_budget,
+)
+from skin_disease_recognition.modeling.distill import (
+    DistillationLoss,
+    cached_teacher_logits,
+    load_teacher,
+    make_distillation_loader,
+)
 from skin_disease_recognition.modeling.engine import Trainer
+from skin_disease_recognition.modeling.features import get_head, make_feature_loaders
+from skin_disease_recognition.modeling.profiling import TraceProfiler
+from skin_disease_recognition.modeling.stopping import EarlyStopping
+from skin_disease_recognition.utils.distributed import (
+    cleanup_distributed,
+    get_world_size,
+    is_distributed,
+    is_main_process,
+    setup_distributed,
+    unwrap,
+)
 from skin_disease_recognition.utils.seeding import seed_everything
 
 logger = logging.getLogger(__name__)
@@ -21,6 +49,15 @@ logger = logging.getLogger(__name__)
     version_base='1.2',
 )
 def train(cfg: DictConfig):
+    # Rank-local device when launched with torchrun
+    cfg.device = setup_distributed(cfg.device)
+    try:
+        fit(cfg)
+    finally:
+        cleanup_distributed()
+
+
+def fit(cfg: DictConfig):
     seed_everything(cfg)
 
     logger.info('Creating data loaders')
@@ -66,6 +103,37 @@ def train(cfg: DictConfig):
 
     model = model.to(device=cfg.device)
 
+    trained_model = model
+    if cfg.checkpointing.enabled:
+        if cfg.model.pretrained and cfg.freeze_layers and cfg.feature_cache.enabled:
+            raise ValueError('Checkpointing does not apply to cached features')
+        if cfg.checkpointing.memory_budget_mb is not None:
+            plan = plan_for_budget(model, cfg)
+            logger.info(f'Memory budget plan: {plan}')
+            cfg.checkpointing.blocks = plan['blocks']
+            cfg.data.batch_size = plan['batch_size']
+            cfg.data.accumulation_steps = plan['accumulation_steps']
+            train_loader, test_loader = make_loaders(cfg)
+        # The view shares the weights, `model` is exported without wrappers
+        trained_model = checkpointed_view(model, cfg.checkpointing.blocks)
+
+    export_test_loader = None
+    if cfg.model.pretrained and cfg.freeze_layers and cfg.feature_cache.enabled:
+        if is_distributed():
+            raise ValueError('Cached features are not supported with torchrun')
+        logger.info('Training head only over cached backbone features')
+        export_test_loader = test_loader
+        train_loader, test_loader = make_feature_loaders(cfg, model)
+        trained_model = get_head(model)
+    elif is_distributed():
+        logger.info(f'Training with DDP on {get_world_size()} processes')
+        device_ids = [torch.device(cfg.device).index] if 'cuda' in cfg.device else None
+        trained_model = DistributedDataParallel(trained_model, device_ids=device_ids)
+        # Final evaluation runs on rank 0 only, over the whole test set
+        g = torch.Generator()
+        g.manual_seed(cfg.seed)
+        export_test_loader = make_test_loader(cfg, g, shard=False)
+
     loss_fn = hydra.utils.instantiate(cfg.loss_function)
     optim = optim_partial(
         [
@@ -82,9 +150,83 @@ def train(cfg: DictConfig):
         threshold_mode=cfg.scheduler.threshold_mode,
     )
 
+    early_stopping = None
+    if cfg.early_stopping.enabled:
+        early_stopping = EarlyStopping(
+            monitor=cfg.early_stopping.monitor,
+            patience=cfg.early_stopping.patience,
+            min_delta=cfg.early_stopping.min_delta,
+        )
+    progressive_resizing = None
+    if cfg.progressive_resizing.enabled:
+        if export_test_loader is not None:
+            raise ValueError('Progressive resizing does not apply to cached features')
+        progressive_resizing = ProgressiveResizing(
+            cfg,
+            start_size=cfg.progressive_resizing.start_size,
+            ramp_epochs=cfg.progressive_resizing.ramp_epochs,
+            step=cfg.progressive_resizing.step,
+        )
+
+    train_profiler = None
+    eval_profiler = None
+    if cfg.profiler.enabled and is_main_process():
+        profiler_dir = os.path.join(HydraConfig.get().runtime.output_dir, 'profiler')
+        train_profiler, eval_profiler = (
+            TraceProfiler(
+                name,
+                profiler_dir,
+                cfg.device,
+                wait=cfg.profiler.wait,
+                warmup=cfg.profiler.warmup,
+                active=cfg.profiler.active,
+                record_shapes=cfg.profiler.record_shapes,
+                profile_memory=cfg.profiler.profile_memory,
+            )
+            for name in ('train', 'evaluate')
+        )
+
+    ema = None
+    if cfg.ema.enabled:
+        ema = AveragedWeights(unwrap(trained_model), decay=cfg.ema.decay)
+    swa = None
+    if cfg.swa.enabled:
+        swa = AveragedWeights(unwrap(trained_model))
+
+    teacher = None
+    teacher_test_loader = None
+    if cfg.distillation.enabled:
+        if cfg.feature_cache.enabled or cfg.progressive_resizing.enabled:
+            raise ValueError(
+                'Distillation does not apply to cached features or progressive resizing'
+            )
+        teacher, teacher_data = load_teacher(
+            cfg.distillation.teacher_model,
+            cfg.distillation.teacher_version,
+            cfg.device,
+        )
+        teacher_data.setdefault('image_size', cfg.model.image_size)
+        logits = cached_teacher_logits(teacher, teacher_data, cfg)
+
+        g = torch.Generator()
+        g.manual_seed(cfg.seed)
+        train_loader = make_distillation_loader(cfg, logits, g)
+        teacher_test_loader = make_test_loader(
+            cfg, g, shard=False, image_size=teacher_data['image_size']
+        )
+        loss_fn = DistillationLoss(
+            loss_fn,
+            temperature=cfg.distillation.temperature,
+            alpha=cfg.distillation.alpha,
+        )
+
+    time_budget_s = None
+    if cfg.time_budget_minutes is not None:
+        time_budget_s = cfg.time_budget_minutes * 60
+
     logger.info('Creating trainer')
     trainer = Trainer(
-        model=model,
+        model=trained_model,
         train_loader=train_loader,
         test_loader=test_loader,
         optimizer=optim,
@@ -93,6 +235,20 @@ def train(cfg: DictConfig):
         num_classes=cfg.data.num_classes,
         scheduler=scheduler,
         accumulation_steps=cfg.data.accumulation_steps,
+        export_model=model,
+        export_test_loader=export_test_loader,
+        early_stopping=early_stopping,
+        time_budget_s=time_budget_s,
+        progressive_resizing=progressive_resizing,
+        profile_loader=cfg.profile_loader,
+        train_profiler=train_profiler,
+        eval_profiler=eval_profiler,
+        ema=ema,
+        swa=swa,
+        swa_start=cfg.swa.start_epoch,
+        swa_bn_batches=cfg.swa.bn_batches,
+        teacher=teacher,
+        teacher_test_loader=teacher_test_loader,
     )
     logger.info('Starting training')
     trainer.train(
@@ -1,19 +1,102 @@
+import asyncio
 from contextlib import asynccontextmanager
-import json
 import logging
 import os.path
+import random
+import time
+from typing import Annotated, Literal
 
 import albumentations as A
-from fastapi import FastAPI, UploadFile, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+import numpy as np
+import orjson
 import torch
 import torch.nn as nn
-from torch.nn.functional import softmax
+from torch.profiler import record_function
 
-from skin_disease_recognition.core.config import ACTIVE_DEVICE, ACTIVE_MODEL, MODEL_DIR
-from skin_disease_recognition.serving.preprocessing import (
-    get_data_from_file,
-    make_transform,
+from skin_disease_recognition.core.config import (
+    ACTIVE_DEVICE,
+    ACTIVE_MODEL,
+    BULK_WEIGHT,
+    CANDIDATE_DIR,
+    CANDIDATE_FRACTION,
+    CANDIDATE_MODE,
+    CANDIDATE_MODEL,
+    CASCADE_MODEL,
+    GRPC_PORT,
+    INTERACTIVE_WEIGHT,
+    JOB_BATCH_SIZE,
+    JOB_LEASE_SECONDS,
+    JOB_WORKERS,
+    JOBS_DIR,
+    MODEL_DIR,
+    MONITOR_WINDOW,
+    PROFILE_DIR,
+    PROFILE_REQUESTS,
+    PROFILING_ENABLED,
+    REQUEST_TIMEOUT_MS,
+    SCHEDULER_MAX_BATCH,
+    SCHEDULER_RESERVED_INTERACTIVE,
+    SCHEDULER_WORKERS,
+    SERVING_MODE,
+    STREAM_MAX_SESSIONS,
+    STREAM_SMOOTHING,
+    TORCH_NUM_INTEROP_THREADS,
+    TORCH_NUM_THREADS,
+    WEB_CONCURRENCY,
+)
+from skin_disease_recognition.serving.candidate import (
+    CandidateWorker,
+    Comparison,
+    ComparisonStore,
+)
+from skin_disease_recognition.serving.cascade import load_cascade, should_escalate
+from skin_disease_recognition.serving.deadlines import (
+    CLIENT_CLOSED_REQUEST,
+    DropCounter,
+    RequestDeadline,
+)
+from skin_disease_recognition.serving.encoding import (
+    OrjsonResponse,
+    ResponseFormat,
+    encode_predictions,
+)
+from skin_disease_recognition.serving.inference import (
+    predict_feature_rows,
+    predict_proba,
+)
+from skin_disease_recognition.serving.jobs import JobStore, JobWorkerPool
+from skin_disease_recognition.serving.loading import load_artifacts
+from skin_disease_recognition.serving.monitoring import (
+    DriftMonitor,
+    RollingDriftMonitor,
 )
+from skin_disease_recognition.serving.preprocessing import get_data_from_file
+from skin_disease_recognition.serving.profiling import RequestProfiler
+from skin_disease_recognition.serving.scheduler import (
+    InferenceScheduler,
+    Lane,
+    Runner,
+)
+from skin_disease_recognition.serving.similarity import SimilarityIndex
+from skin_disease_recognition.serving.streaming import (
+    LatestFrame,
+    Smoother,
+    prepare_frame,
+    stream_message,
+)
+from skin_disease_recognition.serving.threads import configure_torch_threads
 
 logger = logging.getLogger(__name__)
 
@@ -27,78 +110,408 @@ async def lifespan(app: FastAPI):
     if device is None:
         raise ValueError('Active device name not found in .env')
 
+    artifacts['threads'] = configure_torch_threads(
+        mode=SERVING_MODE,
+        workers=WEB_CONCURRENCY,
+        num_threads=int(TORCH_NUM_THREADS) if TORCH_NUM_THREADS else None,
+        num_interop_threads=(
+            int(TORCH_NUM_INTEROP_THREADS) if TORCH_NUM_INTEROP_THREADS else None
+        ),
+    )
+
     model_storage = MODEL_DIR
     model_name: str = ACTIVE_MODEL
     if model_name is None:
         raise ValueError('Active model name not found in .env')
     model_folder = os.path.join(model_storage, model_name)
 
-    model_path = os.path.join(model_folder, 'model.pth')
-    data_path = os.path.join(model_folder, 'model_data.json')
-    classnames_path = os.path.join(model_folder, 'class_names.txt')
-    classif_report_path = os.path.join(model_folder, 'classification_report.json')
+    artifacts.update(load_artifacts(model_folder, device))
 
-    try:
-        model: nn.Module = torch.load(
-            model_path, weights_only=False, map_location=torch.device(device)
+    # Optional first stage: a small model answering the confident requests
+    artifacts['cascade'] = None
+    if CASCADE_MODEL is not None:
+        cascade_folder = os.path.join(model_storage, CASCADE_MODEL)
+        cascade = load_artifacts(cascade_folder, device)
+        cascade['settings'] = load_cascade(cascade_folder)
+        if cascade['settings']['large_model'] != model_name:
+            raise ValueError(
+                f'Cascade was calibrated against '
+                f'{cascade["settings"]["large_model"]}, not {model_name}'
+            )
+        if cascade['classes'] != artifacts['classes']:
+            raise ValueError('Cascade model classes do not match the active model')
+        artifacts['cascade'] = cascade
+        logger.info(f'Cascade enabled with {CASCADE_MODEL} as the first stage')
+
+    # Optional candidate model, compared off the request path
+    artifacts['candidate'] = None
+    if CANDIDATE_MODEL is not None:
+        if CANDIDATE_MODE not in ('shadow', 'canary'):
+            raise ValueError(f'Unknown candidate mode: {CANDIDATE_MODE}')
+        candidate = load_artifacts(os.path.join(model_storage, CANDIDATE_MODEL), device)
+        if candidate['classes'] != artifacts['classes']:
+            raise ValueError('Candidate model classes do not match the active model')
+        candidate['same_input'] = all(
+            candidate['metadata'].get(key) == artifacts['metadata'].get(key)
+            for key in ('image_size', 'input_format')
+        )
+        candidate['worker'] = CandidateWorker(
+            ComparisonStore(CANDIDATE_DIR), artifacts, candidate, CANDIDATE_MODEL
+        )
+        candidate['worker'].start()
+        artifacts['candidate'] = candidate
+        logger.info(
+            f'Candidate {CANDIDATE_MODEL} in {CANDIDATE_MODE} mode on '
+            f'{CANDIDATE_FRACTION:.0%} of predict requests'
         )
-        model.eval()
-        artifacts['model'] = model
-        logger.info('Model loaded successfully')
-    except FileNotFoundError as e:
-        raise ValueError('Model not found') from e
 
-    try:
-        with open(data_path) as f:
-            data = json.load(f)
-        artifacts['metadata'] = data
-    except FileNotFoundError as e:
-        raise ValueError('Metadata not found') from e
+    artifacts['scheduler'] = None
+    if SCHEDULER_WORKERS > 0:
+        runners = {
+            'default': make_runner('default', artifacts['model'], device),
+            # Embeddings for /embed and similar cases, batched like predictions
+            'features': make_runner(
+                'features', artifacts['model'], device, predict_feature_rows
+            ),
+        }
+        for key in ('cascade', 'candidate'):
+            if artifacts[key] is not None:
+                runners[key] = make_runner(key, artifacts[key]['model'], device)
+        scheduler = InferenceScheduler(
+            runners,
+            num_workers=SCHEDULER_WORKERS,
+            reserved=SCHEDULER_RESERVED_INTERACTIVE,
+            weights={'interactive': INTERACTIVE_WEIGHT, 'bulk': BULK_WEIGHT},
+            max_batch=SCHEDULER_MAX_BATCH,
+        )
+        scheduler.start()
+        artifacts['scheduler'] = scheduler
 
-    try:
-        with open(classnames_path) as f:
-            classes = f.read()
-        classes = classes.split()
-        artifacts['classes'] = classes
-    except FileNotFoundError as e:
-        raise ValueError('Class names not found') from e
+    job_store = JobStore(JOBS_DIR, lease=JOB_LEASE_SECONDS)
+    job_workers = JobWorkerPool(
+        job_store,
+        artifacts,
+        num_workers=JOB_WORKERS,
+        batch_size=JOB_BATCH_SIZE,
+        scheduler=artifacts['scheduler'],
+    )
+    job_workers.start()
+    artifacts['job_store'] = job_store
+    artifacts['job_workers'] = job_workers
 
-    try:
-        with open(classif_report_path) as f:
-            report_data = json.load(f)
-        artifacts['report'] = report_data
-    except FileNotFoundError as e:
-        raise ValueError('Metadata not found') from e
+    profiler = RequestProfiler(PROFILE_DIR, device)
+    if PROFILE_REQUESTS > 0:
+        logger.info(f'Profiling the first {PROFILE_REQUESTS} predict requests')
+        profiler.arm(PROFILE_REQUESTS)
+    artifacts['profiler'] = profiler
+    artifacts['drops'] = DropCounter()
+    artifacts['monitor'] = RollingDriftMonitor(artifacts['classes'], MONITOR_WINDOW)
+    artifacts['streams'] = 0
+
+    # gRPC service on the same artifacts, for non-browser callers
+    artifacts['grpc'] = None
+    if GRPC_PORT > 0:
+        # grpcio is only needed when the service is on
+        from skin_disease_recognition.serving.grpc_server import start_server
 
-    transform = make_transform(artifacts['metadata']['image_size'])
-    artifacts['transform'] = transform
+        artifacts['grpc'], port = start_server(artifacts, GRPC_PORT)
+        logger.info(f'gRPC inference service listening on port {port}')
 
     yield
 
+    if artifacts['grpc'] is not None:
+        artifacts['grpc'].stop(grace=5).wait()
+    profiler.close()
+
+    job_workers.stop()
+    if artifacts['scheduler'] is not None:
+        artifacts['scheduler'].stop()
+    if artifacts['candidate'] is not None:
+        artifacts['candidate']['worker'].stop()
     artifacts.clear()
 
 
-app = FastAPI(lifespan=lifespan, root_path='/api')
+def make_runner(
+    name: str, model: nn.Module, device: str, predict=predict_proba
+) -> Runner:
+    def run(batch: torch.Tensor) -> np.ndarray:
+        # Opened on the thread running the forward, so ranges never interleave
+        with record_function(name):
+            return predict(model, batch, device)
+
+    return run
+
+
+app = FastAPI(
+    lifespan=lifespan, root_path='/api', default_response_class=OrjsonResponse
+)
+
+
+@app.middleware('http')
+async def stamp_arrival(request: Request, call_next):
+    # Deadlines count from arrival, before the upload is parsed
+    request.state.received_at = time.monotonic()
+    return await call_next(request)
+
+
+TimeoutHeader = Annotated[float | None, Header(alias='X-Request-Timeout-Ms', gt=0)]
+
+
+def get_deadline(request: Request, timeout_ms: TimeoutHeader = None) -> RequestDeadline:
+    if timeout_ms is None and REQUEST_TIMEOUT_MS > 0:
+        timeout_ms = REQUEST_TIMEOUT_MS
+    return RequestDeadline(
+        request,
+        timeout_ms,
+        artifacts['drops'],
+        received_at=getattr(request.state, 'received_at', None),
+    )
+
+
+Deadline = Annotated[RequestDeadline, Depends(get_deadline)]
+
+PriorityHeader = Annotated[
+    Literal['interactive', 'bulk'] | None, Header(alias='X-Priority')
+]
+BULK_PATHS = {'/bulk/predict'}
+# How often a request waiting for the scheduler checks for a disconnect
+DISCONNECT_POLL_S = 0.05
+
+
+def get_lane(request: Request, priority: PriorityHeader = None) -> Lane:
+    if priority is not None:
+        return priority
+    return 'bulk' if request.scope['route'].path in BULK_PATHS else 'interactive'
+
+
+async def infer(
+    model_key: str,
+    data: torch.Tensor,
+    lane: Lane,
+    deadline: RequestDeadline,
+    offload: bool = False,
+) -> tuple[np.ndarray, float]:
+    """
+    Probabilities of a single-image batch, through the scheduler if enabled,
+    and the duration of the forward pass in ms.
+    Without it, `offload` runs the forward pass in a thread instead of the
+    event loop. The 'features' model key returns `predict_feature_rows` of
+    the active model instead.
+    """
+    await deadline.check('forward')
+    scheduler: InferenceScheduler | None = artifacts['scheduler']
+    if scheduler is None:
+        predict = predict_proba
+        if model_key == 'default':
+            model = artifacts['model']
+        elif model_key == 'features':
+            model, predict = artifacts['model'], predict_feature_rows
+        else:
+            model = artifacts[model_key]['model']
+        runner = make_runner(model_key, model, artifacts['device'], predict)
+        start = time.perf_counter()
+        probs = await asyncio.to_thread(runner, data) if offload else runner(data)
+        return probs[0], (time.perf_counter() - start) * 1000
+
+    future = scheduler.submit(data, lane, model=model_key, deadline=deadline)
+    waiter = asyncio.wrap_future(future)
+    # Starlette does not cancel handlers of disconnected clients, so poll
+    while not (await asyncio.wait({waiter}, timeout=DISCONNECT_POLL_S))[0]:
+        if await deadline.disconnected() and future.cancel():
+            # The scheduler counts the drop when it reaches the cancelled work
+            raise HTTPException(
+                status_code=CLIENT_CLOSED_REQUEST,
+                detail='Client disconnected before forward',
+            )
+    return waiter.result()[0], future.forward_ms
 
 
 @app.post('/predict', status_code=status.HTTP_200_OK)
-async def predict(file: UploadFile):
+@app.post('/bulk/predict', status_code=status.HTTP_200_OK)
+async def predict(
+    file: UploadFile,
+    deadline: Deadline,
+    lane: Annotated[Lane, Depends(get_lane)],
+    top_k: Annotated[int | None, Query(ge=1)] = None,
+    threshold: Annotated[float | None, Query(ge=0.0, le=1.0)] = None,
+    decimals: Annotated[int | None, Query(ge=0, le=8)] = None,
+    response_format: Annotated[ResponseFormat, Query(alias='format')] = 'dict',
+    similar: Annotated[int | None, Query(ge=1, le=50)] = None,
+):
+    transform: A.Compose = artifacts['transform']
+    classes: list[str] = artifacts['classes']
+
+    if similar is not None:
+        index = get_index()
+
+    await deadline.check('decode')
+    mat = await get_data_from_file(file)
+
+    cascade = artifacts['cascade']
+    candidate = artifacts['candidate']
+    sampled = (
+        candidate is not None
+        and similar is None
+        and random.random() < CANDIDATE_FRACTION
+    )
+    served = 'candidate' if sampled and CANDIDATE_MODE == 'canary' else 'primary'
+    stage = None if cascade is None or served == 'candidate' else 'large'
+    probs = None
+    served_ms = None
+    data = None
+    extra = None
+    with artifacts['profiler'].record():
+        if served == 'candidate':
+            data = candidate['transform'](image=mat)['image'].unsqueeze(0)
+            probs, served_ms = await infer('candidate', data, lane, deadline)
+
+        # Similar cases come from the large model's embeddings
+        if probs is None and cascade is not None and similar is None:
+            small_data = cascade['transform'](image=mat)['image'].unsqueeze(0)
+            probs, _ = await infer('cascade', small_data, lane, deadline)
+            if should_escalate(probs, cascade['settings']):
+                probs = None
+            else:
+                stage = 'small'
+
+        if probs is None:
+            data = transform(image=mat)['image'].unsqueeze(0)
+
+            if similar is None:
+                probs, served_ms = await infer('default', data, lane, deadline)
+            else:
+                row, _ = await infer('features', data, lane, deadline, offload=True)
+                probs, embedding = row[: len(classes)], row[len(classes) :]
+                cases = await asyncio.to_thread(
+                    index.similar_cases, embedding, similar, classes
+                )
+                extra = {'similar_cases': cases}
+    artifacts['monitor'].update(mat, probs)
+
+    # Small-model answers of the cascade are not the primary's to compare
+    if sampled and stage != 'small':
+        # The other model runs on the candidate worker, after the response
+        reuse = data is not None and candidate['same_input']
+        candidate['worker'].offer(
+            Comparison(
+                image=mat,
+                tensor=data[0] if reuse else None,
+                served=served,
+                served_class=int(probs.argmax()),
+                served_ms=served_ms,
+            )
+        )
+
+    headers = {}
+    if stage is not None:
+        headers['X-Cascade-Stage'] = stage
+        if response_format != 'float32':
+            extra = {**(extra or {}), 'stage': stage}
+    if candidate is not None:
+        headers['X-Served-By'] = served
+
+    return encode_predictions(
+        probs,
+        classes,
+        response_format=response_format,
+        top_k=top_k,
+        threshold=threshold,
+        decimals=decimals,
+        extra=extra,
+        headers=headers or None,
+    )
+
+
+@app.websocket('/ws/predict')
+async def predict_stream(
+    websocket: WebSocket,
+    smoothing: Annotated[float, Query(ge=0.0, lt=1.0)] = STREAM_SMOOTHING,
+    top_k: Annotated[int | None, Query(ge=1)] = None,
+):
+    await websocket.accept()
+    if artifacts['streams'] >= STREAM_MAX_SESSIONS:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    artifacts['streams'] += 1
+
     transform: A.Compose = artifacts['transform']
-    model: nn.Module = artifacts['model']
     classes: list[str] = artifacts['classes']
-    device = artifacts['device']
+    drops: DropCounter = artifacts['drops']
+    deadline = RequestDeadline(None, None, drops)
+    frames = LatestFrame()
+    smoother = Smoother(smoothing)
+
+    async def receive():
+        try:
+            while (message := await websocket.receive())['type'] == 'websocket.receive':
+                if message.get('bytes') is not None and frames.put(message['bytes']):
+                    drops.record('stale', 'stream')
+        finally:
+            frames.close()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        # Frames that arrive meanwhile replace each other, the newest is next
+        while (item := await frames.get()) is not None:
+            seq, frame = item
+            start = time.perf_counter()
+            data = await asyncio.to_thread(prepare_frame, frame, transform)
+            if data is None:
+                await websocket.send_text(
+                    orjson.dumps({'frame': seq, 'error': 'Invalid image'}).decode()
+                )
+                continue
+            probs, _ = await infer(
+                'default', data, 'interactive', deadline, offload=True
+            )
+            message = stream_message(
+                seq,
+                smoother.update(probs),
+                classes,
+                top_k,
+                frames.dropped,
+                (time.perf_counter() - start) * 1000,
+            )
+            await websocket.send_text(orjson.dumps(message).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        artifacts['streams'] -= 1
+
 
+def get_index() -> SimilarityIndex:
+    index = artifacts['index']
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Similar-case index has not been built for this model',
+        )
+    return index
+
+
+@app.post('/embed', status_code=status.HTTP_200_OK)
+async def embed(
+    file: UploadFile,
+    deadline: Deadline,
+    lane: Annotated[Lane, Depends(get_lane)],
+):
+    transform: A.Compose = artifacts['transform']
+
+    await deadline.check('decode')
     mat = await get_data_from_file(file)
     data: torch.Tensor = transform(image=mat)['image']
-    data = data.unsqueeze(0).to(device)
+    data = data.unsqueeze(0)
+
+    row, _ = await infer('features', data, lane, deadline, offload=True)
+
+    return {'embedding': row[len(artifacts['classes']) :].tolist()}
 
-    with torch.no_grad():
-        pred = model(data)
-        soft = softmax(pred, dim=1)
-    soft = soft.tolist()[0]
-    result = {c: p for c, p in zip(classes, soft, strict=True)}
 
-    return {'predictions': result}
+@app.get('/similar', status_code=status.HTTP_200_OK)
+async def similar_info():
+    index = get_index()
+    return {'size': len(index), 'dim': index.dim}
 
 
 @app.get('/info', status_code=status.HTTP_200_OK)
@@ -106,7 +519,17 @@ async def info():
     model_info_response = {
         'model_name': artifacts['metadata']['model_name'],
         'model_version': artifacts['metadata']['version'],
+        'threads': artifacts['threads'],
+        'classes': artifacts['classes'],
     }
+    cascade = artifacts['cascade']
+    if cascade is not None:
+        model_info_response['cascade'] = {
+            'model_name': cascade['metadata']['model_name'],
+            'model_version': cascade['metadata']['version'],
+            'criterion': cascade['settings']['criterion'],
+            'threshold': cascade['settings']['threshold'],
+        }
 
     response = model_info_response
 
@@ -116,3 +539,101 @@ async def info():
 @app.get('/report', status_code=status.HTTP_200_OK)
 async def report():
     return artifacts['report']
+
+
+@app.get('/metrics', status_code=status.HTTP_200_OK)
+async def metrics():
+    scheduler: InferenceScheduler | None = artifacts['scheduler']
+    return {
+        'dropped': artifacts['drops'].snapshot(),
+        'lanes': None if scheduler is None else scheduler.stats(),
+    }
+
+
+@app.get('/monitoring', status_code=status.HTTP_200_OK)
+async def monitoring():
+    monitor: RollingDriftMonitor = artifacts['monitor']
+    reference: DriftMonitor | None = artifacts['reference']
+    return {
+        'live': monitor.summary(),
+        'reference': None if reference is None else reference.summary(),
+        'drift': None if reference is None else monitor.compare(reference),
+    }
+
+
+@app.get('/candidate', status_code=status.HTTP_200_OK)
+async def candidate_summary():
+    candidate = artifacts['candidate']
+    if candidate is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='No candidate model configured',
+        )
+    worker: CandidateWorker = candidate['worker']
+    summary = await asyncio.to_thread(
+        worker.store.summary, worker.candidate_name, artifacts['classes']
+    )
+    return {
+        'mode': CANDIDATE_MODE,
+        'fraction': CANDIDATE_FRACTION,
+        'skipped': worker.skipped,
+        **summary,
+    }
+
+
+# Job endpoints are sync, so SQLite and upload copies run in the threadpool
+@app.post('/jobs', status_code=status.HTTP_202_ACCEPTED)
+def submit_job(files: list[UploadFile]):
+    job_store: JobStore = artifacts['job_store']
+    job_id, total = job_store.create_job((f.filename, f.file) for f in files)
+    artifacts['job_workers'].notify()
+
+    return {'job_id': job_id, 'total': total}
+
+
+@app.get('/jobs/{job_id}', status_code=status.HTTP_200_OK)
+def job_status(job_id: str):
+    job = artifacts['job_store'].status(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return job
+
+
+@app.get('/jobs/{job_id}/results', status_code=status.HTTP_200_OK)
+def job_results(
+    job_id: str,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+):
+    job_store: JobStore = artifacts['job_store']
+    if job_store.status(job_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return {
+        'job_id': job_id,
+        'classes': artifacts['classes'],
+        'results': job_store.results(job_id, offset=offset, limit=limit),
+    }
+
+
+def get_profiler() -> RequestProfiler:
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return artifacts['profiler']
+
+
+@app.post('/admin/profile', status_code=status.HTTP_202_ACCEPTED)
+async def start_profile(requests: Annotated[int, Query(ge=1, le=1000)] = 20):
+    profiler = get_profiler()
+    try:
+        name = profiler.arm(requests)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+
+    return {'name': name, 'requests': requests}
+
+
+@app.get('/admin/profile', status_code=status.HTTP_200_OK)
+async def profile_status():
+    return get_profiler().status()
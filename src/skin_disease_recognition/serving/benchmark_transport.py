@@ -0,0 +1,170 @@
+import argparse
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from pathlib import Path
+import queue
+import time
+
+import grpc
+import httpx
+import pandas as pd
+
+from skin_disease_recognition.core.config import GRPC_PORT, PROJECT_ROOT
+from skin_disease_recognition.modeling.benchmark import time_calls
+from skin_disease_recognition.serving.grpc_server import (
+    BatchPredictRequest,
+    InferenceStub,
+    PredictRequest,
+)
+
+BENCHMARK_DIR = PROJECT_ROOT / 'benchmarks'
+TRANSPORTS = ('http_json', 'http_float32', 'grpc', 'grpc_stream', 'grpc_batch')
+
+
+class StreamCaller:
+    """Sends each image over one open PredictStream and waits for its reply."""
+
+    def __init__(self, stub: InferenceStub):
+        self._requests = queue.SimpleQueue()
+        self._responses = stub.PredictStream(iter(self._requests.get, None))
+
+    def __call__(self, image: bytes):
+        self._requests.put(PredictRequest(image=image))
+        return next(self._responses)
+
+    def close(self):
+        self._requests.put(None)
+
+
+def make_caller(
+    transport: str,
+    http: httpx.Client,
+    stub: InferenceStub,
+    image: bytes,
+    batch_size: int,
+    streams: list[StreamCaller],
+) -> Callable[[], object]:
+    """
+    One request of `transport` per call, a batch of images for grpc_batch.
+    Opened streams are added to `streams` to be closed by the caller.
+    """
+    if transport.startswith('http'):
+        response_format = 'dict' if transport == 'http_json' else 'float32'
+
+        def call():
+            response = http.post(
+                '/predict',
+                params={'format': response_format},
+                files={'file': ('image.jpg', image, 'image/jpeg')},
+            )
+            response.raise_for_status()
+
+        return call
+    if transport == 'grpc':
+        request = PredictRequest(image=image)
+        return lambda: stub.Predict(request)
+    if transport == 'grpc_stream':
+        stream = StreamCaller(stub)
+        streams.append(stream)
+        return lambda: stream(image)
+    request = BatchPredictRequest(images=[image] * batch_size)
+    return lambda: stub.PredictBatch(request)
+
+
+def measure_throughput(calls: list[Callable[[], object]], requests: int) -> float:
+    """Requests per second with one thread per caller sharing `requests`."""
+    per_caller = max(requests // len(calls), 1)
+
+    def work(call):
+        for _ in range(per_caller):
+            call()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(calls)) as pool:
+        list(pool.map(work, calls))
+    return per_caller * len(calls) / (time.perf_counter() - start)
+
+
+def run_benchmark(
+    http: httpx.Client,
+    stub: InferenceStub,
+    image: bytes,
+    transports: list[str],
+    requests: int = 200,
+    concurrency: int = 8,
+    batch_size: int = 8,
+    warmup: int = 5,
+    iters: int = 50,
+) -> pd.DataFrame:
+    """
+    Client-side latency of sequential requests and throughput of
+    `concurrency` parallel callers, for each transport against the same
+    serving process. Throughput counts images, so grpc_batch is comparable.
+    """
+    rows = []
+    streams = []
+    for transport in transports:
+        images = batch_size if transport == 'grpc_batch' else 1
+
+        def caller(transport=transport):
+            return make_caller(transport, http, stub, image, batch_size, streams)
+
+        latency = time_calls(caller(), 'cpu', warmup, iters)
+        calls = [caller() for _ in range(concurrency)]
+        rows.append(
+            {
+                'transport': transport,
+                'images_per_call': images,
+                **latency,
+                'concurrency': concurrency,
+                'images_per_s': images * measure_throughput(calls, requests),
+            }
+        )
+    for stream in streams:
+        stream.close()
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare gRPC and HTTP predict latency and throughput'
+    )
+    parser.add_argument('--image', type=Path, required=True)
+    parser.add_argument('--http-url', default='http://localhost:8000')
+    parser.add_argument('--grpc-target', default=f'localhost:{GRPC_PORT or 50051}')
+    parser.add_argument(
+        '--transports', nargs='+', choices=TRANSPORTS, default=TRANSPORTS
+    )
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--iters', type=int, default=50)
+    parser.add_argument('--output', type=Path, default=BENCHMARK_DIR / 'transport.csv')
+    args = parser.parse_args()
+    # One INFO line per request otherwise
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    with (
+        httpx.Client(base_url=args.http_url, timeout=60) as http,
+        grpc.insecure_channel(args.grpc_target) as channel,
+    ):
+        table = run_benchmark(
+            http,
+            InferenceStub(channel),
+            args.image.read_bytes(),
+            list(args.transports),
+            requests=args.requests,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            warmup=args.warmup,
+            iters=args.iters,
+        )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output, index=False)
+    print(table.to_string(index=False, float_format='%.2f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import logging
+import os.path
+
+from torch.utils.data import DataLoader
+
+from skin_disease_recognition.core.config import (
+    ACTIVE_DEVICE,
+    ACTIVE_MODEL,
+    MODEL_DIR,
+    PROJECT_ROOT,
+)
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.serving.loading import load_artifacts
+from skin_disease_recognition.serving.similarity import SimilarityIndex, embed_loader
+
+logger = logging.getLogger(__name__)
+
+
+def build_index(
+    model_folder: str | os.PathLike,
+    data_dir: str | os.PathLike,
+    device: str,
+    batch_size: int = 64,
+    num_workers: int = 4,
+) -> SimilarityIndex:
+    loaded = load_artifacts(model_folder, device)
+    dataset = SkinDataset(data_dir, transform=loaded['transform'])
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+
+    logger.info(f'Embedding {len(dataset)} images from {data_dir}')
+    embeddings = embed_loader(loaded['model'], loader, device)
+
+    paths = []
+    for path, _ in dataset.base_dataset.samples:
+        try:
+            paths.append(os.path.relpath(path, PROJECT_ROOT))
+        except ValueError:
+            paths.append(path)
+
+    index = SimilarityIndex(embeddings, dataset.targets, paths)
+    index.save(model_folder)
+    logger.info(f'Saved {len(index)} x {index.dim} embeddings to {model_folder}')
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Embed the training set into a similar-case search index'
+    )
+    parser.add_argument('--model', default=ACTIVE_MODEL)
+    parser.add_argument(
+        '--data-dir', default=PROJECT_ROOT / 'data/raw/SkinDisease/train'
+    )
+    parser.add_argument('--device', default=ACTIVE_DEVICE or 'cpu')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    build_index(
+        MODEL_DIR / args.model,
+        args.data_dir,
+        args.device,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+    )
@@ -0,0 +1,80 @@
+import argparse
+from functools import partial
+import logging
+import os.path
+
+import torch
+from torch.utils.data import DataLoader
+
+from skin_disease_recognition.core.config import (
+    ACTIVE_DEVICE,
+    ACTIVE_MODEL,
+    MODEL_DIR,
+    PROJECT_ROOT,
+)
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.serving.inference import predict_proba
+from skin_disease_recognition.serving.loading import load_artifacts
+from skin_disease_recognition.serving.monitoring import DriftMonitor, image_stats
+
+logger = logging.getLogger(__name__)
+
+
+def collate_with_stats(batch: list, transform) -> tuple[torch.Tensor, list]:
+    """Raw images to a model batch plus the image statistics of each one."""
+    stats = [image_stats(image) for image, _ in batch]
+    images = torch.stack([transform(image=image)['image'] for image, _ in batch])
+    return images, stats
+
+
+def build_reference(
+    model_folder: str | os.PathLike,
+    data_dir: str | os.PathLike,
+    device: str,
+    batch_size: int = 64,
+    num_workers: int = 4,
+) -> DriftMonitor:
+    """Profiles the model's predictions on `data_dir` as the drift reference."""
+    loaded = load_artifacts(model_folder, device)
+    dataset = SkinDataset(data_dir)
+    if dataset.classes != loaded['classes']:
+        raise ValueError(f'Classes in {data_dir} do not match the model')
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=partial(collate_with_stats, transform=loaded['transform']),
+    )
+
+    logger.info(f'Profiling {len(dataset)} images from {data_dir}')
+    reference = DriftMonitor(loaded['classes'])
+    for images, stats in loader:
+        probs = predict_proba(loaded['model'], images, loaded['device'])
+        for (height, width, means), row in zip(stats, probs, strict=True):
+            reference.record(height, width, means, row)
+
+    reference.save(model_folder)
+    logger.info(f'Saved a reference profile of {reference.count} images')
+    return reference
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Profile the test set as the reference for drift monitoring'
+    )
+    parser.add_argument('--model', default=ACTIVE_MODEL)
+    parser.add_argument(
+        '--data-dir', default=PROJECT_ROOT / 'data/raw/SkinDisease/test'
+    )
+    parser.add_argument('--device', default=ACTIVE_DEVICE or 'cpu')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    build_reference(
+        MODEL_DIR / args.model,
+        args.data_dir,
+        args.device,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+    )
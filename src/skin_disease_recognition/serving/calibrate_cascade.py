@@ -0,0 +1,115 @@
+import argparse
+import logging
+import os.path
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+from skin_disease_recognition.core.config import (
+    ACTIVE_DEVICE,
+    ACTIVE_MODEL,
+    MODEL_DIR,
+    PROJECT_ROOT,
+)
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.modeling.benchmark import measure_latency
+from skin_disease_recognition.serving.cascade import (
+    CRITERIA,
+    calibrate_threshold,
+    save_cascade,
+)
+from skin_disease_recognition.serving.inference import predict_proba
+from skin_disease_recognition.serving.loading import load_artifacts
+
+logger = logging.getLogger(__name__)
+
+
+def held_out_predictions(
+    loaded: dict, data_dir: str | os.PathLike, batch_size: int, num_workers: int
+) -> tuple[np.ndarray, np.ndarray]:
+    dataset = SkinDataset(data_dir, transform=loaded['transform'])
+    if dataset.classes != loaded['classes']:
+        raise ValueError(f'Classes in {data_dir} do not match the model')
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+    probs = [
+        predict_proba(loaded['model'], images, loaded['device']) for images, _ in loader
+    ]
+    return np.concatenate(probs), np.asarray(dataset.targets)
+
+
+def calibrate_cascade(
+    small_folder: str | os.PathLike,
+    large_folder: str | os.PathLike,
+    data_dir: str | os.PathLike,
+    target_accuracy: float,
+    device: str,
+    criterion: str = 'auto',
+    batch_size: int = 64,
+    num_workers: int = 4,
+) -> dict:
+    """
+    Scores the held-out set with both models, times them, and saves the
+    cheapest escalation threshold reaching `target_accuracy` to the small
+    model's folder.
+    """
+    stages = {}
+    for stage, folder in (('small', small_folder), ('large', large_folder)):
+        loaded = load_artifacts(folder, device)
+        size = loaded['metadata']['image_size']
+        latency = measure_latency(loaded['model'], (1, 3, size, size), device)
+        probs, labels = held_out_predictions(loaded, data_dir, batch_size, num_workers)
+        stages[stage] = (probs, latency['latency_ms_mean'])
+        logger.info(
+            f'{stage} model {loaded["metadata"]["model_name"]}: '
+            f'{latency["latency_ms_mean"]:.1f} ms per image'
+        )
+
+    (small_probs, small_ms), (large_probs, large_ms) = stages['small'], stages['large']
+    criteria = CRITERIA if criterion == 'auto' else (criterion,)
+    results = [
+        calibrate_threshold(
+            small_probs, large_probs, labels, target_accuracy, small_ms, large_ms, c
+        )
+        for c in criteria
+    ]
+    settings = min(results, key=lambda r: (r['expected_latency_ms'], -r['accuracy']))
+    settings['large_model'] = os.path.basename(os.path.normpath(large_folder))
+    settings['small_latency_ms'] = small_ms
+    settings['large_latency_ms'] = large_ms
+
+    save_cascade(small_folder, settings)
+    logger.info(
+        f'Escalate when {settings["criterion"]} < {settings["threshold"]:.4f}: '
+        f'{settings["escalation_rate"]:.0%} escalated, accuracy '
+        f'{settings["accuracy"]:.4f}, {settings["expected_latency_ms"]:.1f} ms '
+        f'expected vs {large_ms:.1f} ms for the large model alone'
+    )
+    return settings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Calibrate the escalation threshold of a two-model cascade'
+    )
+    parser.add_argument('--small', required=True, help='First-stage model folder')
+    parser.add_argument('--large', default=ACTIVE_MODEL)
+    parser.add_argument(
+        '--data-dir', default=PROJECT_ROOT / 'data/raw/SkinDisease/test'
+    )
+    parser.add_argument('--target-accuracy', type=float, required=True)
+    parser.add_argument('--criterion', choices=['auto', *CRITERIA], default='auto')
+    parser.add_argument('--device', default=ACTIVE_DEVICE or 'cpu')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    calibrate_cascade(
+        MODEL_DIR / args.small,
+        MODEL_DIR / args.large,
+        args.data_dir,
+        args.target_accuracy,
+        args.device,
+        criterion=args.criterion,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+    )
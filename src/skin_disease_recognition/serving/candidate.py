@@ -0,0 +1,185 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import torch
+
+from skin_disease_recognition.serving.inference import predict_proba
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comparisons (
+    created REAL NOT NULL,
+    candidate TEXT NOT NULL,
+    served TEXT NOT NULL,
+    primary_class INTEGER NOT NULL,
+    candidate_class INTEGER NOT NULL,
+    primary_ms REAL NOT NULL,
+    candidate_ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comparisons_candidate ON comparisons (candidate, created);
+"""
+
+
+class ComparisonStore:
+    """
+    Compact SQLite log of primary vs candidate predictions, one row per
+    sampled request: top-1 class indices and inference times of both models.
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / 'comparisons.sqlite'
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, rows: list[tuple[str, str, int, int, float, float]]):
+        """Rows of (candidate, served, primary_class, candidate_class, ms, ms)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO comparisons (created, candidate, served, primary_class, '
+                'candidate_class, primary_ms, candidate_ms) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(now, *row) for row in rows],
+            )
+
+    def summary(
+        self, candidate: str, classes: list[str], top: int = 10, window: int = 10000
+    ) -> dict:
+        """Agreement, most frequent disagreements and latency of the last rows."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT served, primary_class, candidate_class, primary_ms, '
+                'candidate_ms FROM comparisons WHERE candidate = ? '
+                'ORDER BY created DESC LIMIT ?',
+                (candidate, window),
+            ).fetchall()
+
+        result = {'candidate': candidate, 'compared': len(rows)}
+        if not rows:
+            return result
+        served = np.array([row[0] for row in rows])
+        values = np.array([row[1:] for row in rows], dtype=np.float64)
+        primary, cand = values[:, 0].astype(int), values[:, 1].astype(int)
+        agree = primary == cand
+
+        mismatches = np.stack([primary[~agree], cand[~agree]], axis=1)
+        pairs, counts = np.unique(mismatches, axis=0, return_counts=True)
+        order = np.argsort(counts, kind='stable')[::-1][:top]
+        result['agreement'] = float(agree.mean())
+        result['canary_served'] = int((served == 'candidate').sum())
+        result['disagreements'] = [
+            {
+                'primary': classes[pairs[i][0]],
+                'candidate': classes[pairs[i][1]],
+                'count': int(counts[i]),
+            }
+            for i in order
+        ]
+        for name, column in (('primary', values[:, 2]), ('candidate', values[:, 3])):
+            result[f'{name}_latency_ms_p50'] = float(np.percentile(column, 50))
+            result[f'{name}_latency_ms_p95'] = float(np.percentile(column, 95))
+        return result
+
+
+@dataclass
+class Comparison:
+    """A served prediction waiting for the other model's opinion."""
+
+    image: np.ndarray
+    tensor: torch.Tensor | None
+    served: str
+    served_class: int
+    served_ms: float
+
+
+class CandidateWorker:
+    """
+    Background thread running the model that did not answer a sampled
+    request (the candidate in shadow mode, the primary for canary traffic)
+    and logging both predictions to a ComparisonStore. Latencies are forward
+    passes only: the served one as timed where it ran, the other one here.
+
+    `offer` never blocks: when the queue is full the comparison is skipped.
+    """
+
+    def __init__(
+        self,
+        store: ComparisonStore,
+        primary: dict,
+        candidate: dict,
+        candidate_name: str,
+        max_queue: int = 256,
+    ):
+        self.store = store
+        self.loaded = {'primary': primary, 'candidate': candidate}
+        self.candidate_name = candidate_name
+        self.skipped = 0
+        self._queue: queue.Queue[Comparison | None] = queue.Queue(max_queue)
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='candidate-worker', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        # Let queued comparisons finish, then the sentinel stops the thread
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def offer(self, comparison: Comparison) -> bool:
+        try:
+            self._queue.put_nowait(comparison)
+        except queue.Full:
+            self.skipped += 1
+            return False
+        return True
+
+    def _run(self):
+        while (comparison := self._queue.get()) is not None:
+            try:
+                self._compare(comparison)
+            except Exception:
+                logger.exception('Candidate comparison failed')
+
+    def _compare(self, comparison: Comparison):
+        other = 'candidate' if comparison.served == 'primary' else 'primary'
+        loaded = self.loaded[other]
+        tensor = comparison.tensor
+        if tensor is None:
+            tensor = loaded['transform'](image=comparison.image)['image']
+        start = time.perf_counter()
+        probs = predict_proba(loaded['model'], tensor.unsqueeze(0), loaded['device'])
+        other_ms = (time.perf_counter() - start) * 1000
+        other_class = int(probs[0].argmax())
+
+        if comparison.served == 'primary':
+            classes = (comparison.served_class, other_class)
+            times = (comparison.served_ms, other_ms)
+        else:
+            classes = (other_class, comparison.served_class)
+            times = (other_ms, comparison.served_ms)
+        self.store.add([(self.candidate_name, comparison.served, *classes, *times)])
@@ -0,0 +1,104 @@
+import json
+import logging
+import os.path
+from typing import Literal
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CASCADE_FILE = 'cascade.json'
+
+Criterion = Literal['max_prob', 'margin']
+CRITERIA: tuple[Criterion, ...] = ('max_prob', 'margin')
+
+
+def confidence(probs: np.ndarray, criterion: Criterion) -> np.ndarray:
+    """
+    Confidence of (N, classes) probabilities: the top probability or the
+    margin between the two most probable classes.
+    """
+    probs = np.atleast_2d(probs)
+    if criterion == 'max_prob':
+        return probs.max(axis=1)
+    if criterion == 'margin':
+        top2 = np.partition(probs, -2, axis=1)[:, -2:]
+        return top2[:, 1] - top2[:, 0]
+    raise ValueError(f'Unknown cascade criterion: {criterion}')
+
+
+def calibrate_threshold(
+    small_probs: np.ndarray,
+    large_probs: np.ndarray,
+    labels: np.ndarray,
+    target_accuracy: float,
+    small_ms: float,
+    large_ms: float,
+    criterion: Criterion,
+) -> dict:
+    """
+    Threshold on the small model's confidence below which a request is
+    escalated to the large model. Picks the cheapest threshold (expected
+    latency small_ms + escalation rate * large_ms) whose cascade accuracy on
+    the held-out predictions reaches `target_accuracy`, or the most accurate
+    one when none does.
+    """
+    conf = confidence(small_probs, criterion)
+    order = np.argsort(conf, kind='stable')
+    conf = conf[order]
+    small_correct = (small_probs.argmax(axis=1) == labels)[order]
+    large_correct = (large_probs.argmax(axis=1) == labels)[order]
+    n = len(labels)
+
+    # Escalating the k least confident samples, for k = 0..n
+    escalated_correct = np.concatenate([[0], np.cumsum(large_correct)])
+    kept_correct = np.concatenate([np.cumsum(small_correct[::-1])[::-1], [0]])
+    accuracy = (escalated_correct + kept_correct) / n
+    # `conf < threshold` can only split the samples between different values
+    valid = np.ones(n + 1, dtype=bool)
+    valid[1:n] = conf[1:] > conf[:-1]
+
+    candidates = np.flatnonzero(valid & (accuracy >= target_accuracy))
+    if len(candidates) > 0:
+        k = int(candidates[0])
+    else:
+        logger.warning(
+            f'Target accuracy {target_accuracy} is out of reach, '
+            'using the most accurate threshold'
+        )
+        k = int(np.flatnonzero(valid)[np.argmax(accuracy[valid])])
+
+    if k < n:
+        threshold = float(conf[k])
+    else:
+        threshold = float(np.nextafter(conf[-1], np.inf))
+    return {
+        'criterion': criterion,
+        'threshold': threshold,
+        'target_accuracy': target_accuracy,
+        'accuracy': float(accuracy[k]),
+        'escalation_rate': k / n,
+        'expected_latency_ms': small_ms + k / n * large_ms,
+        'small_accuracy': float(accuracy[0]),
+        'large_accuracy': float(accuracy[n]),
+    }
+
+
+def save_cascade(model_folder: str | os.PathLike, settings: dict):
+    with open(os.path.join(model_folder, CASCADE_FILE), 'w') as f:
+        json.dump(settings, f, indent=2)
+
+
+def load_cascade(model_folder: str | os.PathLike) -> dict:
+    path = os.path.join(model_folder, CASCADE_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError as e:
+        raise ValueError(
+            f'Cascade settings not found in {model_folder}, run calibrate_cascade.py'
+        ) from e
+
+
+def should_escalate(probs: np.ndarray, settings: dict) -> bool:
+    return bool(confidence(probs, settings['criterion'])[0] < settings['threshold'])
@@ -0,0 +1,83 @@
+from collections import Counter
+import threading
+import time
+
+from fastapi import HTTPException, Request, status
+
+# Non-standard status (nginx convention) for requests whose client went away
+CLIENT_CLOSED_REQUEST = 499
+
+
+class DropCounter:
+    """Counts work dropped per reason ('expired', 'disconnected') and stage."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, reason: str, stage: str):
+        with self._lock:
+            self._counts[reason, stage] += 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            counts = dict(self._counts)
+        result = {'expired': {}, 'disconnected': {}}
+        for (reason, stage), count in sorted(counts.items()):
+            result.setdefault(reason, {})[stage] = count
+        return result
+
+
+class RequestDeadline:
+    """
+    Deadline of one request, `timeout_ms` after it was received (no deadline
+    when None). `check` is called before each expensive step and drops the
+    request when the deadline passed or the client disconnected.
+    """
+
+    def __init__(
+        self,
+        request: Request | None,
+        timeout_ms: float | None,
+        drops: DropCounter,
+        received_at: float | None = None,
+    ):
+        self.request = request
+        self.drops = drops
+        self.expires_at = None
+        if timeout_ms is not None:
+            if received_at is None:
+                received_at = time.monotonic()
+            self.expires_at = received_at + timeout_ms / 1000
+
+    def remaining(self) -> float | None:
+        """Seconds left before the deadline, None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    async def disconnected(self) -> bool:
+        return self.request is not None and await self.request.is_disconnected()
+
+    def drop(self, reason: str, stage: str) -> HTTPException:
+        """Records the drop and returns the error to answer the request with."""
+        self.drops.record(reason, stage)
+        if reason == 'expired':
+            return HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=f'Request deadline expired before {stage}',
+            )
+        return HTTPException(
+            status_code=CLIENT_CLOSED_REQUEST,
+            detail=f'Client disconnected before {stage}',
+        )
+
+    async def check(self, stage: str):
+        if self.expired():
+            raise self.drop('expired', stage)
+        if await self.disconnected():
+            raise self.drop('disconnected', stage)
@@ -0,0 +1,97 @@
+from typing import Literal
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse, Response
+import msgpack
+import numpy as np
+import orjson
+
+ResponseFormat = Literal['dict', 'array', 'msgpack', 'float32']
+
+
+class OrjsonResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def select_classes(
+    probs: np.ndarray, top_k: int | None = None, threshold: float | None = None
+) -> np.ndarray | None:
+    """
+    Indices of the classes to return, most probable first.
+    Returns None when no filtering was requested, meaning all classes in order.
+    """
+    if top_k is None and threshold is None:
+        return None
+
+    order = np.argsort(probs)[::-1]
+    if top_k is not None:
+        order = order[:top_k]
+    if threshold is not None:
+        order = order[probs[order] >= threshold]
+    return order
+
+
+def encode_predictions(
+    probs: np.ndarray,
+    classes: list[str],
+    response_format: ResponseFormat = 'dict',
+    top_k: int | None = None,
+    threshold: float | None = None,
+    decimals: int | None = None,
+    extra: dict | None = None,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """
+    Builds the /predict response for a single probability vector.
+
+    'dict' maps class names to probabilities (the frontend format), 'array'
+    sends bare floats in the class order published by /info, 'msgpack' is the
+    same payload as 'array' in binary form and 'float32' is the raw
+    little-endian probability buffer.
+    """
+    indices = select_classes(probs, top_k, threshold)
+    values = probs if indices is None else probs[indices]
+
+    if response_format == 'float32':
+        if extra:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='The float32 format carries probabilities only',
+            )
+        headers = dict(headers or {})
+        if indices is not None:
+            headers['X-Class-Indices'] = ','.join(str(i) for i in indices)
+        return Response(
+            content=values.astype('<f4').tobytes(),
+            media_type='application/octet-stream',
+            headers=headers,
+        )
+
+    if decimals is not None:
+        values = np.round(values.astype(np.float64), decimals)
+    values = values.tolist()
+
+    if response_format == 'dict':
+        names = classes if indices is None else [classes[i] for i in indices]
+        payload = {'predictions': dict(zip(names, values, strict=True))}
+    elif response_format in ('array', 'msgpack'):
+        payload = {'probabilities': values}
+        if indices is not None:
+            payload['indices'] = indices.tolist()
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Unknown response format: {response_format}',
+        )
+
+    if extra:
+        payload.update(extra)
+
+    if response_format == 'msgpack':
+        return Response(
+            content=msgpack.packb(payload),
+            media_type='application/msgpack',
+            headers=headers,
+        )
+    return OrjsonResponse(payload, headers=headers)
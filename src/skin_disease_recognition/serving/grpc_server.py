@@ -0,0 +1,360 @@
+import argparse
+from concurrent import futures
+from functools import partial
+import logging
+import os.path
+import time
+
+import cv2
+from fastapi import HTTPException, status
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+import grpc
+import numpy as np
+import torch
+
+from skin_disease_recognition.core.config import (
+    ACTIVE_DEVICE,
+    ACTIVE_MODEL,
+    BULK_WEIGHT,
+    GRPC_MAX_MESSAGE_MB,
+    GRPC_PORT,
+    GRPC_WORKERS,
+    INTERACTIVE_WEIGHT,
+    MODEL_DIR,
+    MONITOR_WINDOW,
+    REQUEST_TIMEOUT_MS,
+    SCHEDULER_MAX_BATCH,
+    SCHEDULER_RESERVED_INTERACTIVE,
+    SCHEDULER_WORKERS,
+    SERVING_MODE,
+    TORCH_NUM_INTEROP_THREADS,
+    TORCH_NUM_THREADS,
+)
+from skin_disease_recognition.serving.deadlines import (
+    CLIENT_CLOSED_REQUEST,
+    DropCounter,
+    RequestDeadline,
+)
+from skin_disease_recognition.serving.inference import predict_proba
+from skin_disease_recognition.serving.loading import load_artifacts
+from skin_disease_recognition.serving.monitoring import RollingDriftMonitor
+from skin_disease_recognition.serving.preprocessing import decode_image
+from skin_disease_recognition.serving.scheduler import (
+    LANES,
+    InferenceScheduler,
+    Lane,
+)
+from skin_disease_recognition.serving.threads import configure_torch_threads
+
+logger = logging.getLogger(__name__)
+
+PACKAGE = 'skin_disease_recognition'
+SERVICE = f'{PACKAGE}.Inference'
+
+# Same messages as inference.proto, fields numbered from 1 in this order
+MESSAGES = {
+    'PredictRequest': [('image', 'bytes'), ('request_id', 'string')],
+    'PredictResponse': [
+        ('probabilities', 'repeated float'),
+        ('request_id', 'string'),
+        ('latency_ms', 'float'),
+        ('error', 'string'),
+    ],
+    'BatchPredictRequest': [('images', 'repeated bytes')],
+    'BatchPredictResponse': [('results', 'repeated PredictResponse')],
+    'InfoRequest': [],
+    'InfoResponse': [
+        ('model_name', 'string'),
+        ('model_version', 'int64'),
+        ('classes', 'repeated string'),
+    ],
+}
+
+# Method name: (call type, request message, response message)
+METHODS = {
+    'Predict': ('unary_unary', 'PredictRequest', 'PredictResponse'),
+    'PredictBatch': ('unary_unary', 'BatchPredictRequest', 'BatchPredictResponse'),
+    'PredictStream': ('stream_stream', 'PredictRequest', 'PredictResponse'),
+    'Info': ('unary_unary', 'InfoRequest', 'InfoResponse'),
+}
+
+FieldProto = descriptor_pb2.FieldDescriptorProto
+SCALAR_TYPES = {
+    'bytes': FieldProto.TYPE_BYTES,
+    'string': FieldProto.TYPE_STRING,
+    'float': FieldProto.TYPE_FLOAT,
+    'int64': FieldProto.TYPE_INT64,
+}
+
+# Without a client deadline, grpc reports an effectively infinite remaining time
+NO_DEADLINE_S = 365 * 24 * 3600
+
+# Errors of RequestDeadline and the scheduler, as gRPC status codes
+STATUS_CODES = {
+    status.HTTP_504_GATEWAY_TIMEOUT: grpc.StatusCode.DEADLINE_EXCEEDED,
+    CLIENT_CLOSED_REQUEST: grpc.StatusCode.CANCELLED,
+}
+
+
+def build_messages() -> dict[str, type]:
+    """
+    Message classes of MESSAGES, built from a descriptor at runtime so that
+    neither protoc nor generated code is needed.
+    """
+    file = descriptor_pb2.FileDescriptorProto(
+        name=f'{PACKAGE}/inference.proto', package=PACKAGE, syntax='proto3'
+    )
+    for name, fields in MESSAGES.items():
+        message = file.message_type.add(name=name)
+        for number, (field_name, kind) in enumerate(fields, start=1):
+            field = message.field.add(
+                name=field_name, number=number, label=FieldProto.LABEL_OPTIONAL
+            )
+            if kind.startswith('repeated '):
+                field.label = FieldProto.LABEL_REPEATED
+                kind = kind.removeprefix('repeated ')
+            if kind in SCALAR_TYPES:
+                field.type = SCALAR_TYPES[kind]
+            else:
+                field.type = FieldProto.TYPE_MESSAGE
+                field.type_name = f'.{PACKAGE}.{kind}'
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file)
+    return {
+        name: message_factory.GetMessageClass(
+            pool.FindMessageTypeByName(f'{PACKAGE}.{name}')
+        )
+        for name in MESSAGES
+    }
+
+
+messages = build_messages()
+PredictRequest = messages['PredictRequest']
+PredictResponse = messages['PredictResponse']
+BatchPredictRequest = messages['BatchPredictRequest']
+BatchPredictResponse = messages['BatchPredictResponse']
+InfoRequest = messages['InfoRequest']
+InfoResponse = messages['InfoResponse']
+
+
+class InferenceStub:
+    """Client of the Inference service, one callable attribute per method."""
+
+    def __init__(self, channel: grpc.Channel):
+        for method, (kind, request, response) in METHODS.items():
+            call = getattr(channel, kind)(
+                f'/{SERVICE}/{method}',
+                request_serializer=messages[request].SerializeToString,
+                response_deserializer=messages[response].FromString,
+            )
+            setattr(self, method, call)
+
+
+def decode(image: bytes) -> np.ndarray | None:
+    try:
+        return decode_image(image)
+    except cv2.error:
+        return None
+
+
+class InferenceServicer:
+    """
+    Predict RPCs over the artifacts of the HTTP app (or of the sidecar): the
+    same transform, model, scheduler lanes, deadline drop counts and drift
+    monitor. Only the active model serves, without cascade or candidate.
+    """
+
+    def __init__(self, loaded: dict):
+        self.loaded = loaded
+
+    def _deadline(self, context: grpc.ServicerContext) -> RequestDeadline:
+        remaining = context.time_remaining()
+        if remaining is not None and remaining < NO_DEADLINE_S:
+            timeout_ms = remaining * 1000
+        else:
+            timeout_ms = REQUEST_TIMEOUT_MS if REQUEST_TIMEOUT_MS > 0 else None
+        return RequestDeadline(None, timeout_ms, self.loaded['drops'])
+
+    def _lane(self, context: grpc.ServicerContext, default: Lane) -> Lane:
+        lane = dict(context.invocation_metadata()).get('x-priority', default)
+        if lane not in LANES:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f'Unknown lane: {lane}')
+        return lane
+
+    def _run(
+        self,
+        images: list[np.ndarray],
+        lane: Lane,
+        deadline: RequestDeadline,
+        context: grpc.ServicerContext,
+    ) -> np.ndarray:
+        """Probabilities of decoded images, aborting the RPC on a drop."""
+        transform = self.loaded['transform']
+        batch = torch.stack([transform(image=image)['image'] for image in images])
+        scheduler: InferenceScheduler | None = self.loaded['scheduler']
+        try:
+            if deadline.expired():
+                raise deadline.drop('expired', 'forward')
+            if scheduler is None:
+                probs = predict_proba(
+                    self.loaded['model'], batch, self.loaded['device']
+                )
+            else:
+                future = scheduler.submit(batch, lane, deadline=deadline)
+                # A cancelled or timed out RPC leaves the queue before its batch
+                context.add_callback(future.cancel)
+                probs = future.result()
+        except HTTPException as e:
+            context.abort(STATUS_CODES[e.status_code], e.detail)
+        except futures.CancelledError:
+            context.abort(grpc.StatusCode.CANCELLED, 'Request cancelled')
+
+        for image, p in zip(images, probs, strict=True):
+            self.loaded['monitor'].update(image, p)
+        return probs
+
+    def Predict(self, request, context):
+        start = time.perf_counter()
+        deadline = self._deadline(context)
+        lane = self._lane(context, 'interactive')
+        image = decode(request.image)
+        if image is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Invalid image')
+        probs = self._run([image], lane, deadline, context)[0]
+        return PredictResponse(
+            probabilities=probs.tolist(),
+            request_id=request.request_id,
+            latency_ms=(time.perf_counter() - start) * 1000,
+        )
+
+    def PredictBatch(self, request, context):
+        start = time.perf_counter()
+        deadline = self._deadline(context)
+        lane = self._lane(context, 'bulk')
+        images = [decode(image) for image in request.images]
+        valid = [image for image in images if image is not None]
+        probs = iter(self._run(valid, lane, deadline, context) if valid else ())
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        return BatchPredictResponse(
+            results=[
+                PredictResponse(error='Invalid image')
+                if image is None
+                else PredictResponse(
+                    probabilities=next(probs).tolist(), latency_ms=latency_ms
+                )
+                for image in images
+            ]
+        )
+
+    def PredictStream(self, request_iterator, context):
+        lane = self._lane(context, 'interactive')
+        for request in request_iterator:
+            start = time.perf_counter()
+            # The RPC deadline covers the stream, the default one each message
+            deadline = self._deadline(context)
+            image = decode(request.image)
+            if image is None:
+                yield PredictResponse(
+                    request_id=request.request_id, error='Invalid image'
+                )
+                continue
+            probs = self._run([image], lane, deadline, context)[0]
+            yield PredictResponse(
+                probabilities=probs.tolist(),
+                request_id=request.request_id,
+                latency_ms=(time.perf_counter() - start) * 1000,
+            )
+
+    def Info(self, request, context):
+        return InfoResponse(
+            model_name=self.loaded['metadata']['model_name'],
+            model_version=int(self.loaded['metadata']['version']),
+            classes=self.loaded['classes'],
+        )
+
+
+def service_handler(servicer: InferenceServicer) -> grpc.GenericRpcHandler:
+    handlers = {}
+    for method, (kind, request, response) in METHODS.items():
+        make_handler = getattr(grpc, f'{kind}_rpc_method_handler')
+        handlers[method] = make_handler(
+            getattr(servicer, method),
+            request_deserializer=messages[request].FromString,
+            response_serializer=messages[response].SerializeToString,
+        )
+    return grpc.method_handlers_generic_handler(SERVICE, handlers)
+
+
+def start_server(
+    loaded: dict,
+    port: int,
+    workers: int = GRPC_WORKERS,
+    max_message_mb: int = GRPC_MAX_MESSAGE_MB,
+) -> tuple[grpc.Server, int]:
+    """
+    Serves `loaded` on `port` (0 picks a free one) from a pool of `workers`
+    threads, each open stream holds one. Returns the server and its port.
+    """
+    max_bytes = max_message_mb * 2**20
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grpc'),
+        options=[
+            ('grpc.max_receive_message_length', max_bytes),
+            ('grpc.max_send_message_length', max_bytes),
+        ],
+    )
+    server.add_generic_rpc_handlers((service_handler(InferenceServicer(loaded)),))
+    bound = server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    return server, bound
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the active model over gRPC, without the HTTP app'
+    )
+    parser.add_argument('--port', type=int, default=GRPC_PORT or 50051)
+    parser.add_argument('--workers', type=int, default=GRPC_WORKERS)
+    args = parser.parse_args()
+
+    if ACTIVE_DEVICE is None:
+        raise ValueError('Active device name not found in .env')
+    if ACTIVE_MODEL is None:
+        raise ValueError('Active model name not found in .env')
+
+    configure_torch_threads(
+        mode=SERVING_MODE,
+        workers=1,
+        num_threads=int(TORCH_NUM_THREADS) if TORCH_NUM_THREADS else None,
+        num_interop_threads=(
+            int(TORCH_NUM_INTEROP_THREADS) if TORCH_NUM_INTEROP_THREADS else None
+        ),
+    )
+    loaded = load_artifacts(os.path.join(MODEL_DIR, ACTIVE_MODEL), ACTIVE_DEVICE)
+    loaded['drops'] = DropCounter()
+    loaded['monitor'] = RollingDriftMonitor(loaded['classes'], MONITOR_WINDOW)
+    loaded['scheduler'] = None
+    if SCHEDULER_WORKERS > 0:
+        loaded['scheduler'] = InferenceScheduler(
+            {'default': partial(predict_proba, loaded['model'], device=ACTIVE_DEVICE)},
+            num_workers=SCHEDULER_WORKERS,
+            reserved=SCHEDULER_RESERVED_INTERACTIVE,
+            weights={'interactive': INTERACTIVE_WEIGHT, 'bulk': BULK_WEIGHT},
+            max_batch=SCHEDULER_MAX_BATCH,
+        )
+        loaded['scheduler'].start()
+
+    server, port = start_server(loaded, args.port, args.workers)
+    logger.info(f'gRPC inference service listening on port {port}')
+    try:
+        server.wait_for_termination()
+    finally:
+        server.stop(grace=None)
+        if loaded['scheduler'] is not None:
+            loaded['scheduler'].stop()
+
+
+if __name__ == '__main__':
+    main()
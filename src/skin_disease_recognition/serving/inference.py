@@ -0,0 +1,36 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.functional import softmax
+
+from skin_disease_recognition.modeling.features import forward_features, forward_head
+
+
+def predict_proba(model: nn.Module, batch: torch.Tensor, device: str) -> np.ndarray:
+    """Runs a (N, C, H, W) batch through the model, returns (N, classes) probs."""
+    with torch.no_grad():
+        pred = model(batch.to(device))
+        soft = softmax(pred, dim=1)
+    return soft.cpu().numpy()
+
+
+def predict_with_features(
+    model: nn.Module, batch: torch.Tensor, device: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """(N, classes) probabilities and the backbone features they come from."""
+    with torch.no_grad():
+        features = forward_features(model, batch.to(device))
+        soft = softmax(forward_head(model, features), dim=1)
+    return soft.cpu().numpy(), features.cpu().numpy()
+
+
+def predict_feature_rows(
+    model: nn.Module, batch: torch.Tensor, device: str
+) -> np.ndarray:
+    """
+    (N, classes + features) rows: the probabilities followed by the backbone
+    features, one row per image like `predict_proba` so that the scheduler
+    can batch and split them.
+    """
+    probs, features = predict_with_features(model, batch, device)
+    return np.concatenate([probs, features], axis=1)
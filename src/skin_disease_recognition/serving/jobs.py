@@ -0,0 +1,351 @@
+from collections.abc import Iterable
+from contextlib import contextmanager
+import json
+import logging
+from pathlib import Path
+import shutil
+import sqlite3
+import threading
+import time
+from typing import BinaryIO
+import uuid
+
+import cv2
+import torch
+
+from skin_disease_recognition.serving.inference import predict_proba
+from skin_disease_recognition.serving.scheduler import InferenceScheduler
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    claimed_at REAL,
+    claim TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, job_id, idx);
+"""
+
+
+class JobStore:
+    """
+    Durable bulk-scoring queue: uploaded images live on disk under
+    `root/<job_id>/`, job and item state in `root/jobs.sqlite`.
+
+    Items move pending -> running -> done/failed. Results are committed
+    together with the status change. A claim is a lease of `lease` seconds,
+    renewed while its items are scored: only items whose lease ran out, e.g.
+    those of a crashed process, are put back in the queue. Results are only
+    recorded under the claim that is still current, so an item requeued
+    from a late worker is never scored twice.
+    """
+
+    def __init__(self, root: str | Path, lease: float = 600.0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / 'jobs.sqlite'
+        self.lease = lease
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            conn.execute('BEGIN IMMEDIATE')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(items)')}
+            # Stores created before claims had leases
+            for column, kind in (('claimed_at', 'REAL'), ('claim', 'TEXT')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE items ADD COLUMN {column} {kind}')
+            conn.execute('COMMIT')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create_job(self, files: Iterable[tuple[str, BinaryIO]]) -> tuple[str, int]:
+        job_id = uuid.uuid4().hex
+        job_dir = self.root / job_id
+        job_dir.mkdir()
+
+        rows = []
+        for idx, (filename, stream) in enumerate(files):
+            path = job_dir / f'{idx:07d}'
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(stream, f)
+            rows.append((job_id, idx, filename, str(path), 'pending'))
+
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO jobs (id, created, total) VALUES (?, ?, ?)',
+                (job_id, time.time(), len(rows)),
+            )
+            conn.executemany(
+                'INSERT INTO items (job_id, idx, filename, path, status) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows,
+            )
+            conn.execute('COMMIT')
+        return job_id, len(rows)
+
+    def requeue_stale(self) -> int:
+        """Puts items claimed more than `lease` seconds ago back in the queue."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET status = 'pending', claim = NULL "
+                "WHERE status = 'running' "
+                'AND (claimed_at IS NULL OR claimed_at < ?)',
+                (time.time() - self.lease,),
+            )
+        return cursor.rowcount
+
+    def renew(self, claims: Iterable[str]):
+        """Restarts the lease of the items still held under `claims`."""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE items SET claimed_at = ? WHERE status = 'running' "
+                'AND claim = ?',
+                [(time.time(), claim) for claim in claims],
+            )
+
+    def claim(self, limit: int) -> tuple[str, list[tuple[str, int, str]]]:
+        """
+        Atomically marks up to `limit` oldest pending items as running.
+        Returns the claim token to complete them with and their rows.
+        """
+        claim = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT items.job_id, items.idx, items.path FROM items '
+                'JOIN jobs ON jobs.id = items.job_id '
+                "WHERE items.status = 'pending' "
+                'ORDER BY jobs.created, items.idx LIMIT ?',
+                (limit,),
+            ).fetchall()
+            claimed_at = time.time()
+            conn.executemany(
+                "UPDATE items SET status = 'running', claimed_at = ?, claim = ? "
+                'WHERE job_id = ? AND idx = ?',
+                [(claimed_at, claim, job_id, idx) for job_id, idx, _ in rows],
+            )
+            conn.execute('COMMIT')
+        return claim, rows
+
+    def complete(
+        self,
+        claim: str,
+        results: list[tuple[str, int, list[float]]],
+        failures: list[tuple[str, int, str]],
+    ) -> int:
+        """
+        Records the outcome of items still held under `claim`, others were
+        requeued and belong to a newer claim. Returns how many were recorded.
+        """
+        updates = [
+            ("status = 'done', result = ?", json.dumps(probs), job_id, idx)
+            for job_id, idx, probs in results
+        ] + [
+            ("status = 'failed', error = ?", error, job_id, idx)
+            for job_id, idx, error in failures
+        ]
+        recorded = []
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for assignment, value, job_id, idx in updates:
+                cursor = conn.execute(
+                    f'UPDATE items SET {assignment} WHERE job_id = ? AND idx = ? '
+                    "AND status = 'running' AND claim = ?",
+                    (value, job_id, idx, claim),
+                )
+                if cursor.rowcount:
+                    recorded.append((job_id, idx))
+            conn.execute('COMMIT')
+
+        # The image of an item claimed again is still needed
+        for job_id, idx in recorded:
+            (self.root / job_id / f'{idx:07d}').unlink(missing_ok=True)
+        return len(recorded)
+
+    def status(self, job_id: str) -> dict | None:
+        with self._connect() as conn:
+            job = conn.execute(
+                'SELECT total FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(
+                conn.execute(
+                    'SELECT status, COUNT(*) FROM items WHERE job_id = ? '
+                    'GROUP BY status',
+                    (job_id,),
+                ).fetchall()
+            )
+
+        finished = counts.get('done', 0) + counts.get('failed', 0)
+        return {
+            'job_id': job_id,
+            'status': 'completed' if finished == job[0] else 'in_progress',
+            'total': job[0],
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'pending': counts.get('pending', 0) + counts.get('running', 0),
+        }
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 1000) -> list[dict]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT idx, filename, status, result, error FROM items '
+                "WHERE job_id = ? AND status IN ('done', 'failed') "
+                'ORDER BY idx LIMIT ? OFFSET ?',
+                (job_id, limit, offset),
+            ).fetchall()
+
+        return [
+            {
+                'index': idx,
+                'filename': filename,
+                'status': item_status,
+                'probabilities': json.loads(result) if result else None,
+                'error': error,
+            }
+            for idx, filename, item_status, result, error in rows
+        ]
+
+
+class JobWorkerPool:
+    """
+    Background threads that drain a JobStore in batches of `batch_size`
+    through the model loaded by `load_artifacts`, or through the bulk lane of
+    `scheduler` when given.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        loaded: dict,
+        num_workers: int = 1,
+        batch_size: int = 64,
+        poll_interval: float = 1.0,
+        scheduler: InferenceScheduler | None = None,
+    ):
+        self.store = store
+        self.scheduler = scheduler
+        self.loaded = loaded
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: list[threading.Thread] = []
+        # Claims being scored, their leases are renewed until completion
+        self._held: set[str] = set()
+        self._held_lock = threading.Lock()
+
+    def _requeue_stale(self) -> int:
+        requeued = self.store.requeue_stale()
+        if requeued:
+            logger.info(f'Requeued {requeued} job items with expired claims')
+        return requeued
+
+    def start(self):
+        self._requeue_stale()
+        for i in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._run, name=f'job-worker-{i}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._renew, name='job-leases', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _renew(self):
+        # A batch may wait behind interactive work for longer than a lease
+        while not self._stop.wait(max(self.store.lease / 3, 0.1)):
+            with self._held_lock:
+                held = list(self._held)
+            try:
+                self.store.renew(held)
+            except Exception:
+                logger.exception('Could not renew job claims')
+
+    def _run(self):
+        while not self._stop.is_set():
+            claim, claimed = self.store.claim(self.batch_size)
+            if not claimed:
+                # Claims of a crashed process come back once their lease expires
+                if self._requeue_stale():
+                    continue
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            with self._held_lock:
+                self._held.add(claim)
+            try:
+                self._score(claim, claimed)
+            except Exception as e:
+                logger.exception('Job batch failed')
+                try:
+                    self.store.complete(
+                        claim, [], [(job_id, idx, str(e)) for job_id, idx, _ in claimed]
+                    )
+                except Exception:
+                    # The lease runs out and the batch is claimed again
+                    logger.exception('Could not record the failed job batch')
+            finally:
+                with self._held_lock:
+                    self._held.discard(claim)
+
+    def _score(self, claim: str, claimed: list[tuple[str, int, str]]):
+        transform = self.loaded['transform']
+        tensors = []
+        keys = []
+        failures = []
+        for job_id, idx, path in claimed:
+            image = cv2.imread(path)
+            if image is None:
+                failures.append((job_id, idx, 'Could not decode image'))
+                continue
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            tensors.append(transform(image=image)['image'])
+            keys.append((job_id, idx))
+
+        results = []
+        if tensors:
+            if self.scheduler is not None:
+                probs = self.scheduler.submit(torch.stack(tensors), 'bulk').result()
+            else:
+                probs = predict_proba(
+                    self.loaded['model'], torch.stack(tensors), self.loaded['device']
+                )
+            results = [
+                (job_id, idx, p.tolist())
+                for (job_id, idx), p in zip(keys, probs, strict=True)
+            ]
+        self.store.complete(claim, results, failures)
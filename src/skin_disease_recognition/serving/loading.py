@@ -0,0 +1,77 @@
+import json
+import logging
+import os.path
+
+import torch
+import torch.nn as nn
+
+from skin_disease_recognition.serving.monitoring import REFERENCE_FILE, DriftMonitor
+from skin_disease_recognition.serving.preprocessing import make_transform
+from skin_disease_recognition.serving.similarity import (
+    EMBEDDINGS_FILE,
+    SimilarityIndex,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def load_artifacts(model_folder: str | os.PathLike, device: str) -> dict:
+    """
+    Loads an exported model folder (as written by download_model.py) into a
+    dict with the model, its metadata, class names, classification report and
+    the matching inference transform.
+    """
+    model_path = os.path.join(model_folder, 'model.pth')
+    data_path = os.path.join(model_folder, 'model_data.json')
+    classnames_path = os.path.join(model_folder, 'class_names.txt')
+    classif_report_path = os.path.join(model_folder, 'classification_report.json')
+
+    loaded = {'device': device}
+
+    try:
+        model: nn.Module = torch.load(
+            model_path, weights_only=False, map_location=torch.device(device)
+        )
+        model.eval()
+        loaded['model'] = model
+        logger.info('Model loaded successfully')
+    except FileNotFoundError as e:
+        raise ValueError('Model not found') from e
+
+    try:
+        with open(data_path) as f:
+            data = json.load(f)
+        loaded['metadata'] = data
+    except FileNotFoundError as e:
+        raise ValueError('Metadata not found') from e
+
+    try:
+        with open(classnames_path) as f:
+            classes = f.read()
+        classes = classes.split()
+        loaded['classes'] = classes
+    except FileNotFoundError as e:
+        raise ValueError('Class names not found') from e
+
+    try:
+        with open(classif_report_path) as f:
+            report_data = json.load(f)
+        loaded['report'] = report_data
+    except FileNotFoundError as e:
+        raise ValueError('Metadata not found') from e
+
+    loaded['transform'] = make_transform(
+        loaded['metadata']['image_size'],
+        loaded['metadata'].get('input_format', 'normalized'),
+    )
+
+    loaded['index'] = None
+    if os.path.exists(os.path.join(model_folder, EMBEDDINGS_FILE)):
+        loaded['index'] = SimilarityIndex.load(model_folder)
+        logger.info(f'Similar-case index loaded ({len(loaded["index"])} images)')
+
+    loaded['reference'] = None
+    if os.path.exists(os.path.join(model_folder, REFERENCE_FILE)):
+        loaded['reference'] = DriftMonitor.load(model_folder)
+
+    return loaded
@@ -0,0 +1,233 @@
+import bisect
+import json
+import os.path
+import threading
+
+import cv2
+import numpy as np
+
+REFERENCE_FILE = 'reference_profile.json'
+
+CONFIDENCE_BINS = 100
+COLOR_BINS = 16
+# Shorter image side, in pixels
+SIZE_EDGES = (64, 128, 256, 512, 1024, 2048)
+# Side of the pixel grid sampled for the color statistics
+COLOR_GRID = 16
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Population stability index above which a distribution counts as drifted
+PSI_THRESHOLD = 0.25
+
+
+def image_stats(image: np.ndarray) -> tuple[int, int, tuple[float, ...]]:
+    """Height, width and per-channel mean of an (H, W, 3) image, on a pixel grid."""
+    height, width = image.shape[:2]
+    grid = cv2.resize(image, (COLOR_GRID, COLOR_GRID), interpolation=cv2.INTER_NEAREST)
+    return height, width, cv2.mean(grid)[:3]
+
+
+def histogram_quantiles(counts: np.ndarray, quantiles=QUANTILES) -> list[float]:
+    """Quantiles of values in [0, 1] from equal-width bin counts."""
+    total = counts.sum()
+    if total == 0:
+        return [None] * len(quantiles)
+    cdf = np.concatenate([[0], np.cumsum(counts)]) / total
+    edges = np.linspace(0, 1, len(counts) + 1)
+    return [float(np.interp(q, cdf, edges)) for q in quantiles]
+
+
+def psi(expected: np.ndarray, actual: np.ndarray, eps: float = 1e-4) -> float | None:
+    """Population stability index between two histograms of counts."""
+    if expected.sum() == 0 or actual.sum() == 0:
+        return None
+    e = np.clip(expected / expected.sum(), eps, None)
+    a = np.clip(actual / actual.sum(), eps, None)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+class DriftMonitor:
+    """
+    Streaming, fixed-size sketch of what the service sees and predicts:
+    per-class prediction counts, a confidence histogram, shorter-side image
+    size buckets and per-channel color histograms. Memory does not grow with
+    traffic; an update is a handful of counter increments (plain lists, which
+    are several times faster to bump than numpy scalars).
+    """
+
+    def __init__(self, classes: list[str]):
+        self.classes = classes
+        self.count = 0
+        self.predictions = [0] * len(classes)
+        self.confidence = [0] * CONFIDENCE_BINS
+        self.sizes = [0] * (len(SIZE_EDGES) + 1)
+        self.colors = [[0] * COLOR_BINS for _ in range(3)]
+        self._lock = threading.Lock()
+
+    def update(self, image: np.ndarray, probs: np.ndarray):
+        height, width, means = image_stats(image)
+        self.record(height, width, means, probs)
+
+    def record(self, height: int, width: int, means: tuple, probs: np.ndarray):
+        label = int(probs.argmax())
+        confidence_bin = min(int(probs[label] * CONFIDENCE_BINS), CONFIDENCE_BINS - 1)
+        size_bin = bisect.bisect_right(SIZE_EDGES, min(height, width))
+        color_bins = [int(m) * COLOR_BINS // 256 for m in means]
+        with self._lock:
+            self.count += 1
+            self.predictions[label] += 1
+            self.confidence[confidence_bin] += 1
+            self.sizes[size_bin] += 1
+            for counts, b in zip(self.colors, color_bins, strict=True):
+                counts[b] += 1
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            for counts in (self.predictions, self.confidence, self.sizes, *self.colors):
+                counts[:] = [0] * len(counts)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                'classes': list(self.classes),
+                'count': self.count,
+                'predictions': list(self.predictions),
+                'confidence': list(self.confidence),
+                'sizes': list(self.sizes),
+                'colors': [list(counts) for counts in self.colors],
+            }
+
+    @classmethod
+    def merge(cls, states: list[dict]) -> 'DriftMonitor':
+        """One monitor holding the counts of several states added up."""
+        total = states[0]
+        for state in states[1:]:
+            total = {
+                'classes': total['classes'],
+                'count': total['count'] + state['count'],
+                **{
+                    key: [a + b for a, b in zip(total[key], state[key], strict=True)]
+                    for key in ('predictions', 'confidence', 'sizes')
+                },
+                'colors': [
+                    [a + b for a, b in zip(x, y, strict=True)]
+                    for x, y in zip(total['colors'], state['colors'], strict=True)
+                ],
+            }
+        return cls.from_state(total)
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'DriftMonitor':
+        monitor = cls(state['classes'])
+        monitor.count = state['count']
+        monitor.predictions = list(state['predictions'])
+        monitor.confidence = list(state['confidence'])
+        monitor.sizes = list(state['sizes'])
+        monitor.colors = [list(counts) for counts in state['colors']]
+        return monitor
+
+    def summary(self) -> dict:
+        state = self.state()
+        count = max(state['count'], 1)
+        return {
+            'count': state['count'],
+            'predictions': {
+                name: n / count
+                for name, n in zip(self.classes, state['predictions'], strict=True)
+            },
+            'confidence_quantiles': dict(
+                zip(
+                    [f'p{round(q * 100)}' for q in QUANTILES],
+                    histogram_quantiles(np.asarray(state['confidence'])),
+                    strict=True,
+                )
+            ),
+            'min_side': dict(
+                zip(
+                    [f'<{edge}' for edge in SIZE_EDGES] + [f'>={SIZE_EDGES[-1]}'],
+                    [n / count for n in state['sizes']],
+                    strict=True,
+                )
+            ),
+            'color_mean': {
+                channel: float(
+                    np.dot(counts, (np.arange(COLOR_BINS) + 0.5) * 256 / COLOR_BINS)
+                    / count
+                )
+                for channel, counts in zip('rgb', state['colors'], strict=True)
+            },
+        }
+
+    def compare(self, reference: 'DriftMonitor') -> dict:
+        """PSI of every sketch against `reference`, with a drift flag."""
+        live, ref = self.state(), reference.state()
+        scores = {
+            'predictions': psi(
+                np.asarray(ref['predictions']), np.asarray(live['predictions'])
+            ),
+            'confidence': psi(
+                np.asarray(ref['confidence']), np.asarray(live['confidence'])
+            ),
+            'min_side': psi(np.asarray(ref['sizes']), np.asarray(live['sizes'])),
+        }
+        for channel, e, a in zip('rgb', ref['colors'], live['colors'], strict=True):
+            scores[f'color_{channel}'] = psi(np.asarray(e), np.asarray(a))
+        return {
+            'psi': scores,
+            'drifted': sorted(
+                name
+                for name, score in scores.items()
+                if score is not None and score > PSI_THRESHOLD
+            ),
+        }
+
+    def save(self, folder: str | os.PathLike):
+        with open(os.path.join(folder, REFERENCE_FILE), 'w') as f:
+            json.dump(self.state(), f)
+
+    @classmethod
+    def load(cls, folder: str | os.PathLike) -> 'DriftMonitor':
+        with open(os.path.join(folder, REFERENCE_FILE)) as f:
+            return cls.from_state(json.load(f))
+
+
+class RollingDriftMonitor:
+    """
+    DriftMonitor of recent traffic: counts go to a current bucket, and once
+    it holds `window` requests it replaces the previous one and a new one
+    starts. Summaries and drift scores cover both buckets, the last
+    `window` to `2 * window` requests, so a shift shows up as quickly after
+    a week of traffic as after a minute.
+    """
+
+    def __init__(self, classes: list[str], window: int = 10000):
+        self.classes = classes
+        self.window = window
+        self.total = 0
+        self._current = DriftMonitor(classes)
+        self._previous = DriftMonitor(classes)
+        self._lock = threading.Lock()
+
+    def update(self, image: np.ndarray, probs: np.ndarray):
+        height, width, means = image_stats(image)
+        self.record(height, width, means, probs)
+
+    def record(self, height: int, width: int, means: tuple, probs: np.ndarray):
+        with self._lock:
+            if self._current.count >= self.window:
+                self._previous = self._current
+                self._current = DriftMonitor(self.classes)
+            self.total += 1
+            current = self._current
+        current.record(height, width, means, probs)
+
+    def recent(self) -> DriftMonitor:
+        with self._lock:
+            buckets = (self._previous, self._current)
+        return DriftMonitor.merge([bucket.state() for bucket in buckets])
+
+    def summary(self) -> dict:
+        return {**self.recent().summary(), 'total': self.total}
+
+    def compare(self, reference: DriftMonitor) -> dict:
+        return self.recent().compare(reference)
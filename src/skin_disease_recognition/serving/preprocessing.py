@@ -4,9 +4,15 @@ import cv2
 from fastapi import UploadFile
 import numpy as np
 
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
 
-async def get_data_from_file(file: UploadFile):
-    bts = await file.read()
+# Input the exported model expects: ImageNet-normalized floats (the default),
+# raw 0-255 pixels or [0, 1] floats, see optimize_export.py
+INPUT_FORMATS = ('normalized', 'uint8', 'unit')
+
+
+def decode_image(bts: bytes) -> np.ndarray:
     nparr = np.frombuffer(bts, np.uint8)
 
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -15,11 +21,17 @@ async def get_data_from_file(file: UploadFile):
     return img
 
 
-def make_transform(image_size: int):
-    return A.Compose(
-        [
-            A.Resize(image_size, image_size),
-            A.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
-            ToTensorV2(),
-        ]
-    )
+async def get_data_from_file(file: UploadFile):
+    return decode_image(await file.read())
+
+
+def make_transform(image_size: int, input_format: str = 'normalized'):
+    if input_format == 'normalized':
+        scaling = [A.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)]
+    elif input_format == 'unit':
+        scaling = [A.ToFloat(max_value=255)]
+    elif input_format == 'uint8':
+        scaling = []
+    else:
+        raise ValueError(f'Unknown input format: {input_format}')
+    return A.Compose([A.Resize(image_size, image_size), *scaling, ToTensorV2()])
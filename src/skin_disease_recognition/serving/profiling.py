@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from skin_disease_recognition.modeling.profiling import TraceProfiler
+
+
+class RequestProfiler:
+    """
+    Profiles a window of the next `num_requests` /predict calls.
+
+    Forward passes run on scheduler workers or in threads off the event loop,
+    so every thread is traced. Each pass is under a range named after its
+    model, opened on the thread that runs it; bulk work running during the
+    window is in the trace as well.
+    """
+
+    def __init__(self, output_dir: Path, device: str):
+        self.output_dir = output_dir
+        self.device = device
+        self.profiler: TraceProfiler | None = None
+        self.remaining = 0
+
+    @property
+    def active(self) -> bool:
+        return self.profiler is not None and self.profiler.running
+
+    def arm(self, num_requests: int) -> str:
+        if self.active:
+            raise RuntimeError('A profiling window is already open')
+        name = f'predict_{datetime.now():%Y%m%d_%H%M%S}'
+        self.profiler = TraceProfiler(
+            name, self.output_dir, self.device, all_threads=True
+        )
+        self.remaining = num_requests
+        self.profiler.start()
+        return name
+
+    @contextmanager
+    def record(self):
+        if not self.active:
+            yield
+            return
+        try:
+            yield
+        finally:
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.profiler.stop()
+
+    def close(self):
+        if self.active:
+            self.profiler.stop()
+
+    def status(self) -> dict:
+        return {
+            'active': self.active,
+            'remaining': self.remaining if self.active else 0,
+            'files': [str(p) for p in self.profiler.files] if self.profiler else [],
+        }
@@ -0,0 +1,279 @@
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+from typing import Literal
+
+import numpy as np
+import torch
+
+from skin_disease_recognition.serving.deadlines import RequestDeadline
+
+logger = logging.getLogger(__name__)
+
+Lane = Literal['interactive', 'bulk']
+LANES: tuple[Lane, ...] = ('interactive', 'bulk')
+
+Runner = Callable[[torch.Tensor], np.ndarray]
+
+
+@dataclass
+class WorkItem:
+    images: torch.Tensor
+    model: str
+    future: Future
+    deadline: RequestDeadline | None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class LaneStats:
+    """Counters and a rolling window of queue wait and latency for one lane."""
+
+    def __init__(self, window: int = 1000):
+        self.served = 0
+        self.images = 0
+        self.dropped = 0
+        self.failed = 0
+        self.waits = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self, queue_depth: int) -> dict:
+        result = {
+            'queue_depth': queue_depth,
+            'served': self.served,
+            'images': self.images,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+        for name, values in (('wait', self.waits), ('latency', self.latencies)):
+            for q in (50, 95):
+                result[f'{name}_ms_p{q}'] = (
+                    float(np.percentile(values, q)) * 1000 if values else None
+                )
+        return result
+
+
+def gather(futures: list[Future]) -> Future:
+    """
+    Future of the concatenated results of `futures`, failing with the first
+    error, its `forward_ms` the sum of theirs. Cancelling it cancels the
+    parts that have not started.
+    """
+    combined = Future()
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def part_done(_):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            if remaining:
+                return
+        try:
+            if any(f.cancelled() for f in futures):
+                combined.cancel()
+            elif errors := [f.exception() for f in futures if f.exception()]:
+                combined.set_exception(errors[0])
+            else:
+                combined.forward_ms = sum(f.forward_ms for f in futures)
+                combined.set_result(np.concatenate([f.result() for f in futures]))
+        except InvalidStateError:
+            # The caller cancelled it meanwhile
+            pass
+
+    def cancel_parts(_):
+        if combined.cancelled():
+            for future in futures:
+                future.cancel()
+
+    combined.add_done_callback(cancel_parts)
+    for future in futures:
+        future.add_done_callback(part_done)
+    return combined
+
+
+class InferenceScheduler:
+    """
+    Runs forward passes queued in priority lanes on a pool of worker threads.
+
+    Workers pick the next lane by smooth weighted round-robin over the lanes
+    with queued work. The first `reserved` workers only serve the interactive
+    lane, so bulk traffic can never hold all of the inference capacity.
+    Queued requests of the same lane and model are batched up to `max_batch`
+    images, and larger submissions are split into chunks of that size;
+    requests past their deadline or abandoned by their caller are dropped
+    before they join a batch.
+    """
+
+    def __init__(
+        self,
+        runners: dict[str, Runner],
+        num_workers: int = 2,
+        reserved: int = 1,
+        weights: dict[Lane, int] | None = None,
+        max_batch: int = 8,
+    ):
+        if num_workers < 1 or reserved < 0:
+            raise ValueError('Scheduler needs a worker and no negative reservation')
+        if reserved >= num_workers:
+            logger.warning(
+                f'{reserved} reserved interactive workers would leave none of '
+                f'{num_workers} for bulk, reserving {num_workers - 1}'
+            )
+            reserved = num_workers - 1
+        self.runners = runners
+        self.num_workers = num_workers
+        self.reserved = reserved
+        self.weights = weights or {'interactive': 4, 'bulk': 1}
+        self.max_batch = max_batch
+
+        self._queues: dict[Lane, deque[WorkItem]] = {lane: deque() for lane in LANES}
+        self._credit = dict.fromkeys(LANES, 0)
+        self._stats = {lane: LaneStats() for lane in LANES}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            lanes = ('interactive',) if i < self.reserved else LANES
+            thread = threading.Thread(
+                target=self._run, args=(lanes,), name=f'inference-{i}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().future.cancel()
+
+    def submit(
+        self,
+        images: torch.Tensor,
+        lane: Lane,
+        model: str = 'default',
+        deadline: RequestDeadline | None = None,
+    ) -> Future:
+        """
+        Queues a (N, C, H, W) batch, the future resolves to (N, classes).
+        Batches over `max_batch` images are queued as several work items.
+        Once resolved, the future's `forward_ms` is the duration of the
+        forward pass that served it, without the queue wait.
+        """
+        if lane not in self._queues:
+            raise ValueError(f'Unknown lane: {lane}')
+        if model not in self.runners:
+            raise ValueError(f'Unknown model: {model}')
+        items = [
+            WorkItem(chunk, model, Future(), deadline)
+            for chunk in images.split(self.max_batch)
+        ]
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('Scheduler is stopped')
+            self._queues[lane].extend(items)
+            # Reserved workers cannot take bulk work, wake everyone
+            self._cond.notify_all()
+        if len(items) == 1:
+            return items[0].future
+        return gather([item.future for item in items])
+
+    def stats(self) -> dict[str, dict]:
+        with self._cond:
+            return {
+                lane: self._stats[lane].snapshot(len(self._queues[lane]))
+                for lane in LANES
+            }
+
+    def _pick_lane(self, lanes: tuple[Lane, ...]) -> Lane | None:
+        ready = [lane for lane in lanes if self._queues[lane]]
+        if not ready:
+            return None
+        for lane in ready:
+            self._credit[lane] += self.weights[lane]
+        lane = max(ready, key=self._credit.__getitem__)
+        self._credit[lane] -= sum(self.weights[name] for name in ready)
+        return lane
+
+    def _take_batch(self, lane: Lane) -> list[WorkItem]:
+        queue = self._queues[lane]
+        batch = [queue.popleft()]
+        rows = len(batch[0].images)
+        while (
+            queue
+            and queue[0].model == batch[0].model
+            and rows + len(queue[0].images) <= self.max_batch
+        ):
+            batch.append(queue.popleft())
+            rows += len(batch[-1].images)
+        return batch
+
+    def _run(self, lanes: tuple[Lane, ...]):
+        while True:
+            with self._cond:
+                lane = self._pick_lane(lanes)
+                while lane is None and not self._stopped:
+                    self._cond.wait()
+                    lane = self._pick_lane(lanes)
+                if self._stopped:
+                    return
+                batch = self._take_batch(lane)
+            self._execute(lane, batch)
+
+    def _execute(self, lane: Lane, batch: list[WorkItem]):
+        start = time.monotonic()
+        live = []
+        dropped = failed = 0
+        for item in batch:
+            if not item.future.set_running_or_notify_cancel():
+                # The caller stopped waiting
+                if item.deadline is not None:
+                    item.deadline.drops.record('disconnected', 'batch')
+                dropped += 1
+            elif item.deadline is not None and item.deadline.expired():
+                item.future.set_exception(item.deadline.drop('expired', 'batch'))
+                dropped += 1
+            else:
+                live.append(item)
+
+        if live:
+            try:
+                forward_start = time.monotonic()
+                probs = self.runners[live[0].model](
+                    torch.cat([item.images for item in live])
+                )
+                forward_ms = (time.monotonic() - forward_start) * 1000
+            except Exception as e:
+                logger.exception(f'Inference batch failed in the {lane} lane')
+                for item in live:
+                    item.future.set_exception(e)
+                failed, live = len(live), []
+            else:
+                offset = 0
+                for item in live:
+                    count = len(item.images)
+                    # Set first, waiters read it once the result is there
+                    item.future.forward_ms = forward_ms
+                    item.future.set_result(probs[offset : offset + count])
+                    offset += count
+
+        end = time.monotonic()
+        with self._cond:
+            stats = self._stats[lane]
+            stats.dropped += dropped
+            stats.failed += failed
+            for item in live:
+                stats.served += 1
+                stats.images += len(item.images)
+                stats.waits.append(start - item.enqueued_at)
+                stats.latencies.append(end - item.enqueued_at)
@@ -0,0 +1,83 @@
+import json
+import os.path
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from skin_disease_recognition.modeling.features import forward_features
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+EMBEDDINGS_INDEX_FILE = 'embeddings_index.json'
+
+
+def embed_loader(model: nn.Module, loader: DataLoader, device: str) -> np.ndarray:
+    """L2-normalized backbone features for every sample, as float16."""
+    chunks = []
+    model.eval()
+    with torch.no_grad():
+        for images, _ in loader:
+            features = forward_features(model, images.to(device))
+            features = torch.nn.functional.normalize(features, dim=1)
+            chunks.append(features.cpu().numpy().astype(np.float16))
+    return np.concatenate(chunks)
+
+
+class SimilarityIndex:
+    """
+    Exact cosine-similarity search over stored embeddings.
+
+    The matrix is kept as float16 on disk and upcast to float32 in memory so
+    a query is a single BLAS matrix-vector product plus a partial sort, which
+    takes a few milliseconds for the ~15k training images.
+    """
+
+    def __init__(self, embeddings: np.ndarray, labels: list[int], paths: list[str]):
+        if len(embeddings) != len(labels) or len(labels) != len(paths):
+            raise ValueError('Embeddings, labels and paths differ in length')
+        self.matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.labels = np.asarray(labels)
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def save(self, folder: str | os.PathLike):
+        np.save(os.path.join(folder, EMBEDDINGS_FILE), self.matrix.astype(np.float16))
+        with open(os.path.join(folder, EMBEDDINGS_INDEX_FILE), 'w') as f:
+            json.dump({'labels': self.labels.tolist(), 'paths': self.paths}, f)
+
+    @classmethod
+    def load(cls, folder: str | os.PathLike) -> 'SimilarityIndex':
+        embeddings = np.load(os.path.join(folder, EMBEDDINGS_FILE))
+        with open(os.path.join(folder, EMBEDDINGS_INDEX_FILE)) as f:
+            index_data = json.load(f)
+        return cls(embeddings, index_data['labels'], index_data['paths'])
+
+    def query(self, embedding: np.ndarray, k: int) -> list[tuple[int, float]]:
+        """Returns (row, cosine similarity) of the k nearest rows, best first."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.matrix @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def similar_cases(
+        self, embedding: np.ndarray, k: int, classes: list[str]
+    ) -> list[dict]:
+        return [
+            {
+                'path': self.paths[row],
+                'label': classes[self.labels[row]],
+                'similarity': score,
+            }
+            for row, score in self.query(embedding, k)
+        ]
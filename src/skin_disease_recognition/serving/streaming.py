@@ -0,0 +1,93 @@
+import asyncio
+
+import cv2
+import numpy as np
+import torch
+
+from skin_disease_recognition.serving.encoding import select_classes
+from skin_disease_recognition.serving.preprocessing import decode_image
+
+
+class LatestFrame:
+    """
+    Single-slot mailbox of one frame stream. `put` replaces a frame that was
+    not picked up yet, counted as dropped, so whenever the consumer is free
+    it gets the newest frame and never works through a backlog.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self._frame: bytes | None = None
+        self._closed = False
+        self._ready = asyncio.Event()
+
+    def put(self, frame: bytes) -> bool:
+        """Stores the frame, True when it replaced a stale one."""
+        self.received += 1
+        stale = self._frame is not None
+        if stale:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+        return stale
+
+    def close(self):
+        self._closed = True
+        self._ready.set()
+
+    async def get(self) -> tuple[int, bytes] | None:
+        """Newest frame and its sequence number, None once closed."""
+        await self._ready.wait()
+        self._ready.clear()
+        if self._closed:
+            return None
+        frame, self._frame = self._frame, None
+        return self.received, frame
+
+
+class Smoother:
+    """
+    Exponential moving average of a stream's probabilities: `smoothing` is
+    the weight of the history, 0 passes every frame through unchanged.
+    """
+
+    def __init__(self, smoothing: float):
+        self.smoothing = smoothing
+        self.state: np.ndarray | None = None
+
+    def update(self, probs: np.ndarray) -> np.ndarray:
+        probs = probs.astype(np.float64)
+        if self.state is None:
+            self.state = probs
+        else:
+            self.state = self.smoothing * self.state + (1 - self.smoothing) * probs
+        return self.state
+
+
+def stream_message(
+    frame: int,
+    probs: np.ndarray,
+    classes: list[str],
+    top_k: int | None,
+    dropped: int,
+    latency_ms: float,
+) -> dict:
+    indices = select_classes(probs, top_k)
+    if indices is None:
+        indices = range(len(classes))
+    return {
+        'frame': frame,
+        'predictions': {classes[i]: float(probs[i]) for i in indices},
+        'dropped': dropped,
+        'latency_ms': latency_ms,
+    }
+
+
+def prepare_frame(frame: bytes, transform) -> torch.Tensor | None:
+    """Decoded and transformed single-image batch, None if undecodable."""
+    try:
+        image = decode_image(frame)
+    except cv2.error:
+        return None
+    return transform(image=image)['image'].unsqueeze(0)
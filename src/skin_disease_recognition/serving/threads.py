@@ -0,0 +1,56 @@
+import logging
+
+import torch
+
+from skin_disease_recognition.utils.resources import available_cpus
+
+logger = logging.getLogger(__name__)
+
+SERVING_MODES = ('single', 'batch')
+
+
+def plan_threads(mode: str, workers: int, cpus: int) -> tuple[int, int]:
+    """
+    Returns (intra_op, inter_op) thread counts for one server worker.
+
+    The CPU budget is split evenly between worker processes. In 'single' mode
+    every request gets all of the worker's threads; in 'batch' mode two
+    batches run side by side, each with half of them.
+    """
+    if mode not in SERVING_MODES:
+        raise ValueError(f'Unknown serving mode: {mode}')
+    per_worker = max(1, cpus // max(1, workers))
+    if mode == 'single':
+        return per_worker, 1
+    return max(1, per_worker // 2), min(2, per_worker)
+
+
+def configure_torch_threads(
+    mode: str,
+    workers: int,
+    num_threads: int | None = None,
+    num_interop_threads: int | None = None,
+) -> dict:
+    cpus = available_cpus()
+    intra, inter = plan_threads(mode, workers, cpus)
+    if num_threads is not None:
+        intra = num_threads
+    if num_interop_threads is not None:
+        inter = num_interop_threads
+
+    torch.set_num_threads(intra)
+    try:
+        torch.set_num_interop_threads(inter)
+    except RuntimeError:
+        # Inter-op pool can only be sized once per process, before first use
+        logger.warning('Inter-op thread pool already started, keeping its size')
+
+    settings = {
+        'mode': mode,
+        'workers': workers,
+        'available_cpus': cpus,
+        'num_threads': torch.get_num_threads(),
+        'num_interop_threads': torch.get_num_interop_threads(),
+    }
+    logger.info(f'Torch threads configured: {settings}')
+    return settings
@@ -0,0 +1,85 @@
+import os
+
+import torch
+from torch import Tensor, nn
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+from skin_disease_recognition.utils.resources import available_cpus
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def setup_distributed(device: str) -> str:
+    """
+    Joins the process group when launched by torchrun (WORLD_SIZE > 1) and
+    returns the device this process trains on: its own GPU with NCCL, or the
+    CPU with gloo, where the CPU quota is split between processes.
+    Single-process runs return `device` unchanged.
+    """
+    world_size = int(os.getenv('WORLD_SIZE', '1'))
+    if world_size <= 1 or is_distributed():
+        return device
+
+    local_rank = int(os.getenv('LOCAL_RANK', '0'))
+    if torch.device(device).type == 'cuda':
+        torch.cuda.set_device(local_rank)
+        device = f'cuda:{local_rank}'
+        backend = 'nccl'
+    else:
+        # torchrun defaults OMP_NUM_THREADS to 1
+        torch.set_num_threads(max(1, available_cpus() // world_size))
+        backend = 'gloo'
+    dist.init_process_group(backend=backend)
+    return device
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def unwrap(model: nn.Module) -> nn.Module:
+    if isinstance(model, DistributedDataParallel):
+        return model.module
+    return model
+
+
+def all_reduce_sum(tensor: Tensor) -> Tensor:
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast_from_main(tensors: list[Tensor]):
+    if is_distributed():
+        for tensor in tensors:
+            dist.broadcast(tensor, src=0)
+
+
+def any_rank(flag: bool, device: str) -> bool:
+    """True on every rank if `flag` is True on at least one of them."""
+    if not is_distributed():
+        return flag
+    value = torch.tensor(float(flag), device=device)
+    dist.all_reduce(value, op=dist.ReduceOp.MAX)
+    return bool(value.item())
@@ -1,10 +1,9 @@
 from matplotlib import pyplot as plt
+import numpy as np
 import seaborn as sns
-from sklearn.metrics import confusion_matrix
 
 
-def plot_confusion_matrix(path: str, y_trues: list, y_preds: list, classes: list[str]):
-    conf = confusion_matrix(y_trues, y_preds)
+def plot_confusion_matrix(path: str, conf: np.ndarray, classes: list[str]):
     plt.figure(figsize=(10, 8))
     sns.heatmap(
         conf,
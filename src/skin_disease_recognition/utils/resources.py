@@ -0,0 +1,52 @@
+import math
+import os
+from pathlib import Path
+
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+
+
+def _cgroup_v2_quota(root: Path) -> float | None:
+    try:
+        quota, period = (root / 'cpu.max').read_text().split()[:2]
+    except (FileNotFoundError, ValueError):
+        return None
+    if quota == 'max':
+        return None
+    return int(quota) / int(period)
+
+
+def _cgroup_v1_quota(root: Path) -> float | None:
+    for cpu_dir in (root / 'cpu', root / 'cpu,cpuacct'):
+        try:
+            quota = int((cpu_dir / 'cpu.cfs_quota_us').read_text())
+            period = int((cpu_dir / 'cpu.cfs_period_us').read_text())
+        except (FileNotFoundError, ValueError):
+            continue
+        if quota <= 0 or period <= 0:
+            return None
+        return quota / period
+    return None
+
+
+def cgroup_cpu_quota(root: Path = CGROUP_ROOT) -> float | None:
+    quota = _cgroup_v2_quota(root)
+    if quota is None:
+        quota = _cgroup_v1_quota(root)
+    return quota
+
+
+def available_cpus(root: Path = CGROUP_ROOT) -> int:
+    """
+    Number of CPUs this process can actually use: the affinity mask capped by
+    the cgroup CPU quota (rounded up), so containers limited to e.g. 2.5 CPUs
+    report 3 instead of the host core count.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = cgroup_cpu_quota(root)
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
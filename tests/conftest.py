@@ -71,14 +71,21 @@ def sample_report():
 
 
 class MockModel(nn.Module):
-    def __init__(self, num_classes=5):
+    def __init__(self, num_classes=5, num_features=8):
         super().__init__()
         self.num_classes = num_classes
+        self.num_features = num_features
 
     def forward(self, x):
         batch_size = x.shape[0]
         return torch.randn(batch_size, self.num_classes)
 
+    def forward_features(self, x):
+        return x.flatten(1)[:, : self.num_features]
+
+    def forward_head(self, features):
+        return torch.randn(features.shape[0], self.num_classes)
+
 
 @pytest.fixture
 def mock_model(sample_classes):
@@ -121,7 +128,7 @@ def temp_image_folder():
 
 
 @pytest.fixture
-def test_client(temp_model_dir):
+def test_client(temp_model_dir, tmp_path):
     from fastapi.testclient import TestClient
 
     from skin_disease_recognition.serving.app import app
@@ -133,6 +140,10 @@ def test_client(temp_model_dir):
         patch('skin_disease_recognition.serving.app.MODEL_DIR', model_storage),
         patch('skin_disease_recognition.serving.app.ACTIVE_MODEL', model_name),
         patch('skin_disease_recognition.serving.app.ACTIVE_DEVICE', 'cpu'),
+        patch('skin_disease_recognition.serving.app.JOBS_DIR', tmp_path / 'jobs'),
+        patch(
+            'skin_disease_recognition.serving.app.PROFILE_DIR', tmp_path / 'profiles'
+        ),
     ):
         with TestClient(app) as client:
             yield client
@@ -1,8 +1,17 @@
+import asyncio
 import io
+from pathlib import Path
+import socket
+import threading
+import time
+from unittest.mock import patch
 
 import cv2
+import msgpack
+import numpy as np
 from PIL import Image
 import pytest
+import torch
 
 
 def test_predict_returns_200(test_client, sample_image_bytes):
@@ -195,3 +204,638 @@ def test_mixed_endpoints(test_client, sample_image_bytes):
         ).status_code
         == 200
     )
+
+
+def test_info_thread_settings(test_client):
+    threads = test_client.get('/info').json()['threads']
+
+    assert threads['num_threads'] >= 1
+    assert threads['num_interop_threads'] >= 1
+    assert threads['mode'] == 'single'
+
+
+def test_info_lists_classes(test_client, sample_classes):
+    assert test_client.get('/info').json()['classes'] == sample_classes
+
+
+def test_predict_top_k(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        params={'top_k': 2},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    predictions = list(response.json()['predictions'].values())
+
+    assert len(predictions) == 2
+    assert predictions[0] >= predictions[1]
+
+
+def test_predict_threshold(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        params={'threshold': 0.3},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert all(p >= 0.3 for p in response.json()['predictions'].values())
+
+
+def test_predict_rounding(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        params={'decimals': 2},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    for prob in response.json()['predictions'].values():
+        assert prob == round(prob, 2)
+
+
+def test_predict_array_format(test_client, sample_image_bytes, sample_classes):
+    response = test_client.post(
+        '/predict',
+        params={'format': 'array'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    probabilities = response.json()['probabilities']
+
+    assert len(probabilities) == len(sample_classes)
+    assert abs(sum(probabilities) - 1.0) < 0.01
+
+
+def test_predict_float32_format(test_client, sample_image_bytes, sample_classes):
+    response = test_client.post(
+        '/predict',
+        params={'format': 'float32'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    probs = np.frombuffer(response.content, dtype='<f4')
+
+    assert response.headers['content-type'] == 'application/octet-stream'
+    assert probs.shape == (len(sample_classes),)
+    assert abs(probs.sum() - 1.0) < 0.01
+
+
+def test_predict_msgpack_format(test_client, sample_image_bytes, sample_classes):
+    response = test_client.post(
+        '/predict',
+        params={'format': 'msgpack', 'top_k': 3},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    payload = msgpack.unpackb(response.content)
+
+    assert len(payload['probabilities']) == 3
+    assert all(0 <= i < len(sample_classes) for i in payload['indices'])
+
+
+def test_predict_unknown_format_422(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        params={'format': 'xml'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    assert response.status_code == 422
+
+
+def wait_for_job(test_client, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = test_client.get(f'/jobs/{job_id}').json()
+        if job['status'] == 'completed':
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_job_submit_and_results(test_client, sample_image_bytes, sample_classes):
+    files = [
+        ('files', (f'img_{i}.jpg', sample_image_bytes, 'image/jpeg')) for i in range(5)
+    ]
+    response = test_client.post('/jobs', files=files)
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+
+    job = wait_for_job(test_client, job_id)
+    assert job['done'] == 5
+    assert job['failed'] == 0
+
+    data = test_client.get(f'/jobs/{job_id}/results').json()
+    assert data['classes'] == sample_classes
+    assert [r['index'] for r in data['results']] == list(range(5))
+    for result in data['results']:
+        assert abs(sum(result['probabilities']) - 1.0) < 0.01
+
+
+def test_job_undecodable_image_fails(test_client, sample_image_bytes):
+    files = [
+        ('files', ('good.jpg', sample_image_bytes, 'image/jpeg')),
+        ('files', ('bad.jpg', b'not an image', 'image/jpeg')),
+    ]
+    job_id = test_client.post('/jobs', files=files).json()['job_id']
+
+    job = wait_for_job(test_client, job_id)
+    assert job['done'] == 1
+    assert job['failed'] == 1
+
+
+def test_unknown_job_404(test_client):
+    assert test_client.get('/jobs/missing').status_code == 404
+    assert test_client.get('/jobs/missing/results').status_code == 404
+
+
+def test_embed_returns_features(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/embed',
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()['embedding']) == 8
+
+
+def test_predict_similar_without_index_503(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        params={'similar': 3},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    assert response.status_code == 503
+
+
+def test_predict_similar_cases(test_client, sample_image_bytes, sample_classes):
+    from skin_disease_recognition.serving.app import artifacts
+    from skin_disease_recognition.serving.similarity import SimilarityIndex
+
+    embeddings = np.random.default_rng(0).standard_normal((20, 8))
+    labels = [i % len(sample_classes) for i in range(20)]
+    paths = [f'train/{i}.jpg' for i in range(20)]
+    artifacts['index'] = SimilarityIndex(embeddings, labels, paths)
+
+    response = test_client.post(
+        '/predict',
+        params={'similar': 3},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    data = response.json()
+
+    assert len(data['predictions']) == len(sample_classes)
+    assert len(data['similar_cases']) == 3
+    for case in data['similar_cases']:
+        assert case['label'] in sample_classes
+    assert test_client.get('/similar').json() == {'size': 20, 'dim': 8}
+
+
+def test_profile_disabled_by_default(test_client):
+    assert test_client.get('/admin/profile').status_code == 404
+    assert test_client.post('/admin/profile').status_code == 404
+
+
+@pytest.mark.parametrize('client', ['test_client', 'scheduled_client'])
+def test_profile_predict_window(client, sample_image_bytes, request):
+    client = request.getfixturevalue(client)
+    with patch('skin_disease_recognition.serving.app.PROFILING_ENABLED', True):
+        response = client.post('/admin/profile', params={'requests': 2})
+        assert response.status_code == 202
+        assert client.post('/admin/profile').status_code == 409
+
+        for _ in range(2):
+            client.post(
+                '/predict',
+                files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+            )
+        profile = client.get('/admin/profile').json()
+
+    assert profile['active'] is False
+    assert {name.rsplit('_', 1)[-1] for name in profile['files']} == {
+        'trace.json',
+        'ops.txt',
+    }
+    # Forward passes run off the event loop thread and are still recorded
+    trace = Path(profile['files'][0]).read_text()
+    assert '"default"' in trace
+    assert 'aten::randn' in trace
+
+
+@pytest.mark.parametrize('threshold, stage', [(0.0, 'small'), (2.0, 'large')])
+def test_predict_cascade_stage(
+    test_client, sample_image_bytes, mock_model, sample_metadata, threshold, stage
+):
+    from skin_disease_recognition.serving.app import artifacts
+    from skin_disease_recognition.serving.preprocessing import make_transform
+
+    artifacts['cascade'] = {
+        'model': mock_model,
+        'transform': make_transform(64),
+        'metadata': sample_metadata,
+        'settings': {'criterion': 'max_prob', 'threshold': threshold},
+    }
+
+    response = test_client.post(
+        '/predict',
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    raw = test_client.post(
+        '/predict',
+        params={'format': 'float32'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert response.json()['stage'] == stage
+    assert response.headers['X-Cascade-Stage'] == stage
+    assert raw.headers['X-Cascade-Stage'] == stage
+    assert test_client.get('/info').json()['cascade']['threshold'] == threshold
+
+
+def test_predict_without_cascade_has_no_stage(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert 'stage' not in response.json()
+    assert 'X-Cascade-Stage' not in response.headers
+    assert 'cascade' not in test_client.get('/info').json()
+
+
+def test_expired_deadline_dropped_before_decode(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        headers={'X-Request-Timeout-Ms': '0.001'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert response.status_code == 504
+    assert test_client.get('/metrics').json()['dropped']['expired'] == {'decode': 1}
+
+
+def test_disconnected_client_dropped(test_client, sample_image_bytes):
+    async def disconnected(self):
+        return True
+
+    with patch('starlette.requests.Request.is_disconnected', disconnected):
+        response = test_client.post(
+            '/embed',
+            files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+        )
+
+    assert response.status_code == 499
+    assert test_client.get('/metrics').json()['dropped'] == {
+        'expired': {},
+        'disconnected': {'decode': 1},
+    }
+
+
+def test_generous_deadline_is_served(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        headers={'X-Request-Timeout-Ms': '60000'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert response.status_code == 200
+    assert test_client.get('/metrics').json()['dropped']['expired'] == {}
+
+
+def test_invalid_timeout_header_422(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        headers={'X-Request-Timeout-Ms': '-5'},
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    assert response.status_code == 422
+
+
+@pytest.fixture
+def scheduled_client(temp_model_dir, tmp_path):
+    from fastapi.testclient import TestClient
+
+    from skin_disease_recognition.serving.app import app
+
+    with (
+        patch('skin_disease_recognition.serving.app.MODEL_DIR', temp_model_dir.parent),
+        patch('skin_disease_recognition.serving.app.ACTIVE_MODEL', temp_model_dir.name),
+        patch('skin_disease_recognition.serving.app.ACTIVE_DEVICE', 'cpu'),
+        patch('skin_disease_recognition.serving.app.JOBS_DIR', tmp_path / 'jobs'),
+        patch(
+            'skin_disease_recognition.serving.app.PROFILE_DIR', tmp_path / 'profiles'
+        ),
+        patch('skin_disease_recognition.serving.app.SCHEDULER_WORKERS', 2),
+    ):
+        with TestClient(app) as client:
+            yield client
+
+
+def test_metrics_without_scheduler(test_client):
+    assert test_client.get('/metrics').json()['lanes'] is None
+
+
+def test_priority_lanes(scheduled_client, sample_image_bytes, sample_classes):
+    def post(path, headers=None):
+        return scheduled_client.post(
+            path,
+            headers=headers,
+            files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+        )
+
+    assert len(post('/predict').json()['predictions']) == len(sample_classes)
+    assert post('/bulk/predict').status_code == 200
+    assert post('/predict', headers={'X-Priority': 'bulk'}).status_code == 200
+    assert post('/predict', headers={'X-Priority': 'urgent'}).status_code == 422
+
+    lanes = scheduled_client.get('/metrics').json()['lanes']
+    assert lanes['interactive']['served'] == 1
+    assert lanes['bulk']['served'] == 2
+    assert lanes['bulk']['queue_depth'] == 0
+
+
+def test_disconnect_cancels_queued_inference():
+    from fastapi import HTTPException
+
+    from skin_disease_recognition.serving import app as app_module
+    from skin_disease_recognition.serving.deadlines import (
+        DropCounter,
+        RequestDeadline,
+    )
+    from skin_disease_recognition.serving.scheduler import InferenceScheduler
+
+    release = threading.Event()
+
+    def runner(batch):
+        release.wait(5)
+        return np.zeros((len(batch), 2))
+
+    class LeavesWhileQueued(RequestDeadline):
+        checks = 0
+
+        async def disconnected(self):
+            # Connected at the check before the forward pass, gone after
+            self.checks += 1
+            return self.checks > 1
+
+    drops = DropCounter()
+    scheduler = InferenceScheduler(
+        {'default': runner}, num_workers=1, reserved=0, max_batch=1
+    )
+    scheduler.start()
+    try:
+        # Keeps the only worker busy, so the next request stays queued
+        busy = scheduler.submit(torch.zeros(1, 3, 4, 4), 'interactive')
+        with patch.dict(app_module.artifacts, {'scheduler': scheduler}):
+            with pytest.raises(HTTPException) as e:
+                asyncio.run(
+                    app_module.infer(
+                        'default',
+                        torch.zeros(1, 3, 4, 4),
+                        'interactive',
+                        LeavesWhileQueued(None, None, drops),
+                    )
+                )
+        release.set()
+        busy.result(5)
+    finally:
+        release.set()
+        scheduler.stop()
+
+    assert e.value.status_code == 499
+    assert drops.snapshot()['disconnected'] == {'batch': 1}
+    assert scheduler.stats()['interactive']['served'] == 1
+
+
+def test_embeddings_use_scheduler_lanes(scheduled_client, sample_image_bytes):
+    from skin_disease_recognition.serving.app import artifacts
+    from skin_disease_recognition.serving.similarity import SimilarityIndex
+
+    artifacts['index'] = SimilarityIndex(
+        np.eye(8), [0] * 8, [f'train/{i}.jpg' for i in range(8)]
+    )
+    files = {'file': ('test.jpg', sample_image_bytes, 'image/jpeg')}
+
+    embed = scheduled_client.post('/embed', files=files)
+    similar = scheduled_client.post(
+        '/predict', params={'similar': 2}, files=files, headers={'X-Priority': 'bulk'}
+    )
+
+    assert len(embed.json()['embedding']) == 8
+    assert len(similar.json()['similar_cases']) == 2
+    lanes = scheduled_client.get('/metrics').json()['lanes']
+    assert lanes['interactive']['served'] == 1
+    assert lanes['bulk']['served'] == 1
+
+
+def test_jobs_use_bulk_lane(scheduled_client, sample_image_bytes):
+    job = scheduled_client.post(
+        '/jobs', files=[('files', ('a.jpg', sample_image_bytes, 'image/jpeg'))]
+    ).json()
+    for _ in range(50):
+        if scheduled_client.get(f'/jobs/{job["job_id"]}').json()['done'] == 1:
+            break
+        time.sleep(0.1)
+
+    lanes = scheduled_client.get('/metrics').json()['lanes']
+    assert lanes['bulk']['images'] == 1
+    assert lanes['interactive']['served'] == 0
+
+
+@pytest.fixture
+def candidate_client(temp_model_dir, tmp_path, request):
+    from fastapi.testclient import TestClient
+
+    from skin_disease_recognition.serving.app import app
+
+    with (
+        patch('skin_disease_recognition.serving.app.MODEL_DIR', temp_model_dir.parent),
+        patch('skin_disease_recognition.serving.app.ACTIVE_MODEL', temp_model_dir.name),
+        patch('skin_disease_recognition.serving.app.ACTIVE_DEVICE', 'cpu'),
+        patch('skin_disease_recognition.serving.app.JOBS_DIR', tmp_path / 'jobs'),
+        patch(
+            'skin_disease_recognition.serving.app.PROFILE_DIR', tmp_path / 'profiles'
+        ),
+        patch(
+            'skin_disease_recognition.serving.app.CANDIDATE_MODEL', temp_model_dir.name
+        ),
+        patch('skin_disease_recognition.serving.app.CANDIDATE_MODE', request.param),
+        patch('skin_disease_recognition.serving.app.CANDIDATE_FRACTION', 1.0),
+        patch(
+            'skin_disease_recognition.serving.app.CANDIDATE_DIR', tmp_path / 'candidate'
+        ),
+    ):
+        with TestClient(app) as client:
+            yield client
+
+
+@pytest.mark.parametrize(
+    'candidate_client, served',
+    [('shadow', 'primary'), ('canary', 'candidate')],
+    indirect=['candidate_client'],
+)
+def test_candidate_modes(candidate_client, sample_image_bytes, served):
+    response = candidate_client.post(
+        '/predict',
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+    assert response.status_code == 200
+    assert response.headers['X-Served-By'] == served
+
+    for _ in range(50):
+        summary = candidate_client.get('/candidate').json()
+        if summary['compared'] == 1:
+            break
+        time.sleep(0.1)
+    assert summary['mode'] in ('shadow', 'canary')
+    assert summary['compared'] == 1
+    assert summary['canary_served'] == (served == 'candidate')
+
+
+@pytest.mark.parametrize('candidate_client', ['shadow'], indirect=True)
+def test_cascade_answers_are_not_compared(
+    candidate_client, sample_image_bytes, mock_model, sample_metadata
+):
+    from skin_disease_recognition.serving.app import artifacts
+    from skin_disease_recognition.serving.preprocessing import make_transform
+
+    artifacts['cascade'] = {
+        'model': mock_model,
+        'transform': make_transform(64),
+        'metadata': sample_metadata,
+        'settings': {'criterion': 'max_prob', 'threshold': 0.0},
+    }
+    with patch.object(artifacts['candidate']['worker'], 'offer') as offer:
+        response = candidate_client.post(
+            '/predict',
+            files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+        )
+
+    assert response.headers['X-Cascade-Stage'] == 'small'
+    offer.assert_not_called()
+
+
+def test_candidate_not_configured_404(test_client, sample_image_bytes):
+    response = test_client.post(
+        '/predict',
+        files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')},
+    )
+
+    assert 'X-Served-By' not in response.headers
+    assert test_client.get('/candidate').status_code == 404
+
+
+def test_monitoring(test_client, sample_image_bytes, sample_classes, monkeypatch):
+    from skin_disease_recognition.serving.app import artifacts
+    from skin_disease_recognition.serving.monitoring import DriftMonitor
+
+    test_client.post(
+        '/predict', files={'file': ('test.jpg', sample_image_bytes, 'image/jpeg')}
+    )
+    body = test_client.get('/monitoring').json()
+    assert body['live']['count'] == 1
+    assert sum(body['live']['predictions'].values()) == pytest.approx(1.0)
+    assert body['reference'] is None
+    assert body['drift'] is None
+
+    monkeypatch.setitem(artifacts, 'reference', DriftMonitor(sample_classes))
+    body = test_client.get('/monitoring').json()
+    assert body['reference']['count'] == 0
+    assert body['drift']['drifted'] == []
+
+
+def test_stream_predictions(test_client, sample_image_bytes, sample_classes):
+    with test_client.websocket_connect('/ws/predict?smoothing=0.5') as ws:
+        ws.send_bytes(sample_image_bytes)
+        first = ws.receive_json()
+        ws.send_bytes(b'not an image')
+        error = ws.receive_json()
+        ws.send_bytes(sample_image_bytes)
+        second = ws.receive_json()
+
+    assert first['frame'] == 1
+    assert list(first['predictions']) == sample_classes
+    assert sum(first['predictions'].values()) == pytest.approx(1.0)
+    assert error == {'frame': 2, 'error': 'Invalid image'}
+    assert second['frame'] == 3
+    assert sum(second['predictions'].values()) == pytest.approx(1.0)
+
+
+def test_stream_top_k(test_client, sample_image_bytes):
+    with test_client.websocket_connect('/ws/predict?top_k=2') as ws:
+        ws.send_bytes(sample_image_bytes)
+        assert len(ws.receive_json()['predictions']) == 2
+
+
+def test_stream_session_limit(test_client):
+    from starlette.websockets import WebSocketDisconnect
+
+    with patch('skin_disease_recognition.serving.app.STREAM_MAX_SESSIONS', 0):
+        with test_client.websocket_connect('/ws/predict') as ws:
+            with pytest.raises(WebSocketDisconnect) as exc_info:
+                ws.receive_json()
+    assert exc_info.value.code == 1013
+
+
+@pytest.fixture
+def grpc_client(temp_model_dir, tmp_path):
+    from fastapi.testclient import TestClient
+    import grpc
+
+    from skin_disease_recognition.serving.app import app
+    from skin_disease_recognition.serving.grpc_server import InferenceStub
+
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+
+    with (
+        patch('skin_disease_recognition.serving.app.MODEL_DIR', temp_model_dir.parent),
+        patch('skin_disease_recognition.serving.app.ACTIVE_MODEL', temp_model_dir.name),
+        patch('skin_disease_recognition.serving.app.ACTIVE_DEVICE', 'cpu'),
+        patch('skin_disease_recognition.serving.app.JOBS_DIR', tmp_path / 'jobs'),
+        patch(
+            'skin_disease_recognition.serving.app.PROFILE_DIR', tmp_path / 'profiles'
+        ),
+        patch('skin_disease_recognition.serving.app.SCHEDULER_WORKERS', 2),
+        patch('skin_disease_recognition.serving.app.GRPC_PORT', port),
+    ):
+        with (
+            TestClient(app) as client,
+            grpc.insecure_channel(f'localhost:{port}') as channel,
+        ):
+            yield client, InferenceStub(channel)
+
+
+def test_grpc_shares_scheduler(grpc_client, sample_image_bytes):
+    from skin_disease_recognition.serving.grpc_server import (
+        BatchPredictRequest,
+        PredictRequest,
+    )
+
+    client, stub = grpc_client
+    stub.Predict(PredictRequest(image=sample_image_bytes))
+    stub.PredictBatch(BatchPredictRequest(images=[sample_image_bytes] * 3))
+
+    lanes = client.get('/metrics').json()['lanes']
+    assert lanes['interactive']['served'] == 1
+    assert lanes['bulk']['images'] == 3
+    assert client.get('/monitoring').json()['live']['count'] == 4
+
+
+def test_transport_benchmark(grpc_client, sample_image_bytes):
+    from skin_disease_recognition.serving.benchmark_transport import (
+        TRANSPORTS,
+        run_benchmark,
+    )
+
+    client, stub = grpc_client
+    table = run_benchmark(
+        client,
+        stub,
+        sample_image_bytes,
+        list(TRANSPORTS),
+        requests=4,
+        concurrency=2,
+        batch_size=2,
+        warmup=1,
+        iters=2,
+    )
+
+    assert table['transport'].tolist() == list(TRANSPORTS)
+    assert table['images_per_call'].tolist() == [1, 1, 1, 1, 2]
+    assert (table['images_per_s'] > 0).all()
@@ -0,0 +1,80 @@
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from skin_disease_recognition.modeling.averaging import (
+    AveragedWeights,
+    recalibrate_batch_norm,
+)
+
+
+def make_model():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4), nn.Linear(4, 2))
+
+
+def test_swa_is_equal_weight_mean():
+    model = make_model()
+    swa = AveragedWeights(model)
+    weight = model[0].weight
+    snapshots = []
+    for value in (1.0, 2.0, 6.0):
+        with torch.no_grad():
+            weight.fill_(value)
+        snapshots.append(weight.detach().clone())
+        swa.update()
+
+    with swa.swap():
+        torch.testing.assert_close(weight, torch.stack(snapshots).mean(0))
+    torch.testing.assert_close(weight, snapshots[-1])
+
+
+def test_ema_update_with_warmup():
+    model = make_model()
+    ema = AveragedWeights(model, decay=0.99)
+    start = model[0].weight.detach().clone()
+    with torch.no_grad():
+        model[0].weight.add_(1.0)
+    ema.update()
+
+    # First update uses decay = min(0.99, 1 / 10)
+    with ema.swap():
+        torch.testing.assert_close(model[0].weight, start + 0.9)
+
+
+def test_swap_exchanges_storage_without_copy():
+    model = make_model()
+    ema = AveragedWeights(model, decay=0.9)
+    live_ptr = model[0].weight.data_ptr()
+
+    with ema.swap():
+        assert model[0].weight.data_ptr() != live_ptr
+    assert model[0].weight.data_ptr() == live_ptr
+
+
+def test_integer_buffers_are_not_averaged():
+    ema = AveragedWeights(make_model(), decay=0.9)
+
+    assert not any('num_batches_tracked' in name for name in ema.names)
+
+
+def test_recalibrate_batch_norm():
+    model = make_model()
+    features = torch.randn(64, 4) * 3 + 5
+    loader = DataLoader(TensorDataset(features, torch.zeros(64)), batch_size=16)
+    model.eval()
+
+    used = recalibrate_batch_norm(model, loader, 'cpu', num_batches=2)
+    expected = model[0](features[:32]).detach().mean(0)
+
+    assert used == 2
+    assert not model.training
+    assert model[1].momentum == 0.1
+    torch.testing.assert_close(model[1].running_mean, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_recalibrate_without_batch_norm():
+    model = nn.Linear(4, 2)
+    loader = DataLoader(TensorDataset(torch.randn(8, 4), torch.zeros(8)))
+
+    assert recalibrate_batch_norm(model, loader, 'cpu') == 0
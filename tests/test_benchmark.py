@@ -0,0 +1,123 @@
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from skin_disease_recognition.modeling import benchmark_matrix
+from skin_disease_recognition.modeling.benchmark import time_calls
+from skin_disease_recognition.modeling.benchmark_matrix import (
+    PeakMemory,
+    config_specs,
+    exported_f1,
+    quantize_static,
+    run_matrix,
+)
+
+
+def conv_model():
+    return nn.Sequential(
+        nn.Conv2d(3, 4, 3),
+        nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1),
+        nn.Flatten(),
+        nn.Linear(4, 5),
+    ).eval()
+
+
+def test_time_calls_skips_warmup():
+    calls = []
+
+    timing = time_calls(lambda: calls.append(1), 'cpu', warmup=2, iters=5)
+
+    assert len(calls) == 7
+    assert set(timing) == {'latency_ms_mean', 'latency_ms_p50', 'latency_ms_p95'}
+
+
+def test_peak_memory_sees_allocation():
+    with PeakMemory('cpu', interval=0.001) as memory:
+        block = np.ones(64 * 2**20 // 8)
+        time_calls(block.sum, 'cpu', warmup=0, iters=20)
+        del block
+
+    if memory.peak_mb is None:
+        pytest.skip('/proc is not available')
+    assert memory.added_mb >= 0
+    assert memory.peak_mb >= memory.added_mb
+
+
+def test_config_specs():
+    (spec,) = config_specs(['resnet18'])
+
+    assert spec == {
+        'name': 'resnet18',
+        'source': 'config',
+        'model_name': 'RESNET-18',
+        'image_size': 224,
+    }
+
+
+def write_export(folder, model_name, f1, **extra):
+    folder.mkdir(exist_ok=True)
+    with open(folder / 'model_data.json', 'w') as f:
+        json.dump({'model_name': model_name, 'image_size': 32, **extra}, f)
+    with open(folder / 'metrics.json', 'w') as f:
+        json.dump({'f1-score': f1}, f)
+
+
+def test_exported_f1_skips_derived_exports(tmp_path):
+    write_export(tmp_path / 'B0v1', 'EFFICIENTNET-B0', 0.7)
+    write_export(tmp_path / 'B0v2', 'EFFICIENTNET-B0', 0.8)
+    write_export(tmp_path / 'B0v2-pruned30', 'EFFICIENTNET-B0', 0.9, pruning={})
+
+    by_folder, by_model = exported_f1(tmp_path)
+
+    assert by_folder == {'B0v1': 0.7, 'B0v2': 0.8, 'B0v2-pruned30': 0.9}
+    assert by_model == {'EFFICIENTNET-B0': 0.8}
+
+
+def test_quantize_static_covers_convolutions():
+    example = torch.randn(1, 3, 16, 16)
+    quantized = quantize_static(conv_model(), example)
+
+    types = {type(module) for module in quantized.modules()}
+    assert torch.ao.nn.quantized.Conv2d in types or (
+        torch.ao.nn.intrinsic.quantized.ConvReLU2d in types
+    )
+    assert quantized(example).shape == (1, 5)
+
+
+def test_run_matrix_joins_f1(temp_model_dir):
+    model = conv_model()
+    write_export(temp_model_dir, 'MOCK', 0.75)
+    torch.save(model, temp_model_dir / 'model.pth')
+    spec = {
+        'name': temp_model_dir.name,
+        'source': 'export',
+        'model_name': 'MOCK',
+        'image_size': 32,
+    }
+
+    with patch.object(benchmark_matrix, 'MODEL_DIR', temp_model_dir.parent):
+        table = run_matrix(
+            [spec],
+            ['eager', 'quantized'],
+            [1, 4],
+            [1],
+            'cpu',
+            num_classes=5,
+            warmup=1,
+            iters=2,
+            isolate=False,
+        )
+
+    assert len(table) == 4
+    assert set(table['backend']) == {'eager', 'quantized'}
+    assert (table.loc[table['backend'] == 'eager', 'f1_macro'] == 0.75).all()
+    assert table.loc[table['backend'] == 'quantized', 'f1_macro'].isna().all()
+    assert (table['images_per_s'] > 0).all()
+    assert table['params_m'].iloc[0] == pytest.approx(
+        sum(p.numel() for p in model.parameters()) / 1e6
+    )
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from skin_disease_recognition.serving.candidate import (
+    CandidateWorker,
+    Comparison,
+    ComparisonStore,
+)
+from skin_disease_recognition.serving.preprocessing import make_transform
+
+CLASSES = ['a', 'b', 'c']
+
+
+class ConstantModel(nn.Module):
+    def __init__(self, label, num_classes=3):
+        super().__init__()
+        self.logits = torch.zeros(num_classes)
+        self.logits[label] = 5.0
+
+    def forward(self, x):
+        return self.logits.expand(x.shape[0], -1)
+
+
+def loaded(label):
+    return {
+        'model': ConstantModel(label),
+        'transform': make_transform(16),
+        'device': 'cpu',
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ComparisonStore(tmp_path)
+
+
+def comparison(served, served_class, tensor=None):
+    return Comparison(
+        image=np.zeros((20, 20, 3), dtype=np.uint8),
+        tensor=tensor,
+        served=served,
+        served_class=served_class,
+        served_ms=5.0,
+    )
+
+
+def test_summary(store):
+    store.add(
+        [
+            ('cand', 'primary', 0, 0, 10.0, 4.0),
+            ('cand', 'primary', 0, 1, 10.0, 4.0),
+            ('cand', 'candidate', 0, 1, 10.0, 4.0),
+            ('cand', 'primary', 2, 1, 10.0, 4.0),
+            ('other', 'primary', 2, 2, 1.0, 1.0),
+        ]
+    )
+
+    summary = store.summary('cand', CLASSES)
+
+    assert summary['compared'] == 4
+    assert summary['agreement'] == 0.25
+    assert summary['canary_served'] == 1
+    assert summary['disagreements'][0] == {
+        'primary': 'a',
+        'candidate': 'b',
+        'count': 2,
+    }
+    assert summary['primary_latency_ms_p95'] == pytest.approx(10.0)
+    assert summary['candidate_latency_ms_p50'] == pytest.approx(4.0)
+
+
+def test_empty_summary(store):
+    assert store.summary('cand', CLASSES) == {'candidate': 'cand', 'compared': 0}
+
+
+@pytest.mark.parametrize('reuse_tensor', [False, True])
+def test_worker_runs_the_other_model(store, reuse_tensor):
+    worker = CandidateWorker(store, loaded(0), loaded(2), 'cand')
+    tensor = torch.zeros(3, 16, 16) if reuse_tensor else None
+    worker.start()
+    worker.offer(comparison('primary', 0, tensor))
+    worker.offer(comparison('candidate', 2, tensor))
+    worker.stop()
+
+    summary = store.summary('cand', CLASSES)
+    assert summary['compared'] == 2
+    assert summary['agreement'] == 0.0
+    assert summary['canary_served'] == 1
+    assert summary['disagreements'] == [{'primary': 'a', 'candidate': 'c', 'count': 2}]
+
+
+def test_worker_keeps_the_served_latency(store):
+    worker = CandidateWorker(store, loaded(0), loaded(2), 'cand')
+    worker.start()
+    worker.offer(comparison('primary', 0))
+    worker.stop()
+
+    summary = store.summary('cand', CLASSES)
+    assert summary['primary_latency_ms_p50'] == pytest.approx(5.0)
+    assert summary['candidate_latency_ms_p50'] > 0
+
+
+def test_full_queue_skips(store):
+    worker = CandidateWorker(store, loaded(0), loaded(1), 'cand', max_queue=1)
+
+    assert worker.offer(comparison('primary', 0))
+    assert not worker.offer(comparison('primary', 0))
+    assert worker.skipped == 1
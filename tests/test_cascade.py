@@ -0,0 +1,101 @@
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+from skin_disease_recognition.serving.calibrate_cascade import calibrate_cascade
+from skin_disease_recognition.serving.cascade import (
+    calibrate_threshold,
+    confidence,
+    load_cascade,
+    should_escalate,
+)
+
+
+def one_hot(labels, num_classes=3, p=0.9):
+    probs = np.full((len(labels), num_classes), (1 - p) / (num_classes - 1))
+    probs[np.arange(len(labels)), labels] = p
+    return probs
+
+
+def test_confidence():
+    probs = np.array([[0.7, 0.2, 0.1], [0.4, 0.35, 0.25]])
+
+    np.testing.assert_allclose(confidence(probs, 'max_prob'), [0.7, 0.4])
+    np.testing.assert_allclose(confidence(probs, 'margin'), [0.5, 0.05])
+    with pytest.raises(ValueError, match='Unknown'):
+        confidence(probs, 'entropy')
+
+
+def test_calibrate_escalates_least_confident():
+    labels = np.array([0, 1, 2, 0])
+    # The small model is wrong exactly on its two least confident samples
+    small = np.array(
+        [
+            [0.9, 0.05, 0.05],
+            [0.1, 0.8, 0.1],
+            [0.5, 0.3, 0.2],
+            [0.3, 0.4, 0.3],
+        ]
+    )
+    large = one_hot(labels)
+
+    result = calibrate_threshold(
+        small, large, labels, 1.0, small_ms=1.0, large_ms=10.0, criterion='max_prob'
+    )
+
+    assert result['accuracy'] == 1.0
+    assert result['escalation_rate'] == 0.5
+    assert result['expected_latency_ms'] == pytest.approx(6.0)
+    assert result['small_accuracy'] == 0.5
+    assert should_escalate(small[2], result)
+    assert not should_escalate(small[1], result)
+
+
+def test_calibrate_no_escalation_when_small_is_enough():
+    labels = np.array([0, 1, 2])
+    result = calibrate_threshold(
+        one_hot(labels), one_hot(labels), labels, 0.9, 1.0, 10.0, 'margin'
+    )
+
+    assert result['escalation_rate'] == 0.0
+    assert not should_escalate(one_hot(labels)[0], result)
+
+
+def test_calibrate_unreachable_target_escalates_everything():
+    labels = np.array([0, 1, 2])
+    small = one_hot([1, 2, 0])
+    result = calibrate_threshold(
+        small, one_hot(labels), labels, 1.0, 1.0, 10.0, 'max_prob'
+    )
+    assert result['escalation_rate'] == 1.0
+    assert all(should_escalate(p, result) for p in small)
+
+
+def test_ties_are_escalated_together():
+    labels = np.array([0, 0])
+    small = one_hot([0, 1], p=0.6)
+    result = calibrate_threshold(
+        small, one_hot(labels), labels, 0.9, 1.0, 10.0, 'max_prob'
+    )
+
+    assert result['escalation_rate'] == 1.0
+
+
+def test_calibrate_cascade_writes_settings(temp_model_dir, temp_image_folder):
+    small = temp_model_dir.parent / 'small_model'
+    shutil.copytree(temp_model_dir, small)
+    classes = sorted(p.name for p in temp_image_folder.iterdir())
+    for folder in (small, temp_model_dir):
+        (folder / 'class_names.txt').write_text('\n'.join(classes))
+
+    settings = calibrate_cascade(
+        small, temp_model_dir, temp_image_folder, 0.0, 'cpu', num_workers=0
+    )
+
+    assert load_cascade(small) == json.loads(json.dumps(settings))
+    assert settings['large_model'] == temp_model_dir.name
+    assert settings['escalation_rate'] == 0.0
+    with pytest.raises(ValueError, match='calibrate_cascade'):
+        load_cascade(temp_model_dir)
@@ -0,0 +1,115 @@
+import copy
+
+import pytest
+import torch
+from torch import nn
+from torchvision.models import efficientnet_b0, resnet18
+
+from skin_disease_recognition.modeling.checkpointing import (
+    CheckpointedBlock,
+    checkpointed_view,
+    plan_checkpointing,
+    residual_blocks,
+    training_state_mb,
+)
+
+
+def count_wrapped(model):
+    return sum(isinstance(m, CheckpointedBlock) for m in model.modules())
+
+
+@pytest.mark.parametrize('count, expected', [(0, 0), (3, 3), (-1, 8)])
+def test_view_wraps_first_blocks(count, expected):
+    model = resnet18(weights=None, num_classes=5)
+
+    view = checkpointed_view(model, count)
+
+    assert count_wrapped(view) == expected
+    assert count_wrapped(model) == 0
+    assert {id(p) for p in view.parameters()} == {id(p) for p in model.parameters()}
+    if expected:
+        assert isinstance(view.layer1[0], CheckpointedBlock)
+        assert view.layer1[0].block is model.layer1[0]
+
+
+@pytest.mark.parametrize('factory', [resnet18, efficientnet_b0])
+def test_checkpointed_training_step_matches(factory):
+    torch.manual_seed(0)
+    model = factory(weights=None, num_classes=5).train()
+    reference = copy.deepcopy(model)
+    view = checkpointed_view(model, -1).train()
+    x = torch.randn(2, 3, 64, 64)
+
+    torch.manual_seed(1)
+    view(x).sum().backward()
+    torch.manual_seed(1)
+    reference(x).sum().backward()
+
+    for p, q in zip(model.parameters(), reference.parameters(), strict=True):
+        torch.testing.assert_close(p.grad, q.grad, rtol=1e-4, atol=1e-5)
+    # Recomputation in the backward pass must not update running stats again
+    for b, c in zip(model.buffers(), reference.buffers(), strict=True):
+        torch.testing.assert_close(b, c)
+
+
+def test_unsupported_model():
+    with pytest.raises(ValueError, match='not supported'):
+        residual_blocks(nn.Linear(4, 2))
+
+
+def fake_measure(count, batch_size):
+    # Checkpointing each pair of blocks saves 20 MB per image
+    return 1000 + batch_size * (100 - 10 * count)
+
+
+def test_plan_uses_fewest_blocks_for_no_accumulation():
+    plan = plan_checkpointing(fake_measure, 8, 32, 3000)
+
+    assert plan['blocks'] == 4
+    assert plan['batch_size'] == 32
+    assert plan['accumulation_steps'] == 1
+
+
+def test_plan_keeps_effective_batch():
+    plan = plan_checkpointing(fake_measure, 8, 32, 1500, extra_mb=100)
+
+    assert plan['batch_size'] * plan['accumulation_steps'] == 32
+    assert plan['predicted_mb'] <= 1500
+    assert (plan['blocks'], plan['batch_size']) == (8, 16)
+
+
+def test_plan_fails_when_nothing_fits():
+    with pytest.raises(ValueError, match='No micro-batch'):
+        plan_checkpointing(fake_measure, 8, 32, 500)
+
+
+def test_plan_keeps_headroom():
+    plan = plan_checkpointing(fake_measure, 8, 32, 3000, headroom=0.5)
+
+    assert plan['measured_mb'] <= 1500
+    assert (plan['blocks'], plan['batch_size']) == (8, 16)
+
+
+def test_plan_checks_the_chosen_batch_with_a_real_step():
+    def measure(count, batch_size):
+        # Grows faster than the probes at 2 and 4 suggest
+        return fake_measure(count, batch_size) + (400 if batch_size >= 16 else 0)
+
+    plan = plan_checkpointing(measure, 8, 32, 1500)
+
+    assert plan['measured_mb'] <= 1500
+    # The fewest blocks that fit the fallback micro-batch
+    assert (plan['blocks'], plan['batch_size']) == (4, 8)
+    assert plan['accumulation_steps'] == 4
+
+
+def test_training_state_counts_buckets_and_averaged_copies():
+    model = nn.Sequential(nn.Linear(1024, 256), nn.BatchNorm1d(256))
+    model[0].bias.requires_grad = False
+    trainable = 1024 * 256 * 4 + 2 * 256 * 4
+    # Plus the frozen bias and the BatchNorm running mean and variance
+    averaged = trainable + 3 * 256 * 4
+    mb = 2**20
+
+    assert training_state_mb(model, 2, False, 0) == 2 * trainable / mb
+    assert training_state_mb(model, 2, True, 2) == (3 * trainable + 2 * averaged) / mb
@@ -1,9 +1,25 @@
+import shutil
+
+from hydra import compose, initialize_config_dir
 import numpy as np
+from omegaconf import OmegaConf
+import pandas as pd
 import pytest
 import torch
 
+from skin_disease_recognition.core.config import PROJECT_ROOT
 from skin_disease_recognition.data.dataset import SkinDataset
-from skin_disease_recognition.data.factory import get_transforms
+from skin_disease_recognition.data.factory import (
+    ProgressiveResizing,
+    get_transforms,
+    loader_kwargs,
+)
+from skin_disease_recognition.data.tune_loader import (
+    candidate_settings,
+    pick_best,
+    tuned_config,
+    write_override,
+)
 
 
 def test_dataset_init(temp_image_folder):
@@ -97,6 +113,144 @@ def test_test_no_augmentation(mock_hydra_cfg):
     assert 'Resize' in names
 
 
+def test_transforms_custom_size(mock_hydra_cfg):
+    transform = get_transforms(mock_hydra_cfg, stage='train', image_size=128)
+    sample = np.random.randint(0, 255, (100, 100, 3), dtype=np.uint8)
+
+    assert transform(image=sample)['image'].shape == (3, 128, 128)
+
+
+def test_progressive_resizing_schedule(mock_hydra_cfg):
+    schedule = ProgressiveResizing(
+        mock_hydra_cfg, start_size=128, ramp_epochs=4, step=32
+    )
+    sizes = [schedule.size_for_epoch(epoch) for epoch in range(6)]
+
+    assert sizes[0] == 128
+    assert sizes[4:] == [224, 224]
+    assert sizes == sorted(sizes)
+    assert all(size % 32 == 0 for size in sizes)
+
+
+def test_progressive_resizing_disabled_ramp(mock_hydra_cfg):
+    schedule = ProgressiveResizing(
+        mock_hydra_cfg, start_size=128, ramp_epochs=0, step=32
+    )
+
+    assert schedule.size_for_epoch(0) == 224
+
+
+def test_progressive_resizing_loader(mock_hydra_cfg, temp_image_folder):
+    mock_hydra_cfg.data.train_path = str(temp_image_folder)
+    schedule = ProgressiveResizing(
+        mock_hydra_cfg, start_size=64, ramp_epochs=2, step=32
+    )
+    images, _ = next(iter(schedule.make_loader(64)))
+
+    assert images.shape == (4, 3, 64, 64)
+
+
+def test_loader_kwargs_without_workers():
+    cfg = OmegaConf.create(
+        {'data': {'num_workers': 0, 'prefetch_factor': 4, 'persistent_workers': True}}
+    )
+
+    assert loader_kwargs(cfg) == {'num_workers': 0, 'pin_memory': True}
+
+
+def test_loader_kwargs_with_workers():
+    cfg = OmegaConf.create(
+        {'data': {'num_workers': 2, 'prefetch_factor': 4, 'persistent_workers': True}}
+    )
+    kwargs = loader_kwargs(cfg)
+
+    assert kwargs['prefetch_factor'] == 4
+    assert kwargs['persistent_workers'] is True
+
+
+def test_loader_kwargs_defaults():
+    kwargs = loader_kwargs(OmegaConf.create({'data': {'num_workers': 2}}))
+
+    assert 'prefetch_factor' not in kwargs
+    assert kwargs['persistent_workers'] is False
+
+
+def test_candidate_settings():
+    candidates = candidate_settings([0, 2], [2, 4], [False, True])
+
+    # 1 setting without workers, 2 x 2 with workers
+    assert len(candidates) == 5
+    assert candidates[0] == {
+        'num_workers': 0,
+        'prefetch_factor': None,
+        'persistent_workers': False,
+    }
+
+
+def test_pick_best_prefers_fewer_workers():
+    results = pd.DataFrame(
+        [
+            {
+                'num_workers': 8,
+                'prefetch_factor': 2,
+                'persistent_workers': True,
+                'images_per_sec': 100.0,
+            },
+            {
+                'num_workers': 4,
+                'prefetch_factor': 2,
+                'persistent_workers': True,
+                'images_per_sec': 98.0,
+            },
+            {
+                'num_workers': 0,
+                'prefetch_factor': None,
+                'persistent_workers': False,
+                'images_per_sec': 20.0,
+            },
+        ]
+    )
+
+    assert pick_best(results)['num_workers'] == 4
+
+
+def test_write_override(tmp_path):
+    path = write_override(
+        {
+            'num_workers': 4,
+            'prefetch_factor': 2.0,
+            'persistent_workers': True,
+        },
+        path=tuned_config('resnet18', tmp_path),
+    )
+    content = path.read_text()
+    data = OmegaConf.load(path).data
+
+    assert content.startswith('# @package _global_')
+    assert 'batch_size' not in data
+    assert 'accumulation_steps' not in data
+    assert data.num_workers == 4
+    assert data.prefetch_factor == 2
+    assert data.persistent_workers is True
+
+
+def test_tuned_override_applies_to_its_model_only(tmp_path):
+    conf_dir = tmp_path / 'conf'
+    shutil.copytree(PROJECT_ROOT / 'conf', conf_dir)
+    write_override(
+        {'num_workers': 7, 'prefetch_factor': None, 'persistent_workers': False},
+        tuned_config('resnet18', conf_dir / 'loader'),
+    )
+
+    with initialize_config_dir(config_dir=str(conf_dir), version_base='1.2'):
+        tuned = compose(config_name='config', overrides=['model=resnet18'])
+        other = compose(config_name='config', overrides=['model=efficientnet_b0'])
+
+    assert tuned.data.num_workers == 7
+    assert other.data.num_workers == 4
+    assert tuned.data.batch_size == other.data.batch_size
+
+
 @pytest.fixture
 def mock_hydra_cfg():
     from unittest.mock import MagicMock
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from fastapi import HTTPException
+import pytest
+
+from skin_disease_recognition.serving.deadlines import DropCounter, RequestDeadline
+
+
+def test_no_timeout_never_expires():
+    deadline = RequestDeadline(None, None, DropCounter())
+
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    asyncio.run(deadline.check('forward'))
+
+
+def test_deadline_counts_from_arrival():
+    received = time.monotonic() - 1.0
+    deadline = RequestDeadline(None, 500, DropCounter(), received_at=received)
+
+    assert deadline.remaining() < 0
+    assert deadline.expired()
+
+
+def test_expired_check_records_drop():
+    drops = DropCounter()
+    deadline = RequestDeadline(None, 1, drops, received_at=time.monotonic() - 1.0)
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(deadline.check('forward'))
+
+    assert e.value.status_code == 504
+    assert drops.snapshot() == {'expired': {'forward': 1}, 'disconnected': {}}
+
+
+def test_drop_counter_snapshot():
+    drops = DropCounter()
+    for stage in ('decode', 'decode', 'forward'):
+        drops.record('disconnected', stage)
+
+    assert drops.snapshot()['disconnected'] == {'decode': 2, 'forward': 1}
@@ -0,0 +1,83 @@
+from omegaconf import OmegaConf
+import pytest
+import torch
+from torch import nn
+
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.data.factory import get_transforms
+from skin_disease_recognition.modeling.distill import (
+    AugmentedView,
+    DistillationDataset,
+    DistillationLoss,
+    compute_teacher_logits,
+)
+
+
+@pytest.fixture
+def cfg():
+    return OmegaConf.create(
+        {
+            'seed': 42,
+            'device': 'cpu',
+            'model': {'image_size': 32},
+            'data': {'batch_size': 4, 'num_workers': 0},
+        }
+    )
+
+
+@pytest.fixture
+def train_dataset(cfg, temp_image_folder):
+    return SkinDataset(str(temp_image_folder), get_transforms(cfg, 'train'))
+
+
+def test_loss_plain_labels_use_hard_loss():
+    loss_fn = DistillationLoss(nn.CrossEntropyLoss(), temperature=4.0, alpha=0.7)
+    pred = torch.randn(8, 3)
+    labels = torch.randint(0, 3, (8,))
+
+    torch.testing.assert_close(
+        loss_fn(pred, labels), nn.CrossEntropyLoss()(pred, labels)
+    )
+
+
+def test_loss_combines_soft_and_hard_terms():
+    pred = torch.randn(8, 3)
+    labels = torch.randint(0, 3, (8,))
+    target = torch.cat([labels[:, None].float(), pred.clone()], dim=1)
+
+    hard_only = DistillationLoss(nn.CrossEntropyLoss(), temperature=2.0, alpha=0.0)
+    soft_only = DistillationLoss(nn.CrossEntropyLoss(), temperature=2.0, alpha=1.0)
+
+    torch.testing.assert_close(
+        hard_only(pred, target), nn.CrossEntropyLoss()(pred, labels)
+    )
+    # Student already matches the teacher
+    assert soft_only(pred, target).item() == pytest.approx(0.0, abs=1e-6)
+
+
+def test_augmented_view_is_deterministic(train_dataset):
+    views = AugmentedView(train_dataset, seed=1)
+    first, _ = views.get(0, 2)
+    again, _ = views.get(0, 2)
+    other = [views.get(view, 2)[0] for view in range(1, 6)]
+
+    torch.testing.assert_close(first, again)
+    assert any(not torch.equal(first, image) for image in other)
+
+
+def test_teacher_logits_and_targets(cfg, train_dataset, mock_model):
+    logits = compute_teacher_logits(
+        mock_model, AugmentedView(train_dataset, cfg.seed), 2, cfg
+    )
+    dataset = DistillationDataset(train_dataset, cfg.seed, logits)
+    _, target = dataset[0]
+
+    assert logits.shape == (2, len(train_dataset), 5)
+    assert logits.dtype == torch.float16
+    assert target.shape == (6,)
+    assert target[0].item() == train_dataset.targets[0]
+
+
+def test_stale_logits_rejected(cfg, train_dataset):
+    with pytest.raises(ValueError, match='do not match'):
+        DistillationDataset(train_dataset, cfg.seed, torch.zeros(1, 3, 5))
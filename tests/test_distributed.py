@@ -0,0 +1,82 @@
+import pytest
+import torch
+import torch.distributed as dist
+
+from skin_disease_recognition.data.samplers import (
+    DistributedWeightedSampler,
+    ShardSampler,
+)
+from skin_disease_recognition.utils.distributed import (
+    all_reduce_sum,
+    any_rank,
+    get_world_size,
+    is_main_process,
+    setup_distributed,
+)
+
+
+def test_weighted_sampler_shards_are_disjoint_parts_of_one_draw():
+    weights = [1.0] * 10
+    shards = [
+        list(DistributedWeightedSampler(weights, 10, seed=1, rank=r, world_size=3))
+        for r in range(3)
+    ]
+    full = torch.multinomial(
+        torch.ones(10, dtype=torch.double),
+        12,
+        replacement=True,
+        generator=torch.Generator().manual_seed(1),
+    ).tolist()
+
+    assert [len(shard) for shard in shards] == [4, 4, 4]
+    assert sorted(sum(shards, [])) == sorted(full)
+
+
+def test_weighted_sampler_follows_weights():
+    sampler = DistributedWeightedSampler([0.0, 1.0], 100, rank=0, world_size=2)
+
+    assert set(sampler) == {1}
+
+
+def test_weighted_sampler_set_epoch_changes_draw():
+    sampler = DistributedWeightedSampler([1.0] * 50, 50, rank=1, world_size=2)
+    first = list(sampler)
+    sampler.set_epoch(1)
+
+    assert list(sampler) != first
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+
+def test_shard_sampler_covers_each_index_once():
+    shards = [list(ShardSampler(10, rank=r, world_size=3)) for r in range(3)]
+
+    assert sorted(sum(shards, [])) == list(range(10))
+    assert [len(ShardSampler(10, rank=r, world_size=3)) for r in range(3)] == [
+        4,
+        3,
+        3,
+    ]
+
+
+def test_single_process_defaults():
+    assert setup_distributed('cpu') == 'cpu'
+    assert get_world_size() == 1
+    assert is_main_process()
+    assert any_rank(True, 'cpu') is True
+    assert all_reduce_sum(torch.tensor(2.0)).item() == 2.0
+
+
+@pytest.fixture
+def gloo_group(tmp_path):
+    dist.init_process_group(
+        'gloo', init_method=f'file://{tmp_path / "store"}', rank=0, world_size=1
+    )
+    yield
+    dist.destroy_process_group()
+
+
+def test_collectives_with_process_group(gloo_group):
+    assert all_reduce_sum(torch.tensor([1.0, 2.0])).tolist() == [1.0, 2.0]
+    assert any_rank(False, 'cpu') is False
+    assert any_rank(True, 'cpu') is True
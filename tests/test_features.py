@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock
+
+import pytest
+import torch
+import torchvision
+
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.modeling.features import (
+    cached_features,
+    forward_features,
+    forward_head,
+    get_head,
+)
+from skin_disease_recognition.serving.preprocessing import make_transform
+
+
+@pytest.fixture(
+    params=[torchvision.models.resnet18, torchvision.models.efficientnet_b0]
+)
+def small_model(request):
+    model = request.param(weights=None, num_classes=3)
+    model.eval()
+    return model
+
+
+def test_features_then_head_matches_forward(small_model):
+    x = torch.randn(2, 3, 64, 64)
+
+    with torch.no_grad():
+        features = forward_features(small_model, x)
+        logits = forward_head(small_model, features)
+        expected = small_model(x)
+
+    assert features.ndim == 2
+    assert torch.allclose(logits, expected, atol=1e-5)
+
+
+def test_get_head_is_submodule(small_model):
+    head = get_head(small_model)
+
+    assert any(m is head for m in small_model.modules())
+
+
+def test_unsupported_model_raises():
+    with pytest.raises(ValueError):
+        forward_features(torch.nn.Linear(2, 2), torch.randn(1, 2))
+
+
+def test_cached_features_reused(temp_image_folder, tmp_path):
+    model = torchvision.models.resnet18(weights=None, num_classes=3).eval()
+    dataset = SkinDataset(str(temp_image_folder), transform=make_transform(32))
+    cfg = MagicMock()
+    cfg.data.batch_size = 4
+    cfg.data.num_workers = 0
+    cfg.device = 'cpu'
+    cache_path = tmp_path / 'features.pt'
+
+    first = cached_features(model, dataset, cache_path, cfg, views=2)
+    assert cache_path.exists()
+    assert len(first) == 2 * len(dataset)
+    assert first.features.shape == (18, 512)
+
+    model.layer1 = None
+    second = cached_features(model, dataset, cache_path, cfg, views=2)
+    assert torch.equal(first.features, second.features)
+    assert second.classes == dataset.classes
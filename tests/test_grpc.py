@@ -0,0 +1,135 @@
+from pathlib import Path
+import re
+import time
+from unittest.mock import patch
+
+import grpc
+import numpy as np
+import pytest
+
+from skin_disease_recognition.serving.deadlines import DropCounter
+import skin_disease_recognition.serving.grpc_server as grpc_server
+from skin_disease_recognition.serving.grpc_server import (
+    BatchPredictRequest,
+    InferenceStub,
+    InfoRequest,
+    PredictRequest,
+    start_server,
+)
+from skin_disease_recognition.serving.loading import load_artifacts
+from skin_disease_recognition.serving.monitoring import DriftMonitor
+
+
+@pytest.fixture
+def loaded(temp_model_dir):
+    loaded = load_artifacts(temp_model_dir, 'cpu')
+    loaded['drops'] = DropCounter()
+    loaded['monitor'] = DriftMonitor(loaded['classes'])
+    loaded['scheduler'] = None
+    return loaded
+
+
+@pytest.fixture
+def stub(loaded):
+    server, port = start_server(loaded, 0, workers=4)
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        yield InferenceStub(channel)
+    server.stop(grace=None)
+
+
+def test_messages_match_proto():
+    proto = (Path(grpc_server.__file__).parent / 'inference.proto').read_text()
+    declared = {
+        name: re.findall(r'^\s*(?:repeated )?\w+ (\w+) = \d+;', body, re.M)
+        for name, body in re.findall(r'message (\w+) \{(.*?)\}', proto, re.S)
+    }
+    methods = re.findall(r'rpc (\w+)\(', proto)
+
+    assert declared == {
+        name: [field for field, _ in fields]
+        for name, fields in grpc_server.MESSAGES.items()
+    }
+    assert methods == list(grpc_server.METHODS)
+
+
+def test_predict(stub, loaded, sample_image_bytes, sample_classes):
+    response = stub.Predict(PredictRequest(image=sample_image_bytes, request_id='a'))
+    probs = np.array(response.probabilities, dtype=np.float32)
+
+    assert response.request_id == 'a'
+    assert probs.shape == (len(sample_classes),)
+    assert probs.sum() == pytest.approx(1.0, abs=1e-5)
+    assert response.latency_ms > 0
+    assert loaded['monitor'].summary()['count'] == 1
+
+
+def test_predict_invalid_image(stub):
+    with pytest.raises(grpc.RpcError) as e:
+        stub.Predict(PredictRequest(image=b'not an image'))
+
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_predict_unknown_lane(stub, sample_image_bytes):
+    with pytest.raises(grpc.RpcError) as e:
+        stub.Predict(
+            PredictRequest(image=sample_image_bytes),
+            metadata=[('x-priority', 'urgent')],
+        )
+
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_predict_batch(stub, sample_image_bytes, sample_classes):
+    response = stub.PredictBatch(
+        BatchPredictRequest(images=[sample_image_bytes, b'broken', sample_image_bytes])
+    )
+
+    assert [r.error for r in response.results] == ['', 'Invalid image', '']
+    assert [len(r.probabilities) for r in response.results] == [
+        len(sample_classes),
+        0,
+        len(sample_classes),
+    ]
+
+
+def test_predict_stream_in_order(stub, sample_image_bytes, sample_classes):
+    requests = [
+        PredictRequest(image=sample_image_bytes, request_id='1'),
+        PredictRequest(image=b'broken', request_id='2'),
+        PredictRequest(image=sample_image_bytes, request_id='3'),
+    ]
+
+    responses = list(stub.PredictStream(iter(requests)))
+
+    assert [r.request_id for r in responses] == ['1', '2', '3']
+    assert responses[1].error == 'Invalid image'
+    assert len(responses[2].probabilities) == len(sample_classes)
+
+
+def test_default_deadline(stub, sample_image_bytes):
+    with patch.object(grpc_server, 'REQUEST_TIMEOUT_MS', 1e-6):
+        with pytest.raises(grpc.RpcError) as e:
+            stub.Predict(PredictRequest(image=sample_image_bytes))
+
+    assert e.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+
+
+def test_stream_default_deadline_per_message(stub, sample_image_bytes):
+    def requests():
+        for i in range(3):
+            time.sleep(0.1)
+            yield PredictRequest(image=sample_image_bytes, request_id=str(i))
+
+    with patch.object(grpc_server, 'REQUEST_TIMEOUT_MS', 50):
+        responses = list(stub.PredictStream(requests()))
+
+    assert [r.request_id for r in responses] == ['0', '1', '2']
+
+
+def test_info(stub, sample_metadata, sample_classes):
+    response = stub.Info(InfoRequest())
+
+    assert response.model_name == sample_metadata['model_name']
+    assert response.model_version == sample_metadata['version']
+    assert list(response.classes) == sample_classes
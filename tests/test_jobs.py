@@ -0,0 +1,143 @@
+import io
+from pathlib import Path
+import sqlite3
+import time
+from unittest.mock import patch
+
+from skin_disease_recognition.serving.jobs import JobStore, JobWorkerPool
+
+
+def make_store(tmp_path, n=4):
+    store = JobStore(tmp_path / 'jobs')
+    files = [(f'img_{i}.jpg', io.BytesIO(b'bytes')) for i in range(n)]
+    job_id, total = store.create_job(files)
+    return store, job_id, total
+
+
+def test_create_job(tmp_path):
+    store, job_id, total = make_store(tmp_path)
+
+    assert total == 4
+    assert store.status(job_id)['pending'] == 4
+    assert store.status(job_id)['status'] == 'in_progress'
+
+
+def test_claim_is_exclusive(tmp_path):
+    store, _, _ = make_store(tmp_path)
+
+    first_claim, first = store.claim(3)
+    second_claim, second = store.claim(3)
+
+    assert first_claim != second_claim
+    assert len(first) == 3
+    assert len(second) == 1
+    assert not {r[:2] for r in first} & {r[:2] for r in second}
+
+
+def test_restart_resumes_without_rescoring(tmp_path):
+    store, job_id, _ = make_store(tmp_path)
+
+    claim, done = store.claim(2)
+    store.complete(claim, [(j, i, [1.0, 0.0]) for j, i, _ in done], [])
+    store.claim(2)
+
+    reopened = JobStore(tmp_path / 'jobs', lease=0)
+    assert reopened.requeue_stale() == 2
+
+    _, remaining = reopened.claim(10)
+    assert {i for _, i, _ in remaining} == {2, 3}
+    assert reopened.status(job_id)['done'] == 2
+
+
+def test_live_claims_are_not_requeued(tmp_path):
+    store, job_id, _ = make_store(tmp_path)
+    store.claim(2)
+
+    # Another worker process starting on the same store
+    other = JobStore(tmp_path / 'jobs')
+    assert other.requeue_stale() == 0
+    assert {i for _, i, _ in other.claim(10)[1]} == {2, 3}
+
+
+def test_expired_claim_cannot_complete(tmp_path):
+    store, job_id, _ = make_store(tmp_path, n=1)
+    late, claimed = store.claim(1)
+    expired = JobStore(tmp_path / 'jobs', lease=0)
+    expired.requeue_stale()
+    current, _ = store.claim(1)
+    path = claimed[0][2]
+
+    # The late worker neither records its result nor removes the image
+    assert store.complete(late, [(job_id, 0, [1.0])], []) == 0
+    assert Path(path).exists()
+    assert store.complete(current, [], [(job_id, 0, 'broken')]) == 1
+    assert not Path(path).exists()
+    assert store.results(job_id)[0]['status'] == 'failed'
+
+
+def test_renewed_claims_are_not_requeued(tmp_path):
+    store, _, _ = make_store(tmp_path, n=2)
+    claim, _ = store.claim(1)
+    store.claim(1)
+    time.sleep(0.2)
+
+    store.renew([claim])
+
+    assert JobStore(tmp_path / 'jobs', lease=0.1).requeue_stale() == 1
+
+
+def test_store_without_leases_is_migrated(tmp_path):
+    root = tmp_path / 'jobs'
+    root.mkdir()
+    with sqlite3.connect(root / 'jobs.sqlite') as conn:
+        conn.executescript(
+            'CREATE TABLE items (job_id TEXT NOT NULL, idx INTEGER NOT NULL, '
+            'filename TEXT NOT NULL, path TEXT NOT NULL, status TEXT NOT NULL, '
+            'result TEXT, error TEXT, PRIMARY KEY (job_id, idx));'
+            "INSERT INTO items VALUES ('old', 0, 'a.jpg', 'a', 'running', NULL, NULL);"
+        )
+    conn.close()
+
+    assert JobStore(root).requeue_stale() == 1
+
+
+def test_worker_survives_failed_completion(tmp_path):
+    store, _, _ = make_store(tmp_path, n=1)
+    pool = JobWorkerPool(store, {'transform': None}, poll_interval=0.05)
+    error = sqlite3.OperationalError('database is locked')
+
+    with patch.object(store, 'complete', side_effect=error) as complete:
+        pool.start()
+        for _ in range(50):
+            if complete.call_count >= 2:
+                break
+            time.sleep(0.05)
+        alive = all(thread.is_alive() for thread in pool._threads)
+        pool.stop()
+
+    # Undecodable upload, then the failure record of the batch
+    assert complete.call_count >= 2
+    assert alive
+
+
+def test_results_in_order(tmp_path):
+    store, job_id, _ = make_store(tmp_path, n=3)
+
+    claim, claimed = store.claim(3)
+    store.complete(
+        claim,
+        [(j, i, [0.5, 0.5]) for j, i, _ in claimed[1:]],
+        [(claimed[0][0], claimed[0][1], 'broken')],
+    )
+    results = store.results(job_id)
+
+    assert store.status(job_id)['status'] == 'completed'
+    assert [r['index'] for r in results] == [0, 1, 2]
+    assert results[0]['status'] == 'failed'
+    assert results[1]['probabilities'] == [0.5, 0.5]
+
+
+def test_unknown_job(tmp_path):
+    store = JobStore(tmp_path / 'jobs')
+
+    assert store.status('nope') is None
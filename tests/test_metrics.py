@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from sklearn.metrics import classification_report, confusion_matrix
+import torch
+
+from skin_disease_recognition.modeling.metrics import (
+    classification_report_from_confusion,
+    update_confusion_matrix,
+)
+
+
+@pytest.fixture
+def predictions():
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 4, 200)
+    y_pred = np.where(rng.random(200) < 0.7, y_true, rng.integers(0, 4, 200))
+    return y_true, y_pred
+
+
+def test_confusion_matrix_matches_sklearn(predictions):
+    y_true, y_pred = predictions
+    matrix = torch.zeros((4, 4), dtype=torch.int64)
+    for start in range(0, 200, 32):
+        update_confusion_matrix(
+            matrix,
+            torch.from_numpy(y_true[start : start + 32]),
+            torch.from_numpy(y_pred[start : start + 32]),
+        )
+
+    np.testing.assert_array_equal(matrix.numpy(), confusion_matrix(y_true, y_pred))
+
+
+def test_report_matches_sklearn(predictions):
+    y_true, y_pred = predictions
+    classes = ['a', 'b', 'c', 'd']
+    expected = classification_report(
+        y_true, y_pred, target_names=classes, output_dict=True
+    )
+    report = classification_report_from_confusion(
+        confusion_matrix(y_true, y_pred), classes
+    )
+
+    assert report.keys() == expected.keys()
+    assert report['accuracy'] == pytest.approx(expected['accuracy'])
+    for key in [*classes, 'macro avg', 'weighted avg']:
+        assert report[key] == pytest.approx(expected[key])
+
+
+def test_report_class_never_predicted():
+    matrix = np.array([[3, 0], [2, 0]])
+    report = classification_report_from_confusion(matrix, ['a', 'b'])
+
+    assert report['b']['precision'] == 0.0
+    assert report['b']['f1-score'] == 0.0
+    assert report['b']['support'] == 2.0
+    assert report['accuracy'] == pytest.approx(0.6)
@@ -0,0 +1,115 @@
+import numpy as np
+from PIL import Image
+import pytest
+
+from skin_disease_recognition.serving.build_reference import build_reference
+from skin_disease_recognition.serving.monitoring import (
+    DriftMonitor,
+    RollingDriftMonitor,
+    histogram_quantiles,
+    image_stats,
+    psi,
+)
+
+
+def test_image_stats_subsamples():
+    image = np.zeros((600, 400, 3), dtype=np.uint8)
+    image[..., 0] = 200
+
+    height, width, means = image_stats(image)
+
+    assert (height, width) == (600, 400)
+    np.testing.assert_allclose(means, [200, 0, 0])
+
+
+def test_histogram_quantiles():
+    counts = np.zeros(10)
+    counts[9] = 4
+
+    assert histogram_quantiles(counts, (0.5,)) == [pytest.approx(0.95)]
+    assert histogram_quantiles(np.zeros(10), (0.5,)) == [None]
+
+
+def test_psi():
+    counts = np.array([10, 20, 30])
+
+    assert psi(counts, counts * 3) == pytest.approx(0.0)
+    assert psi(counts, counts[::-1]) > 0.25
+    assert psi(counts, np.zeros(3)) is None
+
+
+def test_monitor_memory_is_bounded():
+    monitor = DriftMonitor(['a', 'b'])
+    image = np.full((300, 200, 3), 100, dtype=np.uint8)
+
+    for _ in range(1000):
+        monitor.update(image, np.array([0.2, 0.8]))
+
+    assert monitor.count == 1000
+    assert monitor.predictions == [0, 1000]
+    assert monitor.confidence[80] == 1000
+    assert len(monitor.confidence) == 100
+    assert [len(counts) for counts in monitor.colors] == [16] * 3
+
+    summary = monitor.summary()
+    assert summary['predictions'] == {'a': 0.0, 'b': 1.0}
+    assert summary['min_side']['<256'] == 1.0
+    assert summary['confidence_quantiles']['p50'] == pytest.approx(0.805)
+
+    monitor.reset()
+    assert monitor.count == 0
+    assert sum(monitor.predictions) == 0
+
+
+def test_compare_flags_drift(tmp_path):
+    reference = DriftMonitor(['a', 'b'])
+    live = DriftMonitor(['a', 'b'])
+    dark = np.zeros((100, 100, 3), dtype=np.uint8)
+    for i in range(100):
+        reference.update(dark, np.array([0.9, 0.1]) if i % 2 else np.array([0.1, 0.9]))
+        live.update(dark + 200, np.array([0.9, 0.1]))
+
+    reference.save(tmp_path)
+    loaded = DriftMonitor.load(tmp_path)
+    assert loaded.state() == reference.state()
+
+    drift = live.compare(loaded)
+    assert drift['psi']['min_side'] == pytest.approx(0.0)
+    assert 'predictions' in drift['drifted']
+    assert 'color_r' in drift['drifted']
+    assert 'min_side' not in drift['drifted']
+
+
+def test_rolling_monitor_forgets_old_traffic():
+    reference = DriftMonitor(['a', 'b'])
+    monitor = RollingDriftMonitor(['a', 'b'], window=100)
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    for _ in range(100):
+        reference.update(image, np.array([0.9, 0.1]))
+    for _ in range(1000):
+        monitor.update(image, np.array([0.9, 0.1]))
+    assert monitor.compare(reference)['drifted'] == []
+
+    for _ in range(200):
+        monitor.update(image, np.array([0.1, 0.9]))
+
+    summary = monitor.summary()
+    assert summary['total'] == 1200
+    assert summary['count'] == 200
+    assert summary['predictions'] == {'a': 0.0, 'b': 1.0}
+    assert 'predictions' in monitor.compare(reference)['drifted']
+
+
+def test_build_reference(temp_model_dir, sample_classes, tmp_path):
+    data_dir = tmp_path / 'test'
+    for name in sample_classes:
+        (data_dir / name).mkdir(parents=True)
+        Image.new('RGB', (80, 60), color=(10, 20, 30)).save(data_dir / name / 'a.jpg')
+
+    (temp_model_dir / 'class_names.txt').write_text('\n'.join(sorted(sample_classes)))
+
+    reference = build_reference(temp_model_dir, data_dir, 'cpu', num_workers=0)
+
+    assert reference.count == len(sample_classes)
+    assert reference.sizes[0] == len(sample_classes)
+    assert DriftMonitor.load(temp_model_dir).state() == reference.state()
@@ -0,0 +1,90 @@
+import json
+import shutil
+
+import pytest
+import torch
+from torch import nn
+from torchvision.models import efficientnet_b0, resnet18
+
+from skin_disease_recognition.serving.loading import load_artifacts
+from skin_disease_recognition.serving.optimize_export import (
+    FoldedInputConv,
+    fuse_batch_norm,
+    optimize_export,
+    optimize_model,
+)
+from skin_disease_recognition.serving.preprocessing import make_transform
+
+
+def random_model(factory):
+    torch.manual_seed(0)
+    model = factory(weights=None, num_classes=5)
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 1.5)
+    return model.eval()
+
+
+@pytest.fixture
+def image():
+    return torch.randint(0, 256, (64, 64, 3), dtype=torch.uint8).numpy()
+
+
+@pytest.mark.parametrize('factory', [resnet18, efficientnet_b0])
+@pytest.mark.parametrize('input_format', ['uint8', 'unit'])
+def test_optimized_model_matches_original(factory, input_format, image):
+    model = random_model(factory)
+    x = make_transform(64)(image=image)['image'][None]
+    with torch.no_grad():
+        expected = model(x)
+
+        optimize_model(model, 64, input_format)
+        raw = make_transform(64, input_format)(image=image)['image'][None]
+        actual = model(raw)
+
+    assert not any(isinstance(m, nn.BatchNorm2d) for m in model.modules())
+    torch.testing.assert_close(actual, expected, rtol=1e-3, atol=1e-3)
+
+
+def test_other_input_size_recomputes_border(image):
+    model = random_model(resnet18)
+    x = make_transform(48)(image=image)['image'][None]
+    with torch.no_grad():
+        expected = model(x)
+        optimize_model(model, 64, 'uint8')
+        actual = model(make_transform(48, 'uint8')(image=image)['image'][None])
+
+    torch.testing.assert_close(actual, expected, rtol=1e-3, atol=1e-3)
+
+
+def test_fuse_counts_pairs():
+    model = random_model(resnet18)
+
+    # Stem, 2 per basic block, 3 downsample branches
+    assert fuse_batch_norm(model) == 1 + 2 * 8 + 3
+
+
+def test_optimize_export_folder(temp_model_dir, tmp_path):
+    source = tmp_path / 'resnet'
+    shutil.copytree(temp_model_dir, source)
+    torch.save(random_model(resnet18), source / 'model.pth')
+    (source / 'model_data.json').write_text(
+        json.dumps({'model_name': 'RESNET18', 'version': 1, 'image_size': 32})
+    )
+
+    result = optimize_export(source, tmp_path / 'resnet-opt', 'cpu')
+    loaded = load_artifacts(tmp_path / 'resnet-opt', 'cpu')
+
+    assert result['max_prob_diff'] < 1e-3
+    assert loaded['metadata']['input_format'] == 'uint8'
+    assert isinstance(loaded['model'].conv1, FoldedInputConv)
+    assert loaded['classes'] == (source / 'class_names.txt').read_text().split()
+    with pytest.raises(ValueError, match='already optimized'):
+        optimize_export(tmp_path / 'resnet-opt', tmp_path / 'again', 'cpu')
+
+
+def test_model_without_conv_rejected():
+    with pytest.raises(ValueError, match='No convolution'):
+        optimize_model(nn.Sequential(nn.Flatten(), nn.Linear(4, 2)), 32, 'uint8')
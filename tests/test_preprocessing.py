@@ -91,3 +91,17 @@ def test_make_transform_normalizes(sample_image_numpy):
 
     assert result['image'].min() >= -3.0
     assert result['image'].max() <= 3.0
+
+
+def test_make_transform_raw_input_formats(sample_image_numpy):
+    uint8 = make_transform(224, 'uint8')(image=sample_image_numpy)['image']
+    unit = make_transform(224, 'unit')(image=sample_image_numpy)['image']
+
+    assert uint8.dtype == torch.uint8
+    assert unit.dtype == torch.float32
+    torch.testing.assert_close(unit, uint8.float() / 255)
+
+
+def test_make_transform_unknown_format():
+    with pytest.raises(ValueError, match='Unknown input format'):
+        make_transform(224, 'bgr')
@@ -0,0 +1,59 @@
+import json
+
+import torch
+import torch.nn as nn
+
+from skin_disease_recognition.modeling.profiling import TraceProfiler
+from skin_disease_recognition.serving.app import make_runner
+from skin_disease_recognition.serving.profiling import RequestProfiler
+from skin_disease_recognition.serving.scheduler import InferenceScheduler
+
+
+def test_trace_profiler_schedule(tmp_path):
+    profiler = TraceProfiler(
+        'train', tmp_path, 'cpu', wait=1, warmup=1, active=2, record_shapes=False
+    )
+    profiler.start()
+    for _ in range(6):
+        torch.randn(32, 32) @ torch.randn(32, 32)
+        profiler.step()
+    profiler.stop()
+
+    assert profiler.done
+    assert (tmp_path / 'train_trace.json').exists()
+    assert 'aten::mm' in (tmp_path / 'train_ops.txt').read_text()
+
+
+def test_trace_profiler_captures_once(tmp_path):
+    profiler = TraceProfiler('evaluate', tmp_path, 'cpu')
+    profiler.start()
+    torch.ones(4).sum()
+    profiler.stop()
+    profiler.start()
+
+    assert not profiler.running
+    assert profiler.files == [
+        tmp_path / 'evaluate_trace.json',
+        tmp_path / 'evaluate_ops.txt',
+    ]
+
+
+def test_request_profiler_records_scheduler_workers(tmp_path):
+    model = nn.Sequential(nn.Conv2d(3, 4, 3), nn.Flatten()).eval()
+    scheduler = InferenceScheduler(
+        {'default': make_runner('default', model, 'cpu')}, num_workers=1, reserved=0
+    )
+    scheduler.start()
+    profiler = RequestProfiler(tmp_path, 'cpu')
+    try:
+        profiler.arm(1)
+        with profiler.record():
+            scheduler.submit(torch.randn(1, 3, 8, 8), 'interactive').result(5)
+    finally:
+        scheduler.stop()
+
+    events = json.loads((tmp_path / f'{profiler.profiler.name}_trace.json').read_text())
+    names = {event['name'] for event in events['traceEvents']}
+    assert not profiler.active
+    assert 'default' in names
+    assert 'aten::conv2d' in names
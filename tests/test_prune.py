@@ -0,0 +1,65 @@
+import pytest
+import torch
+from torch import nn
+from torchvision.models import efficientnet_b0, resnet18, resnet50
+
+from skin_disease_recognition.modeling.prune import (
+    count_parameters,
+    keep_count,
+    prune_model,
+)
+
+
+@pytest.mark.parametrize(
+    'channels, amount, expected',
+    [(64, 0.3, 48), (64, 0.0, 64), (16, 0.9, 8), (100, 0.5, 48)],
+)
+def test_keep_count(channels, amount, expected):
+    assert keep_count(channels, amount) == expected
+
+
+@pytest.mark.parametrize('factory', [resnet18, resnet50, efficientnet_b0])
+def test_pruned_model_keeps_output_shape(factory):
+    model = factory(weights=None, num_classes=5).eval()
+    params = count_parameters(model)
+
+    prune_model(model, 0.5)
+    out = model(torch.randn(2, 3, 64, 64))
+
+    assert out.shape == (2, 5)
+    assert count_parameters(model) < params
+
+
+def test_pruning_zero_scale_channels_keeps_outputs():
+    torch.manual_seed(0)
+    model = resnet18(weights=None, num_classes=5).eval()
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+    # Half of the inner channels do nothing, so removing them is lossless
+    for layer in (model.layer1, model.layer2, model.layer3, model.layer4):
+        for block in layer:
+            half = block.bn1.num_features // 2
+            block.bn1.weight.data[:half] = 0
+            block.bn1.bias.data[:half] = 0
+    x = torch.randn(2, 3, 64, 64)
+    with torch.no_grad():
+        expected = model(x)
+
+        prune_model(model, 0.5)
+        actual = model(x)
+
+    assert model.layer1[0].conv1.out_channels == 32
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('amount', [-0.1, 1.0])
+def test_invalid_amount(amount):
+    with pytest.raises(ValueError, match='amount'):
+        prune_model(resnet18(weights=None), amount)
+
+
+def test_unsupported_model():
+    with pytest.raises(ValueError, match='not supported'):
+        prune_model(nn.Linear(4, 2), 0.3)
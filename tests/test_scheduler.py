@@ -0,0 +1,208 @@
+from concurrent.futures import CancelledError
+import threading
+import time
+
+from fastapi import HTTPException
+import numpy as np
+import pytest
+import torch
+
+from skin_disease_recognition.serving.deadlines import DropCounter, RequestDeadline
+from skin_disease_recognition.serving.scheduler import InferenceScheduler
+
+
+def images(n=1):
+    return torch.zeros(n, 3, 4, 4)
+
+
+class RecordingRunner:
+    def __init__(self, num_classes=3):
+        self.num_classes = num_classes
+        self.batch_sizes = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, batch):
+        self.release.wait(5)
+        self.batch_sizes.append(len(batch))
+        return np.full((len(batch), self.num_classes), 1 / self.num_classes)
+
+
+@pytest.fixture
+def runner():
+    return RecordingRunner()
+
+
+def test_weighted_round_robin(runner):
+    scheduler = InferenceScheduler(
+        {'default': runner}, weights={'interactive': 4, 'bulk': 1}
+    )
+    for _ in range(10):
+        scheduler.submit(images(), 'interactive')
+        scheduler.submit(images(), 'bulk')
+
+    picks = [scheduler._pick_lane(('interactive', 'bulk')) for _ in range(10)]
+
+    assert picks.count('interactive') == 8
+    assert picks.count('bulk') == 2
+
+
+def test_requests_are_batched_per_model(runner):
+    scheduler = InferenceScheduler({'default': runner, 'cascade': runner}, max_batch=4)
+    for model in ('default', 'default', 'default', 'cascade'):
+        scheduler.submit(images(), 'bulk', model=model)
+    scheduler.submit(images(4), 'bulk', model='cascade')
+
+    sizes = [len(scheduler._take_batch('bulk')) for _ in range(3)]
+
+    assert sizes == [3, 1, 1]
+
+
+def test_results_split_per_request(runner):
+    scheduler = InferenceScheduler({'default': runner})
+    scheduler.start()
+    try:
+        futures = [scheduler.submit(images(n), 'interactive') for n in (1, 2)]
+        shapes = [f.result(5).shape for f in futures]
+    finally:
+        scheduler.stop()
+
+    assert shapes == [(1, 3), (2, 3)]
+    stats = scheduler.stats()['interactive']
+    assert stats['served'] == 2
+    assert stats['images'] == 3
+    assert stats['latency_ms_p95'] is not None
+
+
+def test_reserved_worker_serves_interactive_during_bulk(runner):
+    runner.release.clear()
+    scheduler = InferenceScheduler({'default': runner}, num_workers=2, reserved=1)
+    scheduler.start()
+    try:
+        bulk = scheduler.submit(images(), 'bulk')
+        time.sleep(0.1)
+        # The shared worker is stuck on bulk, the reserved one is free
+        assert scheduler.stats()['bulk']['queue_depth'] == 0
+        interactive = scheduler.submit(images(), 'interactive')
+        time.sleep(0.1)
+        assert scheduler.stats()['interactive']['queue_depth'] == 0
+        runner.release.set()
+        interactive.result(5)
+        bulk.result(5)
+    finally:
+        runner.release.set()
+        scheduler.stop()
+
+
+def test_reserved_interactive_workers_only_wait_for_interactive(runner):
+    runner.release.clear()
+    scheduler = InferenceScheduler(
+        {'default': runner}, num_workers=2, reserved=1, max_batch=1
+    )
+    scheduler.start()
+    try:
+        for _ in range(3):
+            scheduler.submit(images(), 'bulk')
+        time.sleep(0.1)
+
+        # One bulk batch runs, the rest waits: the reserved worker ignores it
+        assert scheduler.stats()['bulk']['queue_depth'] == 2
+    finally:
+        runner.release.set()
+        scheduler.stop()
+
+
+def test_expired_and_cancelled_work_is_dropped(runner):
+    drops = DropCounter()
+    expired = RequestDeadline(None, 1, drops, received_at=time.monotonic() - 1)
+    scheduler = InferenceScheduler({'default': runner})
+    late = scheduler.submit(images(), 'interactive', deadline=expired)
+    abandoned = scheduler.submit(
+        images(), 'interactive', deadline=RequestDeadline(None, None, drops)
+    )
+    abandoned.cancel()
+    scheduler.start()
+    try:
+        with pytest.raises(HTTPException):
+            late.result(5)
+        with pytest.raises(CancelledError):
+            abandoned.result(5)
+        scheduler.submit(images(), 'interactive').result(5)
+    finally:
+        scheduler.stop()
+
+    assert runner.batch_sizes == [1]
+    assert scheduler.stats()['interactive']['dropped'] == 2
+    assert drops.snapshot() == {
+        'expired': {'batch': 1},
+        'disconnected': {'batch': 1},
+    }
+
+
+def test_single_worker_serves_both_lanes(runner):
+    scheduler = InferenceScheduler({'default': runner}, num_workers=1, reserved=1)
+    scheduler.start()
+    try:
+        scheduler.submit(images(), 'bulk').result(5)
+    finally:
+        scheduler.stop()
+
+    assert scheduler.reserved == 0
+
+
+def test_large_submissions_are_split(runner):
+    scheduler = InferenceScheduler({'default': runner}, max_batch=4)
+    scheduler.start()
+    try:
+        probs = scheduler.submit(images(10), 'bulk').result(5)
+    finally:
+        scheduler.stop()
+
+    assert probs.shape == (10, 3)
+    assert sorted(runner.batch_sizes) == [2, 4, 4]
+
+
+def test_forward_time_excludes_queue_wait():
+    def slow(batch):
+        time.sleep(0.05)
+        return np.zeros((len(batch), 3))
+
+    scheduler = InferenceScheduler(
+        {'default': slow}, num_workers=1, reserved=0, max_batch=1
+    )
+    scheduler.start()
+    try:
+        futures = [scheduler.submit(images(n), 'bulk') for n in (1, 1, 2)]
+        for future in futures:
+            future.result(5)
+    finally:
+        scheduler.stop()
+
+    # The second request waited for the first forward pass as well
+    assert 50 <= futures[1].forward_ms < 100
+    # Split submissions add up the passes of their parts
+    assert futures[2].forward_ms >= 100
+
+
+def test_cancelled_split_submission_drops_queued_parts(runner):
+    scheduler = InferenceScheduler({'default': runner}, max_batch=2)
+    future = scheduler.submit(images(6), 'bulk')
+    future.cancel()
+    scheduler.start()
+    try:
+        scheduler.submit(images(), 'bulk').result(5)
+    finally:
+        scheduler.stop()
+
+    assert runner.batch_sizes == [1]
+    assert scheduler.stats()['bulk']['dropped'] == 3
+
+
+def test_invalid_configuration(runner):
+    with pytest.raises(ValueError, match='worker'):
+        InferenceScheduler({'default': runner}, num_workers=0, reserved=0)
+    scheduler = InferenceScheduler({'default': runner})
+    with pytest.raises(ValueError, match='lane'):
+        scheduler.submit(images(), 'batch')
+    with pytest.raises(ValueError, match='model'):
+        scheduler.submit(images(), 'bulk', model='cascade')
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+from skin_disease_recognition.data.dataset import SkinDataset
+from skin_disease_recognition.serving.preprocessing import make_transform
+from skin_disease_recognition.serving.similarity import SimilarityIndex, embed_loader
+
+
+@pytest.fixture
+def random_index():
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((100, 16)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    labels = [i % 3 for i in range(100)]
+    paths = [f'img_{i}.jpg' for i in range(100)]
+    return SimilarityIndex(embeddings.astype(np.float16), labels, paths)
+
+
+def test_query_finds_itself(random_index):
+    result = random_index.query(random_index.matrix[42], k=5)
+
+    assert result[0][0] == 42
+    assert result[0][1] == pytest.approx(1.0, abs=1e-3)
+
+
+def test_query_sorted_by_similarity(random_index):
+    scores = [score for _, score in random_index.query(random_index.matrix[0], k=10)]
+
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_query_k_larger_than_index(random_index):
+    assert len(random_index.query(random_index.matrix[0], k=500)) == 100
+
+
+def test_query_matches_brute_force(random_index):
+    query = np.random.default_rng(1).standard_normal(16)
+    scores = random_index.matrix @ (query / np.linalg.norm(query))
+
+    rows = [row for row, _ in random_index.query(query, k=5)]
+
+    assert rows == list(np.argsort(-scores)[:5])
+
+
+def test_save_and_load(random_index, tmp_path):
+    random_index.save(tmp_path)
+    loaded = SimilarityIndex.load(tmp_path)
+
+    assert np.load(tmp_path / 'embeddings.npy').dtype == np.float16
+    assert len(loaded) == len(random_index)
+    assert loaded.paths == random_index.paths
+
+
+def test_similar_cases_labels(random_index):
+    cases = random_index.similar_cases(random_index.matrix[4], 1, ['a', 'b', 'c'])
+
+    assert cases[0]['label'] == 'b'
+    assert cases[0]['path'] == 'img_4.jpg'
+
+
+def test_mismatched_lengths_raise():
+    with pytest.raises(ValueError):
+        SimilarityIndex(np.zeros((3, 4)), [0, 1], ['a', 'b', 'c'])
+
+
+def test_embed_loader(temp_image_folder, mock_model):
+    dataset = SkinDataset(str(temp_image_folder), transform=make_transform(32))
+    embeddings = embed_loader(mock_model, DataLoader(dataset, batch_size=4), 'cpu')
+
+    assert embeddings.shape == (9, 8)
+    assert embeddings.dtype == np.float16
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-2)
@@ -0,0 +1,35 @@
+import pytest
+
+from skin_disease_recognition.modeling.stopping import EarlyStopping
+
+
+def test_stops_after_patience_without_f1_improvement():
+    stopper = EarlyStopping(monitor='f1', patience=2, min_delta=0.01)
+
+    assert not stopper.step({'f1': 0.5})
+    assert not stopper.step({'f1': 0.505})
+    assert stopper.step({'f1': 0.509})
+
+
+def test_improvement_resets_patience():
+    stopper = EarlyStopping(monitor='f1', patience=2)
+
+    stopper.step({'f1': 0.5})
+    stopper.step({'f1': 0.4})
+    assert not stopper.step({'f1': 0.6})
+    assert not stopper.step({'f1': 0.6})
+    assert stopper.step({'f1': 0.6})
+
+
+def test_validation_loss_is_minimized():
+    stopper = EarlyStopping(monitor='validation_loss', patience=1)
+
+    assert not stopper.step({'validation_loss': 1.0})
+    assert not stopper.step({'validation_loss': 0.8})
+    assert stopper.step({'validation_loss': 0.9})
+    assert stopper.best == 0.8
+
+
+def test_unknown_metric_raises():
+    with pytest.raises(ValueError):
+        EarlyStopping(monitor='accuracy_top5')
@@ -0,0 +1,48 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from skin_disease_recognition.serving.streaming import (
+    LatestFrame,
+    Smoother,
+    stream_message,
+)
+
+
+def test_latest_frame_drops_stale_frames():
+    async def run():
+        frames = LatestFrame()
+        assert not frames.put(b'1')
+        assert frames.put(b'2')
+        assert frames.put(b'3')
+        newest = await frames.get()
+        frames.put(b'4')
+        frames.close()
+        return newest, await frames.get(), frames.dropped
+
+    newest, after_close, dropped = asyncio.run(run())
+
+    assert newest == (3, b'3')
+    assert after_close is None
+    assert dropped == 2
+
+
+def test_smoother():
+    smoother = Smoother(0.5)
+
+    np.testing.assert_allclose(smoother.update(np.array([1.0, 0.0])), [1.0, 0.0])
+    np.testing.assert_allclose(smoother.update(np.array([0.0, 1.0])), [0.5, 0.5])
+    np.testing.assert_allclose(smoother.update(np.array([0.0, 1.0])), [0.25, 0.75])
+    assert Smoother(0.0).update(np.array([0.2, 0.8])).tolist() == [0.2, 0.8]
+
+
+def test_stream_message_top_k():
+    message = stream_message(7, np.array([0.1, 0.6, 0.3]), ['a', 'b', 'c'], 2, 1, 5.0)
+
+    assert message == {
+        'frame': 7,
+        'predictions': {'b': pytest.approx(0.6), 'c': pytest.approx(0.3)},
+        'dropped': 1,
+        'latency_ms': 5.0,
+    }
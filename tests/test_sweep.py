@@ -0,0 +1,48 @@
+import cv2
+
+from skin_disease_recognition.modeling.sweep import (
+    prepare_resized_dataset,
+    should_prune,
+)
+
+
+def test_prune_below_median():
+    curves = {
+        'a': [0.5, 0.6, 0.7],
+        'b': [0.4, 0.55, 0.65],
+        'c': [0.1, 0.2, 0.25],
+    }
+
+    assert should_prune(curves, 'c', grace_epochs=1)
+    assert not should_prune(curves, 'a', grace_epochs=1)
+
+
+def test_no_prune_during_grace_period():
+    curves = {'a': [0.9], 'b': [0.8], 'c': [0.1]}
+
+    assert not should_prune(curves, 'c', grace_epochs=1)
+
+
+def test_no_prune_without_enough_peers():
+    curves = {'a': [0.9, 0.9, 0.9], 'b': [0.1, 0.1, 0.1], 'c': [0.5]}
+
+    assert not should_prune(curves, 'b', grace_epochs=1)
+
+
+def test_prune_compares_same_epoch():
+    curves = {
+        'a': [0.2, 0.3, 0.9],
+        'b': [0.2, 0.3, 0.9],
+        'c': [0.35, 0.35],
+    }
+
+    assert not should_prune(curves, 'c', grace_epochs=1)
+
+
+def test_resized_dataset(temp_image_folder, tmp_path):
+    dst = prepare_resized_dataset(temp_image_folder, tmp_path / 'resized', 32, 2)
+    images = sorted(dst.rglob('*.jpg'))
+
+    assert len(images) == 9
+    assert cv2.imread(str(images[0])).shape == (32, 32, 3)
+    assert (dst / 'class_a').is_dir()
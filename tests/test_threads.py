@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from skin_disease_recognition.serving.threads import (
+    configure_torch_threads,
+    plan_threads,
+)
+
+
+def test_single_mode_uses_all_worker_cpus():
+    assert plan_threads('single', workers=1, cpus=8) == (8, 1)
+
+
+def test_cpus_split_between_workers():
+    intra, _ = plan_threads('single', workers=4, cpus=8)
+
+    assert intra == 2
+
+
+def test_batch_mode_splits_threads():
+    assert plan_threads('batch', workers=1, cpus=8) == (4, 2)
+
+
+def test_plan_never_below_one_thread():
+    assert plan_threads('batch', workers=16, cpus=2) == (1, 1)
+
+
+def test_unknown_mode_raises():
+    with pytest.raises(ValueError, match='Unknown serving mode'):
+        plan_threads('stream', workers=1, cpus=4)
+
+
+def test_env_override_wins():
+    previous = torch.get_num_threads()
+    settings = configure_torch_threads('single', workers=1, num_threads=1)
+
+    assert settings['num_threads'] == 1
+    assert torch.get_num_threads() == 1
+    torch.set_num_threads(previous)
@@ -5,6 +5,7 @@ from unittest.mock import MagicMock
 import numpy as np
 import torch
 
+from skin_disease_recognition.utils.resources import available_cpus, cgroup_cpu_quota
 from skin_disease_recognition.utils.seeding import seed_everything
 
 
@@ -92,3 +93,31 @@ def test_tensor_reproducibility():
     t2 = torch.randn(10, 10)
 
     assert torch.allclose(t1, t2)
+
+
+def test_cgroup_v2_quota(tmp_path):
+    (tmp_path / 'cpu.max').write_text('250000 100000\n')
+
+    assert cgroup_cpu_quota(tmp_path) == 2.5
+    assert available_cpus(tmp_path) <= 3
+
+
+def test_cgroup_v2_unlimited(tmp_path):
+    (tmp_path / 'cpu.max').write_text('max 100000\n')
+
+    assert cgroup_cpu_quota(tmp_path) is None
+
+
+def test_cgroup_v1_quota(tmp_path):
+    cpu_dir = tmp_path / 'cpu'
+    cpu_dir.mkdir()
+    (cpu_dir / 'cpu.cfs_quota_us').write_text('100000\n')
+    (cpu_dir / 'cpu.cfs_period_us').write_text('100000\n')
+
+    assert cgroup_cpu_quota(tmp_path) == 1.0
+    assert available_cpus(tmp_path) == 1
+
+
+def test_no_cgroup_uses_affinity(tmp_path):
+    assert cgroup_cpu_quota(tmp_path) is None
+    assert available_cpus(tmp_path) >= 1